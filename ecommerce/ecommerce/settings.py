@@ -75,6 +75,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Cart settings
 CART_SESSION_ID = 'cart'
+# Where signed-in customers' carts are kept; None keeps them in the session
+CART_USER_BACKEND = 'shop.cart.DatabaseCart'
 
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -102,7 +104,10 @@ EMAIL_NOTIFICATIONS = {
 }
 
 # Low stock threshold for notifications
-LOW_STOCK_THRESHOLD = 5  # Send alert when stock falls below this number
+LOW_STOCK_THRESHOLD = 5  # Alert when stock falls to this number or below
+
+# How long opening checkout sets the cart's stock aside for the customer
+STOCK_HOLD_SECONDS = 10 * 60
 
 # Site URL for email links
 SITE_URL = 'http://localhost:8000'  # Change in production
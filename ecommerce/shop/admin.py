@@ -1,5 +1,8 @@
+from django import forms
 from django.contrib import admin
-from .models import Category, Brand, Product, ProductImage
+from django.utils import timezone
+from .inventory import shard_stock, with_on_hand
+from .models import Category, Brand, OutgoingEmail, Product, ProductImage, StockMovement
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -15,11 +18,61 @@ class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1
 
+class ProductAdminForm(forms.ModelForm):
+    """
+    Edits a sharded product's stock from its shards' sum rather than the
+    Product.stock last synced from them, so the field shows the real
+    figure and saving compares against it
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        product = self.instance
+        if product.pk and product.stock_shards:
+            on_hand = getattr(product, 'on_hand', None)
+            product.stock = shard_stock(product.pk) if on_hand is None else on_hand
+            product.tracker.set_saved_fields(fields=['stock'])
+            self.initial['stock'] = product.stock
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
+    form = ProductAdminForm
     list_display = ['name', 'price', 'category', 'brand', 'stock', 'available', 'featured', 'created_at']
     list_filter = ['available', 'featured', 'category', 'brand', 'created_at']
     list_editable = ['price', 'stock', 'available', 'featured']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductImageInline]
     search_fields = ['name', 'description']
+
+    def get_queryset(self, request):
+        return with_on_hand(super().get_queryset(request))
+
+    def get_changelist_form(self, request, **kwargs):
+        return super().get_changelist_form(request, form=ProductAdminForm, **kwargs)
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['product', 'quantity', 'kind', 'order', 'created_at', 'folded']
+    list_filter = ['kind', 'folded', 'created_at']
+    raw_id_fields = ['product']
+    
+    # The ledger is append-only; corrections are new adjustments
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'last_error']
+    readonly_fields = ['subject', 'body', 'html_body', 'from_email', 'to', 'headers', 'inline_logo',
+                       'attempts', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry']
+    
+    @admin.action(description='Retry selected emails now')
+    def retry(self, request, queryset):
+        queryset.exclude(status=OutgoingEmail.SENT).update(
+            status=OutgoingEmail.PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
@@ -0,0 +1,196 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from django.db import connections
+from django.urls import reverse
+from .models import Brand, Category, Product
+
+# In-process prefix index for the search box typeahead. Every word of a
+# product, brand or category name is stored as a sorted key pointing at
+# the rest of the name from that word on, so "phon" finds "Phone Case" and
+# "bluetooth phon" finds "Bluetooth Phone Case". Lookups are a bisect over
+# the sorted keys and never touch the database. The index is built on
+# first use and patched by the receivers in shop.signals. After MAX_AGE
+# seconds (so other worker processes pick up catalog edits) one background
+# thread rebuilds it while lookups keep being served from the old one.
+
+MAX_AGE = 300
+DEFAULT_LIMIT = 8
+# Cap on keys read for very short prefixes before ranking
+MAX_SCAN = 2000
+
+# Products first, then brands, then categories for equally good matches
+KIND_ORDER = {'product': 0, 'brand': 1, 'category': 2}
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(text):
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def _suggestion(kind, pk, name, slug):
+    if kind == 'product':
+        url = reverse('shop:product_detail', kwargs={'slug': slug})
+    else:
+        url = f"{reverse('shop:product_list')}?{kind}={pk}"
+    return {'type': kind, 'id': pk, 'name': name, 'url': url}
+
+
+class PrefixIndex:
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # Held by whoever is reading the catalog, so only one rebuild runs
+        self._build_lock = threading.Lock()
+        # Changes made while a rebuild reads the catalog, applied after it
+        self._pending = None
+        self._refresh_thread = None
+        self._built_at = None
+        self._keys = []
+        self._entries = []
+        self._documents = {}
+
+    def _loaded(self):
+        return self._built_at is not None and time.monotonic() - self._built_at < self.max_age
+
+    def _documents_from_db(self):
+        documents = {}
+        products = Product.objects.filter(available=True).values_list('pk', 'name', 'slug')
+        for pk, name, slug in products.iterator():
+            documents['product', pk] = _suggestion('product', pk, name, slug)
+        for pk, name, slug in Brand.objects.values_list('pk', 'name', 'slug'):
+            documents['brand', pk] = _suggestion('brand', pk, name, slug)
+        for pk, name, slug in Category.objects.values_list('pk', 'name', 'slug'):
+            documents['category', pk] = _suggestion('category', pk, name, slug)
+        return documents
+
+    @staticmethod
+    def _document_keys(key, document):
+        words = _normalize(document['name']).split()
+        for i in range(len(words)):
+            yield (' '.join(words[i:]), i, KIND_ORDER[document['type']], document['name'].lower(), key)
+
+    def rebuild(self):
+        """Reload every product, brand and category name from the database"""
+        with self._lock:
+            self._pending = []
+        try:
+            documents = self._documents_from_db()
+            entries = sorted(
+                entry for key, document in documents.items()
+                for entry in self._document_keys(key, document)
+            )
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._documents = documents
+            self._entries = entries
+            self._keys = [entry[0] for entry in entries]
+            self._built_at = time.monotonic()
+            pending, self._pending = self._pending, None
+            for change in pending:
+                change()
+
+    def _refresh(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Could not rebuild the autocomplete index')
+        finally:
+            self._build_lock.release()
+            connections.close_all()
+
+    def ensure_loaded(self):
+        """
+        Build the index if it never was; if it is stale, start a rebuild in
+        the background (unless one is running) and keep serving this one
+        """
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.rebuild()
+        elif not self._loaded() and self._build_lock.acquire(blocking=False):
+            self._refresh_thread = threading.Thread(target=self._refresh, name='autocomplete-rebuild', daemon=True)
+            self._refresh_thread.start()
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Up to `limit` suggestions whose name has a word starting with `query`"""
+        prefix = _normalize(query)
+        if not prefix:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            start = bisect_left(self._keys, prefix)
+            matches = []
+            for i in range(start, min(start + MAX_SCAN, len(self._keys))):
+                if not self._keys[i].startswith(prefix):
+                    break
+                matches.append(self._entries[i])
+            documents = self._documents
+        # Matches at the start of the name beat matches on a later word
+        matches.sort(key=lambda entry: entry[1:4])
+        seen = set()
+        results = []
+        for entry in matches:
+            key = entry[4]
+            if key not in seen and key in documents:
+                seen.add(key)
+                results.append(documents[key])
+                if len(results) == limit:
+                    break
+        return results
+
+    def _remove(self, key):
+        document = self._documents.pop(key, None)
+        if document is None:
+            return
+        for entry in self._document_keys(key, document):
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+                del self._keys[i]
+
+    def _update(self, kind, pk, name, slug):
+        key = (kind, pk)
+        self._remove(key)
+        document = _suggestion(kind, pk, name, slug)
+        self._documents[key] = document
+        for entry in self._document_keys(key, document):
+            i = bisect_left(self._entries, entry)
+            self._entries.insert(i, entry)
+            self._keys.insert(i, entry[0])
+
+    def _apply(self, change):
+        # Callers hold the lock. A rebuild in progress may have read the
+        # catalog before this change, so it is applied again after it
+        if self._pending is not None:
+            self._pending.append(change)
+        if self._built_at is not None:
+            change()
+
+    def update(self, kind, pk, name, slug):
+        """Add or replace one name, if the index has been built"""
+        with self._lock:
+            self._apply(lambda: self._update(kind, pk, name, slug))
+
+    def remove(self, kind, pk):
+        """Drop one name, if the index has been built"""
+        with self._lock:
+            self._apply(lambda: self._remove((kind, pk)))
+
+    def clear(self):
+        with self._lock:
+            self._built_at = None
+            self._keys, self._entries, self._documents = [], [], {}
+
+
+index = PrefixIndex()
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    return index.search(query, limit)
@@ -0,0 +1,82 @@
+from django.utils import timezone
+from .models import Product, ProductCard
+
+CARD_UPDATE_FIELDS = [
+    'category', 'brand', 'name', 'slug', 'short_description', 'category_name',
+    'brand_name', 'price', 'original_price', 'discount_percentage', 'image',
+    'image_renditions', 'stock', 'available', 'featured', 'created_at', 'updated_at',
+]
+
+
+def build_card(product):
+    """Flatten a product (with brand and category loaded) into its card row"""
+    return ProductCard(
+        product_id=product.pk,
+        category_id=product.category_id,
+        brand_id=product.brand_id,
+        name=product.name,
+        slug=product.slug,
+        short_description=product.description[:ProductCard._meta.get_field('short_description').max_length],
+        category_name=product.category.name,
+        brand_name=product.brand.name,
+        price=product.price,
+        original_price=product.original_price,
+        discount_percentage=product.discount_percentage,
+        image=product.image.name,
+        image_renditions=product.image_renditions,
+        stock=product.stock,
+        available=product.available,
+        featured=product.featured,
+        created_at=product.created_at,
+        updated_at=timezone.now(),
+    )
+
+
+def refresh_cards(product_ids):
+    """Upsert the cards of the given products: one read, one write"""
+    products = Product.objects.filter(pk__in=list(product_ids)).select_related('brand', 'category')
+    cards = [build_card(product) for product in products]
+    if cards:
+        ProductCard.objects.bulk_create(
+            cards,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=CARD_UPDATE_FIELDS,
+        )
+    return len(cards)
+
+
+def related_product_cards(product, limit=4):
+    """
+    Cards for the product page's related strip: the best available
+    co-purchased neighbours, topped up from the same category when there
+    are fewer than `limit` of them.
+    """
+    cards = list(
+        ProductCard.objects.filter(product__copurchased_with__product=product, available=True)
+        .order_by('-product__copurchased_with__score', 'pk')[:limit]
+    )
+    if len(cards) < limit:
+        cards += ProductCard.objects.filter(
+            category_id=product.category_id,
+            available=True
+        ).exclude(pk__in=[product.pk] + [card.pk for card in cards])[:limit - len(cards)]
+    return cards
+
+
+def rebuild_cards(batch_size=1000):
+    """Rebuild the whole card table from the catalog, batch by batch"""
+    ProductCard.objects.all().delete()
+    products = Product.objects.select_related('brand', 'category').order_by('pk')
+    total = 0
+    batch = []
+    for product in products.iterator(chunk_size=batch_size):
+        batch.append(build_card(product))
+        if len(batch) >= batch_size:
+            ProductCard.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        ProductCard.objects.bulk_create(batch)
+        total += len(batch)
+    return total
@@ -1,6 +1,103 @@
 from decimal import Decimal
+from functools import cached_property
+from typing import NamedTuple
 from django.conf import settings
-from .models import Product
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import CartItem, Product
+
+# The session holds the cart as parallel arrays plus its item count and
+# subtotal,
+#
+#   {'v': 2, 'ids': [3, 7], 'qty': [2, 1], 'price': [1999, 500],
+#    'n': 3, 'sub': 4498}
+#
+# prices in cents, so it stays small, serializes as plain JSON and never
+# carries model instances or Decimals. The count and subtotal are kept up
+# to date by add() and remove(), so the header badge and totals are read
+# without touching the products. Templates and checkout read the lines
+# through CartLine tuples, built once per Cart; changing one of those
+# does not touch the session. Carts stored by older code are converted
+# when they are first read.
+#
+# get_cart() gives every caller in a request the same Cart, and the
+# context processor only builds it when a template uses it. Nothing is
+# written to the session until the first add(), so visitors who only
+# browse never get a session row.
+#
+# Signed-in customers get settings.CART_USER_BACKEND instead, by default
+# DatabaseCart: one CartItem row per line, read with one query when the
+# cart is first used, so add() and remove() write a single row and the
+# cart follows the customer across devices. Quantities are added by the
+# database (quantity = quantity + n), so adds from two tabs or devices at
+# once both count. Whatever was in the session cart is merged into it
+# when they log in (merge_session_cart).
+
+CART_VERSION = 2
+CENT = Decimal('0.01')
+
+
+def to_cents(price):
+    return int(Decimal(price) / CENT)
+
+
+def from_cents(cents):
+    return cents * CENT
+
+
+def _empty():
+    return {'v': CART_VERSION, 'ids': [], 'qty': [], 'price': [], 'n': 0, 'sub': 0}
+
+
+def _upgrade(cart):
+    """Convert a cart stored in an older format, dropping what cannot be read"""
+    upgraded = _empty()
+    if not isinstance(cart, dict):
+        return upgraded
+    if cart.get('v') == 1:
+        lines = zip(cart['ids'], cart['qty'], cart['price'])
+    elif 'v' not in cart:
+        # {product id: {'quantity': 2, 'price': '19.99'}}
+        lines = []
+        for product_id, item in cart.items():
+            try:
+                lines.append((int(product_id), int(item['quantity']), to_cents(item['price'])))
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                continue
+    else:
+        return upgraded
+    for product_id, quantity, cents in lines:
+        upgraded['ids'].append(product_id)
+        upgraded['qty'].append(quantity)
+        upgraded['price'].append(cents)
+        upgraded['n'] += quantity
+        upgraded['sub'] += quantity * cents
+    return upgraded
+
+
+def cart_class(user):
+    """The Cart class for `user`'s cart"""
+    if settings.CART_USER_BACKEND and user is not None and user.is_authenticated:
+        return import_string(settings.CART_USER_BACKEND)
+    return Cart
+
+
+def get_cart(request):
+    """The request's Cart, shared by views and templates"""
+    if not hasattr(request, '_cart'):
+        request._cart = cart_class(getattr(request, 'user', None))(request)
+    return request._cart
+
+
+class CartLine(NamedTuple):
+    """A cart line with its product, as read by templates and checkout"""
+    product: Product
+    quantity: int
+    price: Decimal
+    total_price: Decimal
+
 
 class Cart:
     def __init__(self, request):
@@ -9,70 +106,277 @@ class Cart:
         """
         self.session = request.session
         cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        if cart and cart.get('v') != CART_VERSION:
+            # save the converted cart in the session
+            cart = self.session[settings.CART_SESSION_ID] = _upgrade(cart)
+        # An empty cart is only stored once something is added, so browsing
+        # without one never marks the session modified
+        self.cart = cart or _empty()
+        self._lines = None
+
+    def _index(self, product_id):
+        try:
+            return self.cart['ids'].index(product_id)
+        except ValueError:
+            return None
+
+    def _set(self, product, quantity, override_quantity):
+        """Apply one add() to the stored structure; returns the line's index and quantity change"""
+        index = self._index(product.id)
+        if index is None:
+            self.cart['ids'].append(product.id)
+            self.cart['qty'].append(0)
+            self.cart['price'].append(to_cents(product.price))
+            index = len(self.cart['ids']) - 1
+        change = quantity - self.cart['qty'][index] if override_quantity else quantity
+        self.cart['qty'][index] += change
+        self.cart['n'] += change
+        self.cart['sub'] += change * self.cart['price'][index]
+        return index, change
 
     def add(self, product, quantity=1, override_quantity=False):
         """
         Add a product to the cart or update its quantity.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0,
-                                   'price': str(product.price)}
-        if override_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
+        index, change = self._set(product, quantity, override_quantity)
+        self._store_lines({index: change}, override_quantity)
+
+    def add_many(self, items, override_quantity=False):
+        """
+        Add several (product, quantity) pairs, persisted in one write.
+        """
+        # A product listed twice is one line
+        changes = {}
+        for product, quantity in items:
+            index, change = self._set(product, quantity, override_quantity)
+            changes[index] = changes.get(index, 0) + change
+        if changes:
+            self._store_lines(changes, override_quantity)
+
+    def _store_lines(self, changes, override_quantity):
+        """
+        Persist add(): `changes` maps line indexes to how much their
+        quantity changed. Session carts save the whole cart.
+        """
         self.save()
 
+    def _drop_line(self, product_id):
+        """Persist the removal of a line"""
+        if self.cart['ids']:
+            self.save()
+        else:
+            # An emptied cart is not kept in the session
+            self.clear()
+
     def save(self):
-        # mark the session as "modified" to make sure it gets saved
-        self.session.modified = True
+        # (re)attach the cart, which also marks the session as "modified"
+        self.session[settings.CART_SESSION_ID] = self.cart
+        self._lines = None
 
     def remove(self, product):
         """
         Remove a product from the cart.
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
-            self.save()
+        self.discard(product.id)
 
-    def __iter__(self):
+    def discard(self, product_id):
+        """
+        Remove the line for `product_id`, if there is one, without reading
+        the product.
+        """
+        index = self._index(product_id)
+        if index is not None:
+            self.cart['n'] -= self.cart['qty'][index]
+            self.cart['sub'] -= self.cart['qty'][index] * self.cart['price'][index]
+            for column in ('ids', 'qty', 'price'):
+                del self.cart[column][index]
+            self._drop_line(product_id)
+
+    def quantities(self):
+        """
+        Map product ids to quantities, without reading the products.
+        """
+        return dict(zip(self.cart['ids'], self.cart['qty']))
+
+    def summary(self, product_ids=()):
+        """
+        The count and subtotal, and the lines for `product_ids` still in
+        the cart, as JSON-ready data; reads no products.
         """
-        Iterate over the items in the cart and get the products from the database.
+        lines = []
+        for product_id in product_ids:
+            index = self._index(product_id)
+            if index is not None:
+                price = from_cents(self.cart['price'][index])
+                quantity = self.cart['qty'][index]
+                lines.append({
+                    'product_id': product_id,
+                    'quantity': quantity,
+                    'price': str(price),
+                    'total_price': str(price * quantity),
+                })
+        return {'count': len(self), 'subtotal': str(self.get_total_price()), 'lines': lines}
+
+    def lines(self):
+        """
+        The lines in the cart, reading their products in one query the
+        first time. Lines whose product no longer exists are skipped.
         """
-        product_ids = self.cart.keys()
-        # get the product objects and add them to the cart
-        products = Product.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-        
-        for product in products:
-            cart[str(product.id)]['product'] = product
+        if self._lines is None:
+            products = Product.objects.for_checkout().in_bulk(self.cart['ids'])
+            self._lines = []
+            for product_id, quantity, cents in zip(self.cart['ids'], self.cart['qty'], self.cart['price']):
+                product = products.get(product_id)
+                if product is not None:
+                    price = from_cents(cents)
+                    self._lines.append(CartLine(product, quantity, price, price * quantity))
+        return self._lines
 
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+    def __iter__(self):
+        return iter(self.lines())
 
     def __len__(self):
         """
         Count all items in the cart.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.cart['n']
 
     def get_total_price(self):
         """
         Calculate total cost of the cart
         """
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return from_cents(self.cart['sub'])
 
     def clear(self):
         """
         Remove cart from session
         """
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
\ No newline at end of file
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.cart = _empty()
+        self._lines = None
+
+
+class DatabaseCart(Cart):
+    """
+    A signed-in customer's cart, stored as CartItem rows. Lines are read
+    on first use; add() and remove() write only the line they change.
+    """
+    def __init__(self, request):
+        self.session = request.session
+        self.user = request.user
+        self._lines = None
+
+    @cached_property
+    def cart(self):
+        cart = _empty()
+        rows = CartItem.objects.filter(user=self.user).values_list('product_id', 'quantity', 'price')
+        for product_id, quantity, price in rows:
+            cents = to_cents(price)
+            cart['ids'].append(product_id)
+            cart['qty'].append(quantity)
+            cart['price'].append(cents)
+            cart['n'] += quantity
+            cart['sub'] += quantity * cents
+        return cart
+
+    def _store_lines(self, changes, override_quantity):
+        if override_quantity:
+            # One upsert of the new quantities; the price of a line already
+            # in the cart is kept
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(user=self.user, product_id=self.cart['ids'][index],
+                             quantity=self.cart['qty'][index], price=from_cents(self.cart['price'][index]))
+                    for index in changes
+                ],
+                update_conflicts=True,
+                unique_fields=['user', 'product'],
+                update_fields=['quantity', 'updated_at'],
+            )
+        else:
+            # Lines whose whole quantity is this change were not in the cart
+            _add_to_stored_cart(
+                self.user,
+                {self.cart['ids'][index]: (change, from_cents(self.cart['price'][index]))
+                 for index, change in changes.items()},
+                stored={self.cart['ids'][index] for index, change in changes.items()
+                        if self.cart['qty'][index] != change},
+            )
+        self._lines = None
+
+    def _drop_line(self, product_id):
+        CartItem.objects.filter(user=self.user, product_id=product_id).delete()
+        self._lines = None
+
+    def save(self):
+        self._lines = None
+
+    def clear(self):
+        CartItem.objects.filter(user=self.user).delete()
+        self.cart = _empty()
+        self._lines = None
+
+
+class _Conflict(Exception):
+    """The stored cart changed under _add_to_stored_cart()"""
+
+
+def _add_to_stored_cart(user, lines, stored):
+    """
+    Add `lines` (product id -> (quantity, price)) to `user`'s CartItems,
+    incrementing in the database so concurrent adds are not lost. `stored`
+    are the products expected to have a row already: those are updated in
+    one UPDATE and the rest inserted in one INSERT. If the rows changed
+    meanwhile (another tab added or removed a line), every line gets a row
+    first and is then incremented.
+    """
+    def increment(product_ids):
+        return CartItem.objects.filter(user=user, product_id__in=product_ids).update(
+            quantity=F('quantity') + Case(
+                *[When(product_id=pk, then=Value(lines[pk][0])) for pk in product_ids],
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+
+    existing = [pk for pk in lines if pk in stored]
+    try:
+        with transaction.atomic():
+            if existing and increment(existing) != len(existing):
+                raise _Conflict
+            CartItem.objects.bulk_create([
+                CartItem(user=user, product_id=pk, quantity=quantity, price=price)
+                for pk, (quantity, price) in lines.items() if pk not in stored
+            ])
+    except (_Conflict, IntegrityError):
+        with transaction.atomic():
+            CartItem.objects.bulk_create(
+                [CartItem(user=user, product_id=pk, quantity=0, price=price) for pk, (_, price) in lines.items()],
+                ignore_conflicts=True,
+            )
+            increment(list(lines))
+
+
+def merge_session_cart(request, user):
+    """
+    Add the lines of the session cart to `user`'s stored cart and empty
+    the session cart. Run on login.
+    """
+    store = cart_class(user)
+    if store is Cart or not request.session.get(settings.CART_SESSION_ID):
+        return
+    session_cart = Cart(request)
+    quantities = session_cart.quantities()
+    prices = dict(zip(session_cart.cart['ids'], session_cart.cart['price']))
+    with transaction.atomic():
+        # Products deleted since they were added are dropped
+        live = set(Product.objects.filter(pk__in=list(quantities)).values_list('pk', flat=True))
+        if live:
+            _add_to_stored_cart(
+                user,
+                {pk: (quantity, from_cents(prices[pk])) for pk, quantity in quantities.items() if pk in live},
+                stored=set(CartItem.objects.filter(user=user, product_id__in=live).values_list('product_id', flat=True)),
+            )
+    session_cart.clear()
+    # The request's cart, if already built, was the anonymous one
+    request.__dict__.pop('_cart', None)
@@ -0,0 +1,195 @@
+import hashlib
+import json
+from django.contrib.messages import get_messages
+from django.db import transaction
+from django.db.models import Count, F, Max, Subquery, Value
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .cards import related_product_cards
+from .cart import get_cart
+from .inventory import with_on_hand
+from .models import ContentVersion, Order, Product, ProductCard
+
+# HTTP validators for the catalog and order tracking pages, so repeat
+# visits can be answered with 304 Not Modified before any rendering.
+#
+# Listing pages are validated by the cards they list: the latest
+# ProductCard.updated_at and the number of cards, over the whole catalog
+# for the product list and over one category for a category page. Cards
+# only change when what they render does, so a sale that leaves a product
+# in stock invalidates nothing. Product pages are validated by the
+# product's updated_at, which stock changes and gallery edits move, its
+# stock on hand (a sharded product's shards change without its row), and
+# the ids and latest updated_at of the related cards they show, which the
+# view then renders without reading them again. Both also carry the `catalog` ContentVersion counter, bumped for what no
+# single row records: category and brand changes, imports, rebuilt
+# related products. Listings are read in one query per page. Tracking
+# pages are validated by the order's updated_at and its latest status
+# update.
+#
+# Pages also show the visitor's name, cart and flash messages, so the ETag
+# mixes in a digest of those and Last-Modified is only sent to visitors
+# with none of them. Responses carry Cache-Control: no-cache (revalidate
+# every time) and Vary: Cookie, so browsers and shared caches may store
+# them but never hand one visitor's page to another.
+
+
+def bump_version(name=ContentVersion.CATALOG):
+    """Advance a page family's version once the current transaction commits"""
+    def bump():
+        updated = ContentVersion.objects.filter(name=name).update(
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            ContentVersion.objects.get_or_create(name=name, defaults={'version': 1})
+    transaction.on_commit(bump)
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _cached(request, key, compute):
+    # condition() asks for the ETag and Last-Modified separately
+    validators = request.__dict__.setdefault('_validators', {})
+    if key not in validators:
+        validators[key] = compute()
+    return validators[key]
+
+
+def _viewer_state(request):
+    """Digest of what a page shows about the visitor, or None for nothing"""
+    def digest():
+        # The request's cart, wherever it is stored; the page reads it anyway
+        cart = get_cart(request)
+        user_id = request.user.pk if request.user.is_authenticated else None
+        pending_messages = len(get_messages(request))
+        if not len(cart) and user_id is None and not pending_messages:
+            return None
+        return _etag(user_id, json.dumps(cart.cart, sort_keys=True), pending_messages)
+    return _cached(request, 'viewer', digest)
+
+
+def _catalog_version(request):
+    def lookup():
+        return ContentVersion.objects.filter(name=ContentVersion.CATALOG) \
+            .values_list('version', 'updated_at').first() or (0, None)
+    return _cached(request, 'catalog', lookup)
+
+
+def _listing_state(request, slug=None):
+    """
+    (catalog version, its updated_at, latest card updated_at, card count)
+    for the cards a listing can show: a category's when `slug` is given
+    """
+    cards = ProductCard.objects.filter(category__slug=slug) if slug else ProductCard.objects.all()
+
+    def lookup():
+        scope = cards.order_by().annotate(scope=Value(1)).values('scope')
+        state = ContentVersion.objects.filter(name=ContentVersion.CATALOG).annotate(
+            cards_updated=Subquery(scope.annotate(latest=Max('updated_at')).values('latest')),
+            card_count=Subquery(scope.annotate(count=Count('pk')).values('count')),
+        ).values_list('version', 'updated_at', 'cards_updated', 'card_count').first()
+        if state is None:
+            # Never bumped
+            found = cards.aggregate(latest=Max('updated_at'), count=Count('pk'))
+            state = (0, None, found['latest'], found['count'])
+        return state
+    return _cached(request, 'listing', lookup)
+
+
+def catalog_etag(request, slug=None):
+    version, _, cards_updated, card_count = _listing_state(request, slug)
+    return _etag('catalog', version, cards_updated and cards_updated.isoformat(), card_count,
+                 request.get_full_path(), _viewer_state(request))
+
+
+def catalog_last_modified(request, slug=None):
+    if _viewer_state(request) is not None:
+        return None
+    _, catalog_updated, cards_updated, _ = _listing_state(request, slug)
+    return max(filter(None, (catalog_updated, cards_updated)), default=None)
+
+
+def _product_state(request, slug):
+    return _cached(request, 'product', lambda: with_on_hand(Product.objects.filter(slug=slug))
+                   .values_list('pk', 'category_id', 'updated_at', 'on_hand').first())
+
+
+def related_cards(request, product):
+    """The product page's related cards, read once for validators and view"""
+    return _cached(request, 'related', lambda: related_product_cards(product))
+
+
+def _related_state(request, slug):
+    """The product's updated_at and that of its newest related card"""
+    state = _product_state(request, slug)
+    if state is None:
+        return None, None, ()
+    pk, category_id, updated, _ = state
+    cards = related_cards(request, Product(pk=pk, category_id=category_id))
+    cards_updated = max((card.updated_at for card in cards), default=None)
+    return updated, cards_updated, [card.pk for card in cards]
+
+
+def product_etag(request, slug):
+    updated, cards_updated, card_ids = _related_state(request, slug)
+    if updated is None:
+        return None
+    version, _ = _catalog_version(request)
+    on_hand = _product_state(request, slug)[3]
+    return _etag('product', slug, updated.isoformat(), on_hand, cards_updated and cards_updated.isoformat(),
+                 card_ids, version, _viewer_state(request))
+
+
+def product_last_modified(request, slug):
+    updated, cards_updated, _ = _related_state(request, slug)
+    if updated is None or _viewer_state(request) is not None:
+        return None
+    catalog_updated = _catalog_version(request)[1]
+    return max(filter(None, (updated, cards_updated, catalog_updated)))
+
+
+def _order_updated(request):
+    tracking_number = request.GET.get('order_number')
+    if request.method not in ('GET', 'HEAD') or not tracking_number:
+        return None
+
+    def lookup():
+        orders = Order.objects.annotate(latest_status=Max('status_updates__timestamp'))
+        row = orders.filter(tracking_number=tracking_number) \
+            .values_list('pk', 'updated_at', 'latest_status').first()
+        if row is None and tracking_number.isdigit():
+            row = orders.filter(pk=tracking_number) \
+                .values_list('pk', 'updated_at', 'latest_status').first()
+        if row is None:
+            return None
+        pk, updated, latest_status = row
+        return pk, max(updated, latest_status) if latest_status else updated
+    return _cached(request, 'order', lookup)
+
+
+def order_etag(request):
+    order = _order_updated(request)
+    if order is None:
+        return None
+    pk, updated = order
+    return _etag('order', pk, updated.isoformat(), _viewer_state(request))
+
+
+def order_last_modified(request):
+    order = _order_updated(request)
+    if order is None or _viewer_state(request) is not None:
+        return None
+    return order[1]
+
+
+def conditional(etag_func, last_modified_func, private=False):
+    """Answer conditional GETs with 304 and make clients revalidate"""
+    def decorator(view):
+        view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+        directives = {'no_cache': True, 'private': True} if private else {'no_cache': True}
+        return cache_control(**directives)(view)
+    return decorator
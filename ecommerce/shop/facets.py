@@ -0,0 +1,103 @@
+from collections import Counter
+from django.db.models import BooleanField, Case, CharField, Count, ExpressionWrapper, Q, Value, When
+
+# Sidebar facets for the product list. All facet counts come from a single
+# GROUP BY over (category, brand, price bucket, featured, in stock); each
+# facet is then counted in Python against every active filter except its
+# own, so picking a category still shows how many products the other
+# categories hold.
+
+PRICE_BUCKETS = {
+    '0-50': (None, 50),
+    '50-100': (50, 100),
+    '100-200': (100, 200),
+    '200-500': (200, 500),
+    '500+': (500, None),
+}
+
+FACETS = ('category', 'brand', 'price_range', 'featured_only', 'available_only')
+
+
+def price_range_q(price_range):
+    """Q object for one of the ProductFilterForm.PRICE_CHOICES buckets"""
+    low, high = PRICE_BUCKETS[price_range]
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def filter_conditions(cleaned_data):
+    """Map each active facet in the filter form to its Q object"""
+    conditions = {}
+    if cleaned_data.get('category'):
+        conditions['category'] = Q(category=cleaned_data['category'])
+    if cleaned_data.get('brand'):
+        conditions['brand'] = Q(brand=cleaned_data['brand'])
+    if cleaned_data.get('price_range') in PRICE_BUCKETS:
+        conditions['price_range'] = price_range_q(cleaned_data['price_range'])
+    if cleaned_data.get('featured_only'):
+        conditions['featured_only'] = Q(featured=True)
+    if cleaned_data.get('available_only'):
+        conditions['available_only'] = Q(available=True, stock__gt=0)
+    return conditions
+
+
+def _price_bucket():
+    whens = [When(price_range_q(key), then=Value(key)) for key in PRICE_BUCKETS]
+    return Case(*whens, default=Value(''), output_field=CharField())
+
+
+def facet_counts(queryset, cleaned_data):
+    """
+    Count products per category, brand, price bucket, featured and in-stock
+    for the current filter state, in one aggregate query. `queryset` should
+    carry every restriction that is not a facet (e.g. the search terms).
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(
+            price_bucket=_price_bucket(),
+            in_stock=ExpressionWrapper(Q(available=True, stock__gt=0), output_field=BooleanField()),
+        )
+        .values('category_id', 'brand_id', 'price_bucket', 'featured', 'in_stock')
+        .annotate(count=Count('pk'))
+    )
+
+    category = cleaned_data.get('category')
+    brand = cleaned_data.get('brand')
+    price_range = cleaned_data.get('price_range')
+    active = {
+        'category': category.pk if category else None,
+        'brand': brand.pk if brand else None,
+        'price_range': price_range if price_range in PRICE_BUCKETS else None,
+        'featured_only': True if cleaned_data.get('featured_only') else None,
+        'available_only': True if cleaned_data.get('available_only') else None,
+    }
+
+    counts = {facet: Counter() for facet in FACETS}
+    for row in rows:
+        values = {
+            'category': row['category_id'],
+            'brand': row['brand_id'],
+            'price_range': row['price_bucket'],
+            'featured_only': bool(row['featured']),
+            'available_only': bool(row['in_stock']),
+        }
+        matches = {
+            facet: active[facet] is None or values[facet] == active[facet]
+            for facet in FACETS
+        }
+        for facet in FACETS:
+            if all(matches[other] for other in FACETS if other != facet):
+                counts[facet][values[facet]] += row['count']
+
+    return {
+        'category': dict(counts['category']),
+        'brand': dict(counts['brand']),
+        'price_range': dict(counts['price_range']),
+        'featured_only': counts['featured_only'][True],
+        'available_only': counts['available_only'][True],
+    }
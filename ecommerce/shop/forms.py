@@ -1,4 +1,5 @@
 from django import forms
+from django.utils.crypto import get_random_string
 from .models import Category, Brand, Order
 
 PRODUCT_QUANTITY_CHOICES = [(i, str(i)) for i in range(1, 21)]
@@ -80,6 +81,21 @@ class ProductFilterForm(forms.Form):
         initial=True,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    
+    def set_facet_counts(self, facets):
+        """Label every filter option with the number of matching products"""
+        category_counts = facets['category']
+        brand_counts = facets['brand']
+        self.fields['category'].label_from_instance = (
+            lambda obj: f"{obj.name} ({category_counts.get(obj.pk, 0)})"
+        )
+        self.fields['brand'].label_from_instance = (
+            lambda obj: f"{obj.name} ({brand_counts.get(obj.pk, 0)})"
+        )
+        self.fields['price_range'].choices = [
+            (value, f"{label} ({facets['price_range'].get(value, 0)})" if value else label)
+            for value, label in self.PRICE_CHOICES
+        ]
 
 class CheckoutForm(forms.ModelForm):
     order_notes = forms.CharField(
@@ -90,6 +106,8 @@ class CheckoutForm(forms.ModelForm):
             'rows': 3
         })
     )
+    # Idempotency key; a form posted twice places one order (see place_order)
+    checkout_token = forms.CharField(required=False, max_length=64, widget=forms.HiddenInput)
     
     class Meta:
         model = Order
@@ -139,6 +157,10 @@ class CheckoutForm(forms.ModelForm):
         
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Every render of the form gets its own idempotency key
+        if not self.is_bound:
+            self.initial.setdefault('checkout_token', get_random_string(32))
+        
         # Update choice fields to use the model's choices
         self.fields['shipping_method'].choices = Order.SHIPPING_METHOD
         self.fields['payment_method'].choices = Order.PAYMENT_METHOD
@@ -0,0 +1,292 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.core.validators import DecimalValidator
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, Value, When
+from django.utils.text import slugify
+from . import autocomplete, search
+from .cards import refresh_cards
+from .conditional import bump_version
+from .inventory import spread_stock, with_on_hand
+from .ledger import record_movements
+from .models import Brand, Category, Product, ProductImage, StockMovement
+
+# Streaming supplier catalog import. Records are read one at a time from
+# CSV or JSON Lines and written BATCH_SIZE at a time with bulk upserts, so
+# memory does not grow with the file and no per-row signals run. What the
+# Product receivers in shop.signals would have done is done per batch:
+# the availability rules as one UPDATE, then the search index and product
+# cards for the whole batch. Low stock events are not recorded for imports.
+# Sharded products (see shop.inventory) have the imported stock spread
+# over their shards, as an admin save would, and their ledger adjustment
+# is taken against the shard total.
+#
+# Rows whose values do not fit their columns (lengths, price digits) are
+# rejected and reported like any other bad row, so one cannot fail a batch.
+#
+# Fields: name, slug (defaults to the slugified name), description, price,
+# original_price, stock, featured, image, images (list in JSONL, "|"
+# separated in CSV), category and brand (names), category_slug and
+# brand_slug. Optional fields a record leaves out (a CSV without the
+# column, a JSONL object without the key) are left untouched on existing
+# products; rows are upserted in groups of the optional fields they carry.
+
+BATCH_SIZE = 1000
+UPDATE_FIELDS = ('name', 'description', 'price', 'stock', 'category', 'brand', 'updated_at')
+# Rejected rows kept for the report; the rest are only counted
+MAX_ERRORS = 100
+OPTIONAL_FIELDS = ('original_price', 'featured', 'image')
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_records(stream, fmt):
+    """
+    Yield (line number, record dict) pairs from a CSV or JSONL stream. A
+    line that is not valid JSON is yielded as an ImportRowError, which
+    clean_record() raises, so it is reported like any other bad row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, ImportRowError(f'invalid JSON: {e.msg} at column {e.colno}')
+
+
+def _decimal(value, field, required=True):
+    if value in (None, ''):
+        if required:
+            raise ImportRowError(f'{field} is required')
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ImportRowError(f'invalid {field}: {value!r}')
+    # NaN and Infinity parse, but cannot be stored or compared as prices
+    if not number.is_finite():
+        raise ImportRowError(f'invalid {field}: {value!r}')
+    # Rounded to the column's decimal places as the database would, then
+    # checked against its digits so an overflow fails this row, not the batch
+    model_field = Product._meta.get_field(field)
+    try:
+        number = number.quantize(Decimal(1).scaleb(-model_field.decimal_places))
+        DecimalValidator(model_field.max_digits, model_field.decimal_places)(number)
+    except (InvalidOperation, ValidationError):
+        raise ImportRowError(f'{field} out of range: {value!r}')
+    return number
+
+
+def _text(value, label, model=Product, field=None):
+    max_length = model._meta.get_field(field or label).max_length
+    if len(value) > max_length:
+        raise ImportRowError(f'{label} is longer than {max_length} characters')
+    return value
+
+
+def _slug(slug, name, field, model=Product):
+    """
+    The given slug, or `name` slugified and cut to the column's length.
+    A name with nothing to slugify (e.g. all punctuation) is rejected
+    rather than imported under the empty slug.
+    """
+    max_length = model._meta.get_field('slug').max_length
+    if slug:
+        slug = str(slug).strip()
+        if len(slug) > max_length:
+            raise ImportRowError(f'{field} is longer than {max_length} characters')
+    else:
+        slug = slugify(name)[:max_length].strip('-')
+    if not slug:
+        raise ImportRowError(f'{field} is required when the name has no letters or digits: {name!r}')
+    return slug
+
+
+def _boolean(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def clean_record(record):
+    """Normalize one input record, raising ImportRowError if unusable"""
+    if isinstance(record, ImportRowError):
+        raise record
+    if not isinstance(record, dict):
+        raise ImportRowError('expected an object')
+    name = (record.get('name') or '').strip()
+    category = (record.get('category') or '').strip()
+    brand = (record.get('brand') or '').strip()
+    if not name or not category or not brand:
+        raise ImportRowError('name, category and brand are required')
+    try:
+        stock = max(int(record.get('stock') or 0), 0)
+        Product._meta.get_field('stock').run_validators(stock)
+    except (TypeError, ValueError, ValidationError):
+        raise ImportRowError(f"invalid stock: {record.get('stock')!r}")
+
+    images = record.get('images') or []
+    if isinstance(images, str):
+        images = [image for image in images.split('|') if image]
+
+    return {
+        'name': _text(name, 'name'),
+        'slug': _slug(record.get('slug'), name, 'slug'),
+        'description': record.get('description') or '',
+        'price': _decimal(record.get('price'), 'price'),
+        'original_price': _decimal(record.get('original_price'), 'original_price', required=False),
+        'stock': stock,
+        'featured': _boolean(record.get('featured')),
+        'image': _text(record.get('image') or '', 'image'),
+        'images': [_text(image, 'images', ProductImage, 'image') for image in images],
+        'optional': tuple(field for field in OPTIONAL_FIELDS if field in record),
+        'category': (_slug(record.get('category_slug'), category, 'category_slug', Category),
+                     _text(category, 'category', Category, 'name')),
+        'brand': (_slug(record.get('brand_slug'), brand, 'brand_slug', Brand),
+                  _text(brand, 'brand', Brand, 'name')),
+    }
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.categories = {}
+        self.brands = {}
+        self.created = self.updated = self.skipped = self.batches = 0
+        self.errors = []
+
+    def _lookup_ids(self, model, cache, pairs):
+        """Map slugs to ids, upserting the ones not seen before"""
+        missing = {slug: name for slug, name in pairs if slug not in cache}
+        if missing:
+            model.objects.bulk_create(
+                [model(slug=slug, name=name) for slug, name in missing.items()],
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=['name'],
+            )
+            cache.update(model.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+        return cache
+
+    def _write(self, rows):
+        # The last record for a slug wins within a batch
+        rows = list({row['slug']: row for row in rows}.values())
+        slugs = [row['slug'] for row in rows]
+        categories = self._lookup_ids(Category, self.categories, [row['category'] for row in rows])
+        brands = self._lookup_ids(Brand, self.brands, [row['brand'] for row in rows])
+
+        # Stock of sharded products is read from, and written to, their shards
+        existing, sharded = {}, {}
+        for slug, on_hand, shards in with_on_hand(Product.objects.filter(slug__in=slugs)) \
+                .values_list('slug', 'on_hand', 'stock_shards'):
+            existing[slug] = on_hand
+            if shards:
+                sharded[slug] = shards
+        products = [
+            Product(
+                name=row['name'],
+                slug=row['slug'],
+                description=row['description'],
+                price=row['price'],
+                original_price=row['original_price'],
+                stock=row['stock'],
+                featured=row['featured'],
+                image=row['image'],
+                available=row['stock'] > 0,
+                category_id=categories[row['category'][0]],
+                brand_id=brands[row['brand'][0]],
+            )
+            for row in rows
+        ]
+        groups = {}
+        for row, product in zip(rows, products):
+            groups.setdefault(row['optional'], []).append(product)
+        for optional, group in groups.items():
+            update_fields = list(UPDATE_FIELDS + optional)
+            if 'image' in optional:
+                # the image may have changed; generate_thumbnails flags it again
+                update_fields.append('image_renditions')
+            Product.objects.bulk_create(
+                group,
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=update_fields,
+            )
+
+        # handle_product_availability, for the whole batch: out of stock
+        # products are hidden, restocked ones come back, the rest keep
+        # whatever availability they had
+        restocked = [slug for slug, stock in existing.items() if stock <= 0]
+        Product.objects.filter(slug__in=slugs).update(available=Case(
+            When(stock__lte=0, then=Value(False)),
+            When(slug__in=restocked, then=Value(True)),
+            default=F('available'),
+            output_field=BooleanField(),
+        ))
+
+        ids = dict(Product.objects.filter(slug__in=slugs).values_list('slug', 'pk'))
+        for row in rows:
+            if row['slug'] in sharded:
+                spread_stock(ids[row['slug']], sharded[row['slug']], row['stock'])
+        gallery = [row for row in rows if row['images']]
+        if gallery:
+            ProductImage.objects.filter(product_id__in=[ids[row['slug']] for row in gallery]).delete()
+            ProductImage.objects.bulk_create([
+                ProductImage(product_id=ids[row['slug']], image=image, alt_text=row['name'])
+                for row in gallery for image in row['images']
+            ])
+
+        # Inventory ledger: opening stock of new products, deltas of the rest
+        record_movements(
+            {ids[row['slug']]: row['stock'] for row in rows if row['slug'] not in existing},
+            StockMovement.RESTOCK
+        )
+        record_movements(
+            {ids[row['slug']]: row['stock'] - existing[row['slug']] for row in rows if row['slug'] in existing},
+            StockMovement.ADJUSTMENT
+        )
+
+        search.index_products(ids.values())
+        refresh_cards(ids.values())
+
+        self.updated += len(existing)
+        self.created += len(rows) - len(existing)
+
+    def _flush(self, batch):
+        if batch:
+            with transaction.atomic():
+                self._write(batch)
+            self.batches += 1
+
+    def run(self, records, progress=None):
+        """Import (line number, record) pairs; returns rows written"""
+        batch = []
+        for line_number, record in records:
+            try:
+                row = clean_record(record)
+            except ImportRowError as e:
+                self.skipped += 1
+                if len(self.errors) < MAX_ERRORS:
+                    self.errors.append((line_number, str(e)))
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+                if progress:
+                    progress(self)
+        self._flush(batch)
+
+        if self.created or self.updated:
+            bump_version()
+            autocomplete.index.clear()
+        return self.created + self.updated
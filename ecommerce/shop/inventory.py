@@ -0,0 +1,354 @@
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual, LessThanOrEqual
+from django.utils import timezone
+from . import autocomplete
+from .ledger import record_movements
+from .models import LowStockEvent, Product, ProductCard, StockHold, StockMovement, StockShard
+
+# Stock reservation. A checkout takes its whole cart out of stock with one
+# guarded UPDATE,
+#
+#   UPDATE shop_product
+#      SET stock = stock - CASE id WHEN 1 THEN 2 WHEN 7 THEN 1 END,
+#          available = stock > CASE id ... END
+#    WHERE available AND ((id = 1 AND stock >= 2) OR (id = 7 AND stock >= 1))
+#
+# so rows are locked for a single statement instead of from validation to
+# commit, and stock is only ever decremented here, never in Python. If
+# fewer rows match than were asked for, the statement is rolled back and
+# the products that could not be covered are reported.
+#
+# .update() runs no Product signals, so stock_changed() does their work
+# for the rows touched: cards, low stock events, typeahead and ETags.
+#
+# Customers who open checkout get StockHolds on their cart for
+# STOCK_HOLD_SECONDS. Live holds of *other* customers are subtracted from
+# stock by every check here, including the guard of the UPDATE, so held
+# units cannot be bought from under the holder; the holder's own holds
+# are dropped in the transaction that reserves their order.
+#
+# Products with `stock_shards` set keep their stock in that many
+# StockShard rows instead. A checkout decrements one shard, picked at
+# random, so concurrent checkouts of the same product mostly lock
+# different rows; when no single shard can cover a line the shards are
+# locked, the line is taken from their total and the rest is spread
+# evenly again. Stock checks always read the shards. Product.stock, which
+# pages show, is only rewritten from them after commit when the product
+# sells out or comes back into stock; otherwise `manage.py
+# sync_sharded_stock` catches it up periodically, so orders never write
+# the product row.
+#
+# Both also append the change to the inventory ledger (shop.ledger).
+
+MAX_ATTEMPTS = 3
+
+
+class _Shortage(Exception):
+    pass
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _shard_total(product):
+    """Sum of the shards of `product` (an id or OuterRef)"""
+    total = (
+        StockShard.objects.filter(product=product).order_by()
+        .values('product').annotate(total=Sum('stock')).values('total')
+    )
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def shard_stock(product_id):
+    """Sum of the shards of one product, for code that holds an instance"""
+    return StockShard.objects.filter(product_id=product_id).aggregate(total=Sum('stock'))['total'] or 0
+
+
+def _held(exclude_user=None, product=OuterRef('pk')):
+    """Units of `product` held by live holds, except `exclude_user`'s"""
+    holds = StockHold.objects.filter(product=product, expires_at__gt=timezone.now())
+    if exclude_user is not None:
+        holds = holds.exclude(user=exclude_user)
+    total = holds.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def _on_hand():
+    """Stock of the outer product, read from its shards when it has them"""
+    return Case(
+        When(stock_shards=0, then=F('stock')),
+        default=_shard_total(OuterRef('pk')),
+        output_field=IntegerField(),
+    )
+
+
+def with_on_hand(queryset):
+    """Annotate `on_hand`: the stock of each product, read from its shards when it has them"""
+    return queryset.annotate(on_hand=_on_hand())
+
+
+def with_free_stock(queryset, exclude_user=None):
+    """Annotate `free`: stock less the live holds of everyone but `exclude_user`"""
+    return queryset.annotate(free=_on_hand() - _held(exclude_user))
+
+
+def available_stock(product_ids, exclude_user=None):
+    """Map each listed, available product to its free stock"""
+    return dict(
+        with_free_stock(Product.objects.filter(pk__in=list(product_ids), available=True), exclude_user)
+        .values_list('pk', 'free')
+    )
+
+
+def stock_changed(product_ids, low_stock=True, previous=None):
+    """
+    Do what the Product receivers do for a stock change made by UPDATE.
+    `previous` maps products to their stock before it, for changes that
+    are not all decrements: low stock is only recorded for drops, and
+    products back in stock are listed in the typeahead again.
+    """
+    rows = list(
+        Product.objects.filter(pk__in=list(product_ids)).values_list('pk', 'stock', 'available', 'name', 'slug')
+    )
+    names = {pk: (name, slug) for pk, _, _, name, slug in rows}
+    levels = [(pk, stock, available) for pk, stock, available, _, _ in rows]
+    if not levels:
+        return
+    # Cards only show whether a product is in stock, so their updated_at
+    # (and the ETags of the pages listing them) only moves when that flips
+    flipped = Q()
+    for pk, stock, available in levels:
+        flipped |= Q(pk=pk) & (~Q(available=available) | (Q(stock=0) if stock > 0 else Q(stock__gt=0)))
+    ProductCard.objects.filter(pk__in=[pk for pk, _, _ in levels]).update(
+        stock=Case(*[When(pk=pk, then=Value(stock)) for pk, stock, _ in levels], output_field=IntegerField()),
+        available=Case(*[When(pk=pk, then=Value(available)) for pk, _, available in levels],
+                       output_field=BooleanField()),
+        updated_at=Case(When(flipped, then=Value(timezone.now())), default=F('updated_at')),
+    )
+    if low_stock and settings.EMAIL_NOTIFICATIONS.get('LOW_STOCK_ALERT', True):
+        LowStockEvent.objects.bulk_create([
+            LowStockEvent(product_id=pk, stock=stock)
+            for pk, stock, _ in levels
+            if stock <= settings.LOW_STOCK_THRESHOLD and (previous is None or stock < previous[pk])
+        ])
+    sold_out = [pk for pk, _, available in levels if not available]
+    relisted = [pk for pk, _, available in levels if available and previous is not None and previous.get(pk, 0) <= 0]
+    if sold_out or relisted:
+        def update_autocomplete():
+            for pk in sold_out:
+                autocomplete.index.remove('product', pk)
+            for pk in relisted:
+                autocomplete.index.update('product', pk, *names[pk])
+        transaction.on_commit(update_autocomplete)
+
+
+def shortages(quantities, user=None):
+    """
+    Map each product in `quantities` (product id -> quantity) that cannot
+    be covered for `user` right now to what it has free; unlisted products
+    map to 0.
+    """
+    found = available_stock(quantities, exclude_user=user)
+    return {
+        pk: found.get(pk, 0)
+        for pk, quantity in quantities.items()
+        if found.get(pk, 0) < quantity
+    }
+
+
+def spread_stock(product_id, shards, total):
+    """Split `total` evenly over `shards` counters (none for 0)"""
+    StockShard.objects.filter(product_id=product_id, number__gte=shards).delete()
+    if shards:
+        StockShard.objects.bulk_create(
+            [
+                StockShard(product_id=product_id, number=number,
+                           stock=total // shards + (number < total % shards))
+                for number in range(shards)
+            ],
+            update_conflicts=True,
+            unique_fields=['product', 'number'],
+            update_fields=['stock'],
+        )
+
+
+def sync_sharded_totals(product_ids=None, low_stock=True, flips_only=False):
+    """
+    Write the shard sums back to Product.stock, with the availability
+    rules, for the sharded products (`product_ids`, or all of them) whose
+    stock is out of date; with `flips_only`, for those that went in or out
+    of stock. Returns the number of products written.
+    """
+    products = Product.objects.filter(stock_shards__gt=0).alias(total=_shard_total(OuterRef('pk')))
+    if product_ids is not None:
+        products = products.filter(pk__in=list(product_ids))
+    if flips_only:
+        products = products.filter(Q(total__lte=0, stock__gt=0) | Q(total__gt=0, stock__lte=0))
+    else:
+        products = products.exclude(stock=F('total'))
+    stale = dict(products.values_list('pk', 'stock'))
+    if not stale:
+        return 0
+    total = _shard_total(OuterRef('pk'))
+    Product.objects.filter(pk__in=list(stale)).update(
+        stock=total,
+        available=Case(
+            When(LessThanOrEqual(total, 0), then=Value(False)),
+            When(stock__lte=0, then=Value(True)),
+            default=F('available'),
+            output_field=BooleanField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    stock_changed(stale, low_stock, previous=stale)
+    return len(stale)
+
+
+def _take_from_shards(product_id, quantity, shards, user):
+    """Decrement one shard of a sharded product by `quantity`, if it can be covered"""
+    free = _shard_total(product_id) - _held(user, product_id)
+    first = random.randrange(shards)
+    for number in [(first + step) % shards for step in range(shards)]:
+        if StockShard.objects.filter(product_id=product_id, number=number, stock__gte=quantity).filter(
+            GreaterThanOrEqual(free, Value(quantity))
+        ).update(stock=F('stock') - quantity):
+            return True
+
+    # No single shard is enough: take it from the total and rebalance
+    total = sum(StockShard.objects.select_for_update().filter(product_id=product_id).values_list('stock', flat=True))
+    if available_stock([product_id], exclude_user=user).get(product_id, 0) < quantity:
+        return False
+    spread_stock(product_id, shards, total - quantity)
+    return True
+
+
+def reserve_stock(quantities, user=None, order_id=None):
+    """
+    Take `quantities` (product id -> quantity) out of stock for `user`,
+    all or nothing, hiding products that sell out and dropping the user's
+    holds. Returns {} on success, otherwise the shortages() that stopped it.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return {}
+    sharded = {
+        pk: (shards, available)
+        for pk, shards, available in Product.objects.filter(pk__in=list(quantities), stock_shards__gt=0)
+        .values_list('pk', 'stock_shards', 'available')
+    }
+    plain = {pk: quantity for pk, quantity in quantities.items() if pk not in sharded}
+    needed = _per_product(plain)
+    held = _held(exclude_user=user)
+    covered = Q()
+    for pk, quantity in plain.items():
+        covered |= Q(pk=pk, stock__gte=held + quantity)
+
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                if plain:
+                    updated = Product.objects.filter(covered, available=True).update(
+                        stock=F('stock') - needed,
+                        available=Case(When(stock__gt=needed, then=Value(True)),
+                                       default=Value(False), output_field=BooleanField()),
+                        updated_at=timezone.now(),
+                    )
+                    if updated != len(plain):
+                        raise _Shortage
+                for pk, (shards, available) in sharded.items():
+                    if not available or not _take_from_shards(pk, quantities[pk], shards, user):
+                        raise _Shortage
+                if user is not None:
+                    StockHold.objects.filter(user=user).delete()
+                record_movements({pk: -quantity for pk, quantity in quantities.items()},
+                                 StockMovement.ORDER, order_id)
+        except _Shortage:
+            missing = shortages(quantities, user)
+            if missing:
+                return missing
+            # Restocked between the two statements; try again
+            continue
+        if plain:
+            stock_changed(plain)
+        if sharded:
+            transaction.on_commit(lambda: sync_sharded_totals(list(sharded), flips_only=True))
+        return {}
+    return shortages(quantities, user) or dict.fromkeys(quantities, 0)
+
+
+def release_stock(quantities, kind=StockMovement.CANCELLATION, order_id=None):
+    """
+    Put `quantities` (product id -> quantity) back into stock, listing
+    again products that had sold out, in one UPDATE
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return 0
+    record_movements(quantities, kind, order_id)
+    sharded = dict(
+        Product.objects.filter(pk__in=list(quantities), stock_shards__gt=0).values_list('pk', 'stock_shards')
+    )
+    for pk, shards in sharded.items():
+        StockShard.objects.filter(product_id=pk, number=random.randrange(shards)).update(
+            stock=F('stock') + quantities.pop(pk)
+        )
+    if sharded:
+        transaction.on_commit(lambda: sync_sharded_totals(list(sharded), low_stock=False, flips_only=True))
+    if not quantities:
+        return len(sharded)
+    previous = dict(Product.objects.filter(pk__in=list(quantities)).values_list('pk', 'stock'))
+    updated = Product.objects.filter(pk__in=list(quantities)).update(
+        stock=F('stock') + _per_product(quantities),
+        available=Case(When(stock__lte=0, then=Value(True)),
+                       default=F('available'), output_field=BooleanField()),
+        updated_at=timezone.now(),
+    )
+    stock_changed(quantities, low_stock=False, previous=previous)
+    return updated + len(sharded)
+
+
+def hold_stock(user, quantities, seconds=None):
+    """
+    Replace `user`'s holds with holds on `quantities` for `seconds`
+    (STOCK_HOLD_SECONDS by default). Lines that cannot be covered are not
+    held and are returned as shortages().
+    """
+    seconds = settings.STOCK_HOLD_SECONDS if seconds is None else seconds
+    expires_at = timezone.now() + timedelta(seconds=seconds)
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    with transaction.atomic():
+        # Lock the products so concurrent holds on them queue up: each one
+        # counts the holds committed before it and cannot take units the
+        # previous customer just held
+        list(Product.objects.select_for_update().filter(pk__in=list(quantities)).order_by('pk').values_list('pk'))
+        StockHold.objects.filter(user=user).delete()
+        missing = shortages(quantities, user)
+        StockHold.objects.bulk_create([
+            StockHold(product_id=pk, user=user, quantity=quantity, expires_at=expires_at)
+            for pk, quantity in quantities.items() if pk not in missing
+        ])
+    return missing
+
+
+def release_holds(user, product_ids=None):
+    """Drop `user`'s holds, or those on `product_ids`, e.g. when they leave their cart"""
+    holds = StockHold.objects.filter(user=user)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    # Only customers with checkout open hold anything; others are not
+    # charged a write
+    return holds.delete()[0] if holds.exists() else 0
+
+
+def release_expired_holds(now=None):
+    """Delete lapsed holds; they already stopped counting when they expired"""
+    return StockHold.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
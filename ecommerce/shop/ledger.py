@@ -0,0 +1,114 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Product, StockMovement, StockShard, StockSnapshot
+
+# Inventory ledger. Every stock change also appends StockMovement rows
+# (order, cancellation, restock, admin adjustment) in the same
+# transaction; appends never conflict with one another. compact() folds
+# the pending movements into one StockSnapshot per product, so
+#
+#   on hand = snapshot + sum(movements not folded yet)
+#
+# stays cheap however long the ledger grows, and reconcile() checks the
+# result against Product.stock, or the shards' sum for sharded products
+# (whose Product.stock is only synced from them periodically).
+
+FOLD_BATCH = 10_000
+
+
+def record_movements(quantities, kind, order_id=None):
+    """Append one movement per product in `quantities` (product id -> signed change)"""
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=pk, quantity=quantity, kind=kind, order_id=order_id)
+        for pk, quantity in quantities.items() if quantity
+    ])
+
+
+def _pending(product=OuterRef('pk')):
+    total = (
+        StockMovement.objects.filter(product=product, folded=False).order_by()
+        .values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def ledger_stock(product_ids=None):
+    """Map products to their on-hand stock according to the ledger"""
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(pk__in=list(product_ids))
+    return dict(
+        products.annotate(on_hand=Coalesce(F('stock_snapshot__on_hand'), Value(0)) + _pending())
+        .values_list('pk', 'on_hand')
+    )
+
+
+def _fold(batch_size):
+    with transaction.atomic():
+        # Concurrent compactions skip each other's rows instead of double counting
+        pending = list(
+            StockMovement.objects.select_for_update(skip_locked=True)
+            .filter(folded=False).order_by('pk').values_list('pk', 'product_id', 'quantity')[:batch_size]
+        )
+        if not pending:
+            return 0
+        deltas = {}
+        for _, product_id, quantity in pending:
+            deltas[product_id] = deltas.get(product_id, 0) + quantity
+        on_hand = dict(
+            StockSnapshot.objects.select_for_update().filter(product_id__in=list(deltas))
+            .values_list('product_id', 'on_hand')
+        )
+        StockSnapshot.objects.bulk_create(
+            [
+                StockSnapshot(product_id=product_id, on_hand=on_hand.get(product_id, 0) + delta)
+                for product_id, delta in deltas.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['on_hand', 'updated_at'],
+        )
+        StockMovement.objects.filter(pk__in=[pk for pk, _, _ in pending]).update(folded=True)
+    return len(pending)
+
+
+def compact(batch_size=FOLD_BATCH, keep_days=None):
+    """
+    Fold every pending movement into the snapshots, `batch_size` per
+    transaction. With `keep_days`, folded movements older than that are
+    deleted. Returns the number of movements folded.
+    """
+    folded = 0
+    while True:
+        count = _fold(batch_size)
+        folded += count
+        if count < batch_size:
+            break
+    if keep_days is not None:
+        StockMovement.objects.filter(
+            folded=True,
+            created_at__lt=timezone.now() - timedelta(days=keep_days)
+        ).delete()
+    return folded
+
+
+def reconcile(product_ids=None):
+    """Map products whose ledger figure differs from their stock to (ledger, stock)"""
+    shards = (
+        StockShard.objects.filter(product=OuterRef('pk')).order_by()
+        .values('product').annotate(total=Sum('stock')).values('total')
+    )
+    stock = dict(
+        (Product.objects.all() if product_ids is None else Product.objects.filter(pk__in=list(product_ids)))
+        .annotate(on_hand=Case(
+            When(stock_shards=0, then=F('stock')),
+            default=Coalesce(Subquery(shards, output_field=IntegerField()), Value(0)),
+        ))
+        .values_list('pk', 'on_hand')
+    )
+    return {
+        pk: (on_hand, stock[pk])
+        for pk, on_hand in ledger_stock(product_ids).items()
+        if on_hand != stock[pk]
+    }
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from shop.ledger import FOLD_BATCH, compact, reconcile
+
+class Command(BaseCommand):
+    help = 'Folds pending inventory ledger movements into the per-product stock snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=FOLD_BATCH,
+                            help='Movements folded per transaction')
+        parser.add_argument('--keep-days', type=int, default=None,
+                            help='Delete folded movements older than this many days')
+        parser.add_argument('--reconcile', action='store_true',
+                            help='Report products whose ledger stock differs from Product.stock')
+
+    def handle(self, *args, **options):
+        folded = compact(options['batch_size'], options['keep_days'])
+        self.stdout.write(self.style.SUCCESS(f'Folded {folded} movements'))
+        if options['reconcile']:
+            drift = reconcile()
+            for product_id, (on_hand, stock) in sorted(drift.items()):
+                self.stdout.write(self.style.WARNING(
+                    f'Product {product_id}: ledger {on_hand}, stock {stock}'
+                ))
+            if not drift:
+                self.stdout.write(self.style.SUCCESS('Ledger matches stock'))
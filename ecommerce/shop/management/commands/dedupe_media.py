@@ -0,0 +1,89 @@
+import posixpath
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shop.conditional import bump_version
+from shop.models import Product, ProductCard, ProductImage
+from shop.storage import content_name, is_content_name, product_image_storage
+from shop.thumbnails import rendition_names
+
+IMAGE_MODELS = (Product, ProductImage, ProductCard)
+
+
+class Command(BaseCommand):
+    help = 'Renames product images to content hashes, merging duplicates and stripping metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report without changing anything')
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help='Also delete files in the upload folders that no row references')
+
+    def handle(self, *args, **options):
+        storage = product_image_storage
+        dry_run = options['dry_run']
+
+        names = set()
+        for model in IMAGE_MODELS:
+            names.update(model.objects.exclude(image='').values_list('image', flat=True))
+
+        renamed = {}
+        before = after = 0
+        blobs = set()
+        for name in sorted(names):
+            if is_content_name(name):
+                continue
+            if not storage.exists(name):
+                self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                continue
+            with storage.open(name, 'rb') as f:
+                data = f.read()
+            new_name, data = content_name(name, data)
+            renamed[name] = new_name
+            before += storage.size(name)
+            if new_name not in blobs:
+                blobs.add(new_name)
+                after += len(data)
+                if not dry_run:
+                    storage.store(new_name, data)
+
+        if not dry_run and renamed:
+            with transaction.atomic():
+                for old, new in renamed.items():
+                    for model in IMAGE_MODELS:
+                        model.objects.filter(image=old).update(image=new, image_renditions=False)
+                bump_version()
+                # Old files go only once the rows point at the new ones
+                transaction.on_commit(lambda: self.delete_files(storage, renamed))
+
+        orphans = []
+        if options['delete_orphans']:
+            referenced = set()
+            for model in IMAGE_MODELS:
+                referenced.update(model.objects.exclude(image='').values_list('image', flat=True))
+            referenced.update(renamed.values())
+            folders = {posixpath.dirname(name) for name in names | referenced}
+            for folder in sorted(folders):
+                for filename in storage.listdir(folder)[1]:
+                    path = posixpath.join(folder, filename)
+                    if path not in referenced and path not in renamed:
+                        orphans.append(path)
+            if not dry_run:
+                for path in orphans:
+                    storage.delete(path)
+
+        prefix = 'Would rewrite' if dry_run else 'Rewrote'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {len(renamed)} images into {len(blobs)} files '
+            f'({before // 1024} KB -> {after // 1024} KB), {len(orphans)} orphaned files'
+            f'{" found" if dry_run else " deleted"}'
+        ))
+        if renamed and not dry_run:
+            self.stdout.write('Run generate_thumbnails to render the renamed images.')
+
+    def delete_files(self, storage, renamed):
+        for old, new in renamed.items():
+            if old == new:
+                continue
+            storage.delete(old)
+            for paths in rendition_names(old).values():
+                for path, _ in paths:
+                    storage.delete(path)
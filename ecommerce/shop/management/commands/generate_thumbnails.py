@@ -0,0 +1,61 @@
+import time
+import django
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from shop.models import Product, ProductImage
+from shop.thumbnails import generate_renditions, mark_rendered, pending_images
+
+
+def _render(name, overwrite):
+    try:
+        return name, generate_renditions(name, overwrite=overwrite), None
+    except Exception as e:
+        return name, 0, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Generates srcset renditions for product and gallery images that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: one per CPU)')
+        parser.add_argument('--overwrite', action='store_true',
+                            help='Regenerate the renditions of every image')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, rendering new uploads every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        overwrite = options['overwrite']
+        while True:
+            if overwrite:
+                names = set(Product.objects.exclude(image='').values_list('image', flat=True))
+                names.update(ProductImage.objects.exclude(image='').values_list('image', flat=True))
+                names = sorted(names)
+            else:
+                names = pending_images()
+            self.render(names, options['workers'], overwrite)
+            # Only the first pass overwrites
+            overwrite = False
+            if not interval:
+                break
+            time.sleep(interval)
+
+    def render(self, names, workers, overwrite):
+        started = time.monotonic()
+        if workers == 1 or not names:
+            results = [_render(name, overwrite) for name in names]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                results = list(pool.map(_render, names, [overwrite] * len(names), chunksize=4))
+        elapsed = time.monotonic() - started
+
+        written = 0
+        for name, count, error in results:
+            written += count
+            if error:
+                self.stdout.write(self.style.WARNING(f'Skipped {name}: {error}'))
+        mark_rendered(name for name, _, error in results if not error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} renditions for {len(names)} images in {elapsed:.1f}s'
+        ))
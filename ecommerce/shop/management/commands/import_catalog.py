@@ -0,0 +1,47 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from shop.importer import BATCH_SIZE, CatalogImporter, read_records
+
+
+class Command(BaseCommand):
+    help = 'Streams a CSV or JSON Lines supplier catalog into the shop with bulk upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file, or - for standard input')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Records written per batch')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        if path == '-' and not options['format']:
+            raise CommandError('--format is required when reading standard input')
+
+        importer = CatalogImporter(batch_size=options['batch_size'])
+        started = time.monotonic()
+
+        def progress(importer):
+            if importer.batches % 10 == 0:
+                done = importer.created + importer.updated
+                rate = done / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(f'{done} products imported ({rate:.0f}/s)')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        try:
+            importer.run(read_records(stream, fmt), progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Import stopped: {e}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.monotonic() - started
+        for line_number, error in importer.errors:
+            self.stdout.write(self.style.WARNING(f'Line {line_number}: {error}'))
+        total = importer.created + importer.updated
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} products ({importer.created} new, {importer.updated} updated, '
+            f'{importer.skipped} skipped) in {elapsed:.1f}s, {total / max(elapsed, 1e-9):.0f} products/s'
+        ))
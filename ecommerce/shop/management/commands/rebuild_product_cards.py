@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shop.cards import rebuild_cards
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized product card table from the catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products written per INSERT')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            total = rebuild_cards(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} product cards in {elapsed:.1f}s'))
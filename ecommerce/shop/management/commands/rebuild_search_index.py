@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from shop import search
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index from scratch'
+
+    def handle(self, *args, **kwargs):
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
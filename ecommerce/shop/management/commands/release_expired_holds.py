@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.inventory import release_expired_holds
+
+class Command(BaseCommand):
+    help = 'Deletes checkout stock holds that have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, sweeping every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            count = release_expired_holds()
+            self.stdout.write(self.style.SUCCESS(f'Released {count} expired holds'))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.outbox import BATCH_SIZE, drain
+
+class Command(BaseCommand):
+    help = 'Delivers the emails waiting in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Emails sent per connection and transaction')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, checking the outbox every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            sent, failed = drain(options['batch_size'])
+            if sent or failed or not interval:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed'))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.stock_alerts import send_digest
+
+class Command(BaseCommand):
+    help = 'Emails one digest of the products that ran low on stock since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, sending a digest every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            count = send_digest()
+            self.stdout.write(self.style.SUCCESS(f'Low stock digest: {count} products'))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.inventory import sync_sharded_totals
+
+class Command(BaseCommand):
+    help = 'Copies the shard totals of sharded products to their stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, syncing every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            count = sync_sharded_totals()
+            self.stdout.write(self.style.SUCCESS(f'Synced the stock of {count} sharded products'))
+            if not interval:
+                break
+            time.sleep(interval)
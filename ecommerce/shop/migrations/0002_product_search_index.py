@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(p.name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(b.name, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(c.name, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(p.description, '')), 'C')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE shop_product ADD COLUMN search_vector tsvector")
+        schema_editor.execute(
+            f"UPDATE shop_product AS p SET search_vector = {PG_DOCUMENT} "
+            "FROM shop_brand AS b, shop_category AS c "
+            "WHERE b.id = p.brand_id AND c.id = p.category_id"
+        )
+        schema_editor.execute(
+            "CREATE INDEX shop_product_search_gin ON shop_product USING gin (search_vector)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE shop_product_fts USING fts5("
+            "name, brand, category, description, tokenize = 'porter unicode61')"
+        )
+        schema_editor.execute(
+            "INSERT INTO shop_product_fts (rowid, name, brand, category, description) "
+            "SELECT p.id, p.name, b.name, c.name, p.description FROM shop_product AS p "
+            "JOIN shop_brand AS b ON b.id = p.brand_id "
+            "JOIN shop_category AS c ON c.id = p.category_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS shop_product_search_gin")
+        schema_editor.execute("ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_cards(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductCard = apps.get_model('shop', 'ProductCard')
+    batch = []
+    for product in Product.objects.select_related('brand', 'category').iterator(chunk_size=1000):
+        discount = 0
+        if product.original_price:
+            discount = int(((product.original_price - product.price) / product.original_price) * 100)
+        batch.append(ProductCard(
+            product_id=product.pk,
+            category_id=product.category_id,
+            brand_id=product.brand_id,
+            name=product.name,
+            slug=product.slug,
+            short_description=product.description[:200],
+            category_name=product.category.name,
+            brand_name=product.brand.name,
+            price=product.price,
+            original_price=product.original_price,
+            discount_percentage=discount,
+            image=product.image.name,
+            stock=product.stock,
+            available=product.available,
+            featured=product.featured,
+            created_at=product.created_at,
+        ))
+        if len(batch) >= 1000:
+            ProductCard.objects.bulk_create(batch)
+            batch = []
+    ProductCard.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='shop.product')),
+                ('name', models.CharField(max_length=200)),
+                ('slug', models.SlugField(db_index=False)),
+                ('short_description', models.CharField(blank=True, max_length=200)),
+                ('category_name', models.CharField(max_length=100)),
+                ('brand_name', models.CharField(max_length=100)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('original_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('discount_percentage', models.IntegerField(default=0)),
+                ('image', models.ImageField(blank=True, upload_to='products/')),
+                ('stock', models.PositiveIntegerField(default=0)),
+                ('available', models.BooleanField(default=True)),
+                ('featured', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('brand', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.brand')),
+                ('category', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.category')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['-created_at'], name='shop_card_created_idx'), models.Index(fields=['category', 'available', '-created_at'], name='shop_card_category_idx'), models.Index(fields=['brand', '-created_at'], name='shop_card_brand_idx'), models.Index(fields=['price'], name='shop_card_price_idx'), models.Index(fields=['name'], name='shop_card_name_idx')],
+            },
+        ),
+        migrations.RunPython(build_cards, migrations.RunPython.noop),
+    ]
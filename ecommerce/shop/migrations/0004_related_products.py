@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_productcard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchaseMatrix',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.BigIntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='copurchased_with', to='shop.product')),
+            ],
+            options={
+                'ordering': ['product', '-score'],
+                'indexes': [models.Index(fields=['product', '-score'], name='shop_related_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related'), name='shop_related_unique')],
+            },
+        ),
+    ]
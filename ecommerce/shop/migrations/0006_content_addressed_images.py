@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:13
+
+import shop.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_content_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, storage=shop.storage.get_product_image_storage, upload_to='products/'),
+        ),
+        migrations.AlterField(
+            model_name='productcard',
+            name='image',
+            field=models.ImageField(blank=True, storage=shop.storage.get_product_image_storage, upload_to='products/'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=shop.storage.get_product_image_storage, upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_snapshots(apps, schema_editor):
+    # The ledger starts from the stock products have today
+    Product = apps.get_model('shop', 'Product')
+    StockSnapshot = apps.get_model('shop', 'StockSnapshot')
+    batch = []
+    for product_id, stock in Product.objects.values_list('pk', 'stock').iterator(chunk_size=1000):
+        batch.append(StockSnapshot(product_id=product_id, on_hand=stock))
+        if len(batch) >= 1000:
+            StockSnapshot.objects.bulk_create(batch)
+            batch = []
+    StockSnapshot.objects.bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_stock_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_snapshot', serialize=False, to='shop.product')),
+                ('on_hand', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('kind', models.CharField(choices=[('order', 'Order'), ('cancellation', 'Cancellation'), ('restock', 'Restock'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('folded', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='shop.product')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('folded', False)), fields=['product'], name='shop_movement_pending_idx')],
+            },
+        ),
+        migrations.RunPython(open_snapshots, migrations.RunPython.noop),
+    ]
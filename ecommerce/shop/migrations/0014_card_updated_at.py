@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_catalog_version(apps, schema_editor):
+    # Listing validators read the counter in the same query as the cards,
+    # so it has to exist before the first bump
+    ContentVersion = apps.get_model('shop', 'ContentVersion')
+    ContentVersion.objects.get_or_create(name='catalog')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_cart_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcard',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['updated_at'], name='shop_card_updated_idx'),
+        ),
+        migrations.RunPython(create_catalog_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='copurchasematrix',
+            name='recent_orders',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='copurchasematrix',
+            name='watermark',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, IntegerField, Value, When
+from django.db.models.functions import Cast, Ceil, Floor
 from django.urls import reverse
+from django.utils import timezone
 from model_utils import FieldTracker
+from .storage import get_product_image_storage
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -20,6 +24,35 @@ class Brand(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    """
+    Named read profiles so each page loads only what it renders, with
+    brand and category joined in rather than fetched per product.
+    Listings read ProductCard rows (shop.cards) instead.
+    """
+    CHECKOUT_FIELDS = ('id', 'name', 'slug', 'price', 'image', 'stock', 'stock_shards', 'available')
+
+    def with_discount(self):
+        """Compute discount_percentage in the database, truncated like int()"""
+        percentage = ExpressionWrapper(
+            (F('original_price') - F('price')) * 100 / F('original_price'),
+            output_field=DecimalField(max_digits=12, decimal_places=4)
+        )
+        return self.annotate(discount_percentage=Cast(Case(
+            When(original_price__gt=F('price'), then=Floor(percentage)),
+            When(original_price__gt=0, then=Ceil(percentage)),
+            default=Value(0),
+            output_field=DecimalField(max_digits=12, decimal_places=4),
+        ), IntegerField()))
+
+    def for_detail(self):
+        """Product page: every column plus brand, category and gallery images"""
+        return self.select_related('brand', 'category').prefetch_related('images').with_discount()
+
+    def for_checkout(self):
+        """Cart and checkout: just what is needed to price and show a line"""
+        return self.only(*self.CHECKOUT_FIELDS)
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
@@ -28,13 +61,31 @@ class Product(models.Model):
     original_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='products')
-    image = models.ImageField(upload_to='products/', blank=True)
+    image = models.ImageField(upload_to='products/', storage=get_product_image_storage, blank=True)
+    # Whether the srcset renditions of `image` have been written (see
+    # shop.thumbnails); reset when the image changes
+    image_renditions = models.BooleanField(default=False, editable=False)
     stock = models.PositiveIntegerField(default=0)
+    stock_shards = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='Split stock over this many counter rows so checkouts of a hot '
+                  'product do not queue on one row; 0 keeps it in this row'
+    )
     available = models.BooleanField(default=True)
     featured = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Loaded values of everything the search index, product card, image
+    # renditions and stock rules depend on, so receivers can diff a save
+    # without reading the row back
+    tracker = FieldTracker(fields=[
+        'name', 'slug', 'description', 'price', 'original_price', 'category_id',
+        'brand_id', 'image', 'stock', 'stock_shards', 'available', 'featured',
+    ])
+    
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
     
@@ -46,18 +97,295 @@ class Product(models.Model):
     
     @property
     def discount_percentage(self):
+        # Prefer the value annotated by ProductQuerySet.with_discount()
+        if '_discount_percentage' in self.__dict__:
+            return self._discount_percentage
         if self.original_price:
             return int(((self.original_price - self.price) / self.original_price) * 100)
         return 0
+    
+    @discount_percentage.setter
+    def discount_percentage(self, value):
+        self._discount_percentage = value
+
+class ProductCard(models.Model):
+    """
+    Flat copy of everything a product card renders, one row per product,
+    so listing pages read a single narrow table. Kept in sync by the
+    receivers in shop.signals; `manage.py rebuild_product_cards` rebuilds it.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 db_index=False, related_name='+')
+    brand = models.ForeignKey(Brand, on_delete=models.DO_NOTHING, db_constraint=False,
+                              db_index=False, related_name='+')
+    name = models.CharField(max_length=200)
+    slug = models.SlugField(db_index=False)
+    short_description = models.CharField(max_length=200, blank=True)
+    category_name = models.CharField(max_length=100)
+    brand_name = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    original_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    discount_percentage = models.IntegerField(default=0)
+    image = models.ImageField(upload_to='products/', storage=get_product_image_storage, blank=True)
+    image_renditions = models.BooleanField(default=False)
+    stock = models.PositiveIntegerField(default=0)
+    available = models.BooleanField(default=True)
+    featured = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    # When what the card renders last changed; stock moves that keep the
+    # product in (or out of) stock leave it alone
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='shop_card_created_idx'),
+            models.Index(fields=['updated_at'], name='shop_card_updated_idx'),
+            models.Index(fields=['category', 'available', '-created_at'], name='shop_card_category_idx'),
+            models.Index(fields=['brand', '-created_at'], name='shop_card_brand_idx'),
+            models.Index(fields=['price'], name='shop_card_price_idx'),
+            models.Index(fields=['name'], name='shop_card_name_idx'),
+        ]
+    
+    def __str__(self):
+        return self.name
+    
+    def get_absolute_url(self):
+        return reverse('shop:product_detail', kwargs={'slug': self.slug})
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='products/')
+    image = models.ImageField(upload_to='products/', storage=get_product_image_storage)
+    image_renditions = models.BooleanField(default=False, editable=False)
     alt_text = models.CharField(max_length=200, blank=True)
+
+    tracker = FieldTracker(fields=['image'])
     
     def __str__(self):
         return f"{self.product.name} - Image"
 
+class RelatedProduct(models.Model):
+    """
+    Top co-purchased neighbours of a product, written by
+    `manage.py build_related_products` (see shop.recommendations).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='copurchased_with')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', '-score']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='shop_related_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='shop_related_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_id} ({self.score:.3f})'
+
+class LowStockEvent(models.Model):
+    """
+    A product whose stock dropped to LOW_STOCK_THRESHOLD or below. Written
+    by shop.signals instead of emailing on the spot, and collapsed into a
+    periodic digest by `manage.py send_low_stock_digest`.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='low_stock_events')
+    stock = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.product_id} at {self.stock}'
+
+class StockShard(models.Model):
+    """
+    One of the `stock_shards` counters a sharded product's stock is split
+    over. shop.inventory decrements a single shard per checkout and writes
+    their sum back to Product.stock after commit.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='shards')
+    number = models.PositiveSmallIntegerField()
+    stock = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'number'], name='shop_stock_shard_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}#{self.number}: {self.stock}'
+
+class StockHold(models.Model):
+    """
+    Stock set aside for a customer who has opened checkout, until
+    `expires_at`. Active holds of other customers count against
+    Product.stock in shop.inventory; placing the order turns the holder's
+    holds into a real decrement and `manage.py release_expired_holds`
+    sweeps the lapsed ones.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='stock_holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Summing the live holds of one product is an index range scan
+            models.Index(fields=['product', 'expires_at'], name='shop_hold_product_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} for {self.user_id}'
+
+class CartItem(models.Model):
+    """
+    One line of a signed-in customer's cart (see shop.cart.DatabaseCart),
+    kept across devices and sessions. `price` is the price when the
+    product was first added, as in session carts.
+    """
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='cart_items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['added_at', 'pk']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='shop_cart_item_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} in the cart of {self.user_id}'
+
+class StockMovement(models.Model):
+    """
+    One entry of the append-only inventory ledger: a signed change to a
+    product's stock and why. Written with plain INSERTs next to every stock
+    change; `manage.py compact_stock_ledger` folds them into StockSnapshot.
+    """
+    ORDER = 'order'
+    CANCELLATION = 'cancellation'
+    RESTOCK = 'restock'
+    ADJUSTMENT = 'adjustment'
+    KINDS = (
+        (ORDER, 'Order'),
+        (CANCELLATION, 'Cancellation'),
+        (RESTOCK, 'Restock'),
+        (ADJUSTMENT, 'Adjustment'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    quantity = models.IntegerField()
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # Kept after the order is deleted, for the audit trail
+    order = models.ForeignKey('Order', on_delete=models.DO_NOTHING, db_constraint=False,
+                              null=True, blank=True, related_name='+')
+    folded = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Only the movements not yet folded into a snapshot are summed
+            models.Index(fields=['product'], condition=models.Q(folded=False), name='shop_movement_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} {self.quantity:+d} ({self.kind})'
+
+class StockSnapshot(models.Model):
+    """
+    On-hand stock of a product as of the movements folded so far; adding
+    its unfolded movements gives the current figure
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stock_snapshot')
+    on_hand = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.product_id}: {self.on_hand}'
+
+class OutgoingEmail(models.Model):
+    """
+    An email waiting in the outbox. Requests only insert these;
+    `manage.py run_mail_worker` delivers them over one reused SMTP
+    connection, retrying with backoff until MAX_ATTEMPTS, after which the
+    message is dead-lettered for someone to look at.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField()
+    headers = models.JSONField(default=dict, blank=True)
+    # Attach the store logo (Content-ID <logo>) when sending
+    inline_logo = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='shop_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.to)} ({self.status})'
+
+class ContentVersion(models.Model):
+    """
+    Change counter for a family of pages, bumped by changes that do not
+    show in any one product's or card's updated_at (categories, brands,
+    imports, related products). Part of the HTTP validators of those pages
+    (see shop.conditional).
+    """
+    CATALOG = 'catalog'
+
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+class CoPurchaseMatrix(models.Model):
+    """
+    Product x product co-purchase counts, kept so the related-products job
+    can fold in new orders without a full rebuild. Every order created
+    before `watermark` less ORDER_OVERLAP has been counted, as have the
+    `recent_orders` created since.
+    """
+    last_order_id = models.BigIntegerField(default=0)
+    watermark = models.DateTimeField(null=True)
+    recent_orders = models.JSONField(default=list)
+    data = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Co-purchase counts up to order {self.last_order_id}'
+
 class Order(models.Model):
     ORDER_STATUS = (
         ('pending', 'Pending'),
@@ -120,6 +448,10 @@ class Order(models.Model):
     tracking_number = models.CharField(max_length=100, unique=True, blank=True, null=True)
     estimated_delivery = models.DateField(null=True, blank=True)
     
+    # Idempotency key of the checkout form that placed the order, so a
+    # resubmitted form finds the order instead of placing another
+    checkout_token = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    
     # Shipping and Payment
     shipping_method = models.CharField(max_length=50, choices=SHIPPING_METHOD, default='standard')
     payment_method = models.CharField(max_length=50, choices=PAYMENT_METHOD, default='cash_on_delivery')
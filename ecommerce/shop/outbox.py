@@ -0,0 +1,127 @@
+import logging
+from datetime import timedelta
+from email.mime.image import MIMEImage
+from functools import cache
+from django.contrib.staticfiles import finders
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutgoingEmail
+
+# Email outbox. Code that wants to send mail calls enqueue(), which only
+# inserts a row, in the caller's transaction, so a rolled back order
+# sends nothing and a committed one cannot lose its email. deliver()
+# sends what is due in batches over a single backend connection; a
+# failure is retried after RETRY_BASE, doubling with each attempt, and
+# after MAX_ATTEMPTS the message is marked dead instead of retried forever.
+
+logger = logging.getLogger('django.mail')
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_BASE = timedelta(minutes=1)
+
+
+@cache
+def _logo():
+    """The store logo, read once per process"""
+    path = finders.find('logo/logo.png')
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def enqueue(message, inline_logo=False):
+    """Store an EmailMessage (or EmailMultiAlternatives) for the mail worker"""
+    html_body = ''
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            html_body = content
+    return OutgoingEmail.objects.create(
+        subject=message.subject,
+        body=message.body,
+        html_body=html_body,
+        from_email=message.from_email,
+        to=list(message.to),
+        headers=message.extra_headers,
+        inline_logo=inline_logo,
+    )
+
+
+def build_message(email, connection=None):
+    message = EmailMultiAlternatives(
+        email.subject,
+        email.body,
+        email.from_email,
+        email.to,
+        headers=email.headers,
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    if email.inline_logo and _logo():
+        image = MIMEImage(_logo())
+        image.add_header('Content-ID', '<logo>')
+        message.attach(image)
+    return message
+
+
+def deliver(batch_size=BATCH_SIZE, now=None):
+    """
+    Send up to `batch_size` due emails over one connection. Returns the
+    number sent and the number that failed.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Several workers can drain the outbox without sending twice
+        due = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if not due:
+            return 0, 0
+
+        sent = failed = 0
+        connection = get_connection()
+        try:
+            for email in due:
+                email.attempts += 1
+                try:
+                    # Opened by us, the connection outlives each send
+                    connection.open()
+                    build_message(email, connection).send()
+                except Exception as e:
+                    failed += 1
+                    email.last_error = f'{type(e).__name__}: {e}'
+                    if email.attempts >= MAX_ATTEMPTS:
+                        email.status = OutgoingEmail.DEAD
+                        logger.error(f'Giving up on email {email.pk} to {email.to}: {e}')
+                    else:
+                        email.next_attempt_at = now + RETRY_BASE * 2 ** (email.attempts - 1)
+                        logger.warning(f'Email {email.pk} failed (attempt {email.attempts}): {e}')
+                    # The next message reconnects
+                    connection.close()
+                else:
+                    sent += 1
+                    email.status = OutgoingEmail.SENT
+                    email.sent_at = timezone.now()
+        finally:
+            connection.close()
+
+        OutgoingEmail.objects.bulk_update(
+            due, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+    return sent, failed
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Deliver batches until nothing is due; returns totals sent and failed"""
+    sent = failed = 0
+    while True:
+        batch_sent, batch_failed = deliver(batch_size)
+        sent += batch_sent
+        failed += batch_failed
+        if batch_sent + batch_failed < batch_size:
+            return sent, failed
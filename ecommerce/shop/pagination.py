@@ -0,0 +1,168 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection
+from django.db.models import Q
+
+# Keyset (cursor) pagination for the catalog pages. Instead of OFFSET,
+# each page remembers the sort key of its first and last row and the
+# next page is fetched with a WHERE clause on that key, so page 500 costs
+# the same as page 1 and no COUNT(*) is needed to render the pager.
+
+ESTIMATE_THRESHOLD = 1000
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPage:
+    """A single page of results plus the cursors to its neighbours"""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], 'prev')
+        return None
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on its current ordering, with the primary key
+    appended as a tiebreaker so every row has a unique position.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        pk = queryset.model._meta.pk
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('pk', pk.name, pk.attname) for field in ordering):
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append(f'-{pk.attname}' if descending else pk.attname)
+        self.ordering = ordering
+
+    def _to_python(self, name, value):
+        meta = self.queryset.model._meta
+        try:
+            field = meta.pk if name == 'pk' else meta.get_field(name)
+        except FieldDoesNotExist:
+            field = self.queryset.query.annotations[name].output_field
+        return field.to_python(value)
+
+    def encode_cursor(self, obj, direction):
+        keys = [_encode_value(getattr(obj, field.lstrip('-'))) for field in self.ordering]
+        payload = json.dumps({'o': self.ordering, 'd': direction, 'k': keys})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return (direction, keys), or None for a missing or stale cursor"""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if payload['o'] != self.ordering or payload['d'] not in ('next', 'prev'):
+                return None
+            if len(payload['k']) != len(self.ordering):
+                return None
+            keys = [
+                self._to_python(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, payload['k'])
+            ]
+        except (ValueError, KeyError, TypeError, ValidationError):
+            return None
+        return payload['d'], keys
+
+    def _seek(self, keys, forward):
+        """Build the WHERE clause for rows strictly after (or before) `keys`"""
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            ascending = not field.startswith('-')
+            lookup = 'gt' if ascending == forward else 'lt'
+            step = Q(**{f'{name}__{lookup}': keys[position]})
+            for previous, value in zip(self.ordering[:position], keys):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor)
+        if decoded is None:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        direction, keys = decoded
+        if direction == 'next':
+            queryset = self.queryset.filter(self._seek(keys, forward=True)).order_by(*self.ordering)
+            rows = list(queryset[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+        # Walk backwards with the ordering flipped, then restore display order
+        reversed_ordering = [
+            field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering
+        ]
+        queryset = self.queryset.filter(self._seek(keys, forward=False)).order_by(*reversed_ordering)
+        rows = list(queryset[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page][::-1], self, True, has_previous)
+
+
+def estimated_count(queryset, threshold=ESTIMATE_THRESHOLD):
+    """
+    Count a queryset without paying for an exact COUNT(*) on large
+    results. Returns (count, is_estimate). Below `threshold` rows the
+    count is exact; above it PostgreSQL's planner estimate is used.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count(), False
+
+    queryset = queryset.order_by()
+    capped = queryset[:threshold].count()
+    if capped < threshold:
+        return capped, False
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return max(int(plan[0]['Plan']['Plan Rows']), threshold), True
@@ -0,0 +1,217 @@
+import io
+from datetime import timedelta
+from itertools import islice
+import numpy as np
+from django.utils import timezone
+from scipy import sparse
+from .conditional import bump_version
+from .models import CoPurchaseMatrix, OrderItem, Product, RelatedProduct
+
+# Item-to-item "customers also bought" built from order lines. Orders are
+# streamed in order_id sequence, CHUNK_SIZE lines at a time, each chunk
+# turned into a sparse order x product incidence matrix B and folded into
+# the running product x product count matrix C += B.T @ B. The diagonal
+# of C is how many orders hold each product, so cosine similarity is
+# C[i, j] / sqrt(C[i, i] * C[j, j]). Only the top-K neighbours per product
+# are written to RelatedProduct; C itself is kept in CoPurchaseMatrix so
+# later runs only have to read the orders placed since.
+#
+# "Since" is by creation time, not order id: an order's id and created_at
+# are taken when it is inserted, but it only becomes visible when its
+# transaction commits, possibly after orders with higher ids. Each run
+# therefore rereads the orders created in the ORDER_OVERLAP before the
+# previous run started, skipping the ones it already counted
+# (CoPurchaseMatrix.recent_orders).
+
+TOP_K = 12
+CHUNK_SIZE = 100_000
+ROW_BLOCK = 5_000
+# Products per DELETE, under SQLite's limit on query parameters
+DELETE_BATCH_SIZE = 500
+# Longest an order may take to commit and still be picked up
+ORDER_OVERLAP = timedelta(hours=1)
+
+# order id, product id, 1 if the order was created after the recent cutoff
+LINE_DTYPE = np.dtype((np.int64, 3))
+
+
+def _order_chunks(since, recent_cutoff, chunk_size):
+    """
+    Yield (order_id, product_id, recent) arrays of about `chunk_size`
+    lines for orders created from `since` (all if None), never splitting
+    an order in two. `recent` flags orders created from `recent_cutoff`.
+    """
+    items = OrderItem.objects.all()
+    if since is not None:
+        items = items.filter(order__created_at__gte=since)
+    lines = (
+        (order_id, product_id, created_at >= recent_cutoff)
+        for order_id, product_id, created_at in items.order_by('order_id')
+        .values_list('order_id', 'product_id', 'order__created_at')
+        .iterator(chunk_size=chunk_size)
+    )
+    carry = np.empty((0, 3), dtype=np.int64)
+    while True:
+        block = np.fromiter(islice(lines, chunk_size), dtype=LINE_DTYPE)
+        exhausted = len(block) < chunk_size
+        block = np.concatenate([carry, block])
+        if exhausted:
+            if len(block):
+                yield block
+            return
+        tail = block[:, 0] == block[-1, 0]
+        carry = block[tail]
+        if not tail.all():
+            yield block[~tail]
+
+
+def _resize(matrix, size):
+    if matrix.shape[0] < size:
+        matrix.resize((size, size))
+    return matrix
+
+
+def _cooccurrence(block, size):
+    """Product x product counts for one chunk of order lines"""
+    _, rows = np.unique(block[:, 0], return_inverse=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(block), dtype=np.int32), (rows, block[:, 1])),
+        shape=(rows.max() + 1, size)
+    )
+    # Buying two of something is still one order holding it
+    incidence.data[:] = 1
+    return (incidence.T @ incidence).tocsr()
+
+
+def accumulate(counts, since, recent_cutoff, counted=(), chunk_size=CHUNK_SIZE):
+    """
+    Fold the lines of every order created from `since` into `counts`,
+    except the orders in `counted`. Returns the new counts, the last order
+    id seen, the lines read, the products touched and the ids of the
+    orders created from `recent_cutoff` that are now counted.
+    """
+    counted = np.array(sorted(counted), dtype=np.int64)
+    last_order_id = 0
+    lines = 0
+    touched = []
+    recent = []
+    for block in _order_chunks(since, recent_cutoff, chunk_size):
+        recent.append(np.unique(block[block[:, 2] == 1, 0]))
+        block = block[~np.isin(block[:, 0], counted)]
+        if not len(block):
+            continue
+        size = max(counts.shape[0], int(block[:, 1].max()) + 1)
+        counts = _resize(counts, size) + _cooccurrence(block, size)
+        last_order_id = int(block[-1, 0])
+        lines += len(block)
+        touched.append(np.unique(block[:, 1]))
+    touched = np.unique(np.concatenate(touched)) if touched else np.empty(0, dtype=np.int64)
+    recent = np.unique(np.concatenate(recent)).tolist() if recent else []
+    return counts.tocsr(), last_order_id, lines, touched, recent
+
+
+def top_neighbours(counts, rows, top_k=TOP_K):
+    """
+    Yield (product_id, related_id, score) triples, best first, for the
+    given rows of the count matrix. Rows are scored ROW_BLOCK at a time.
+    """
+    frequency = counts.diagonal().astype(np.float64)
+    norm = np.zeros_like(frequency)
+    norm[frequency > 0] = 1 / np.sqrt(frequency[frequency > 0])
+
+    for start in range(0, len(rows), ROW_BLOCK):
+        block_rows = rows[start:start + ROW_BLOCK]
+        scores = sparse.diags(norm[block_rows]) @ counts[block_rows].astype(np.float64) @ sparse.diags(norm)
+        scores = scores.tocoo()
+        products = block_rows[scores.row]
+        keep = scores.col != products
+        products, related, data = products[keep], scores.col[keep], scores.data[keep]
+
+        # Sort by product, best score first, then keep each product's first K
+        order = np.lexsort((related, -data, products))
+        products, related, data = products[order], related[order], data[order]
+        starts = np.flatnonzero(np.r_[True, products[1:] != products[:-1]])
+        rank = np.arange(len(products)) - np.repeat(starts, np.diff(np.r_[starts, len(products)]))
+        keep = rank < top_k
+        yield from zip(products[keep].tolist(), related[keep].tolist(), data[keep].tolist())
+
+
+def write_neighbours(counts, rows, top_k=TOP_K, batch_size=1000, replace=True):
+    """
+    Write fresh top-K lists for `rows`, replacing their stored neighbours
+    unless `replace` is false (the table was just emptied)
+    """
+    existing = set(Product.objects.values_list('pk', flat=True))
+    rows = np.array(sorted(existing.intersection(rows.tolist())), dtype=np.int64)
+    if replace:
+        for start in range(0, len(rows), DELETE_BATCH_SIZE):
+            RelatedProduct.objects.filter(product_id__in=rows[start:start + DELETE_BATCH_SIZE].tolist()).delete()
+    written = 0
+    batch = []
+    for product_id, related_id, score in top_neighbours(counts, rows, top_k):
+        if related_id not in existing:
+            continue
+        batch.append(RelatedProduct(product_id=product_id, related_id=related_id, score=score))
+        if len(batch) >= batch_size:
+            RelatedProduct.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        RelatedProduct.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def load_state():
+    state = CoPurchaseMatrix.objects.order_by('-pk').first()
+    if state is None:
+        return None, sparse.csr_matrix((0, 0), dtype=np.int32)
+    return state, sparse.load_npz(io.BytesIO(bytes(state.data))).tocsr()
+
+
+def save_state(state, counts, last_order_id, watermark, recent_orders):
+    buffer = io.BytesIO()
+    sparse.save_npz(buffer, counts, compressed=True)
+    if state is None:
+        state = CoPurchaseMatrix()
+    state.data = buffer.getvalue()
+    state.last_order_id = max(state.last_order_id, last_order_id)
+    state.watermark = watermark
+    state.recent_orders = recent_orders
+    state.save()
+    return state
+
+
+def build_related_products(incremental=False, top_k=TOP_K, chunk_size=CHUNK_SIZE):
+    """
+    Rebuild (or, with `incremental`, update) the RelatedProduct table.
+    Returns a dict of order lines read, products rescored and rows written.
+    """
+    started = timezone.now()
+    state, counts = load_state()
+    # States saved before the watermark existed are rebuilt once
+    incremental = incremental and state is not None and state.watermark is not None
+    if incremental:
+        since, counted = state.watermark - ORDER_OVERLAP, state.recent_orders
+    else:
+        counts, since, counted = sparse.csr_matrix((0, 0), dtype=np.int32), None, ()
+
+    counts, last_order_id, lines, touched, recent = accumulate(
+        counts, since, started - ORDER_OVERLAP, counted, chunk_size
+    )
+
+    if incremental:
+        # New orders shift the counts of the products they hold and, via
+        # the normalisation, the scores of every neighbour of those products
+        rows = np.unique(np.concatenate([touched, counts[touched].indices]))
+    else:
+        RelatedProduct.objects.all().delete()
+        rows = np.flatnonzero(counts.diagonal())
+
+    written = write_neighbours(counts, rows, top_k, replace=incremental) if len(rows) else 0
+    state = save_state(state, counts, last_order_id, started, recent)
+    last_order_id = state.last_order_id
+    if len(rows):
+        # Product pages show the new neighbours
+        bump_version()
+    return {'lines': lines, 'products': len(rows), 'neighbours': written, 'last_order_id': last_order_id}
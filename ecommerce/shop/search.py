@@ -0,0 +1,140 @@
+import re
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from .models import Product
+
+# Full-text search over product name, brand, category and description.
+# PostgreSQL keeps a weighted tsvector on shop_product (GIN indexed),
+# SQLite keeps an FTS5 table keyed by product id. Both are created by
+# migration 0002 and kept current by the receivers in shop.signals.
+
+SEARCH_CONFIG = 'english'
+# Product fields (besides brand and category names) in the search document
+INDEXED_FIELDS = ('name', 'description', 'category_id', 'brand_id')
+FTS_TABLE = 'shop_product_fts'
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('{config}', coalesce(p.name, '')), 'A') || "
+    "setweight(to_tsvector('{config}', coalesce(b.name, '')), 'B') || "
+    "setweight(to_tsvector('{config}', coalesce(c.name, '')), 'B') || "
+    "setweight(to_tsvector('{config}', coalesce(p.description, '')), 'C')"
+).format(config=SEARCH_CONFIG)
+
+# bm25() weights for the name, brand, category and description columns
+FTS_WEIGHTS = '10.0, 5.0, 5.0, 1.0'
+
+
+def _terms(search):
+    """Split raw user input into safe search terms"""
+    return re.findall(r'\w+', search.lower())
+
+
+def _reindex(where, params):
+    """Rebuild the search document for every product matching `where`"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"UPDATE shop_product AS p SET search_vector = {PG_DOCUMENT} "
+                f"FROM shop_brand AS b, shop_category AS c "
+                f"WHERE b.id = p.brand_id AND c.id = p.category_id AND {where}",
+                params
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+                f"(SELECT p.id FROM shop_product AS p WHERE {where})",
+                params
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, brand, category, description) "
+                f"SELECT p.id, p.name, b.name, c.name, p.description "
+                f"FROM shop_product AS p "
+                f"JOIN shop_brand AS b ON b.id = p.brand_id "
+                f"JOIN shop_category AS c ON c.id = p.category_id "
+                f"WHERE {where}",
+                params
+            )
+
+
+def index_products(product_ids):
+    """Refresh the search documents of the given products"""
+    product_ids = list(product_ids)
+    if product_ids:
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        _reindex(f"p.id IN ({placeholders})", product_ids)
+
+
+def index_category(category_id):
+    """Refresh the search documents of every product in a category"""
+    _reindex("p.category_id = %s", [category_id])
+
+
+def index_brand(brand_id):
+    """Refresh the search documents of every product of a brand"""
+    _reindex("p.brand_id = %s", [brand_id])
+
+
+def rebuild_index():
+    """Refresh the search documents of the whole catalog"""
+    _reindex("1 = 1", [])
+
+
+def remove_products(product_ids):
+    """Drop deleted products from the search index"""
+    product_ids = list(product_ids)
+    if product_ids and connection.vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})",
+                product_ids
+            )
+
+
+def search_products(queryset, search):
+    """
+    Filter a Product (or ProductCard) queryset down to matches for
+    `search`, annotated with `search_rank` and ordered best match first.
+    Every term is prefix matched, so "head" finds "headphones".
+    """
+    terms = _terms(search)
+    if not terms:
+        return queryset.none()
+
+    meta = queryset.model._meta
+    pk = f'{meta.db_table}.{meta.pk.column}'
+
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        ts = f"to_tsquery('{SEARCH_CONFIG}', %s)"
+        if meta.db_table == 'shop_product':
+            match_sql = f"shop_product.search_vector @@ {ts}"
+            vector = "shop_product.search_vector"
+        else:
+            match_sql = f"{pk} IN (SELECT id FROM shop_product WHERE search_vector @@ {ts})"
+            vector = f"(SELECT search_vector FROM shop_product WHERE shop_product.id = {pk})"
+        match = RawSQL(match_sql, [tsquery], output_field=BooleanField())
+        rank = RawSQL(f"ts_rank_cd({vector}, {ts})", [tsquery], output_field=FloatField())
+    elif connection.vendor == 'sqlite':
+        fts_query = ' '.join(f'"{term}"*' for term in terms)
+        match = RawSQL(
+            f"{pk} IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)",
+            [fts_query], output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f"(SELECT -bm25({FTS_TABLE}, {FTS_WEIGHTS}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = {pk})",
+            [fts_query], output_field=FloatField()
+        )
+    else:
+        # No full-text support on this backend, fall back to a plain scan
+        matches = Product.objects.filter(
+            Q(name__icontains=search) |
+            Q(description__icontains=search) |
+            Q(category__name__icontains=search) |
+            Q(brand__name__icontains=search)
+        )
+        return queryset.filter(pk__in=matches.values('pk'))
+
+    return queryset.filter(match).annotate(search_rank=rank).order_by('-search_rank', '-pk')
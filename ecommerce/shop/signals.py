@@ -1,52 +1,36 @@
+from django.db import transaction
+from django.db.models import QuerySet
 from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Order, OrderItem, OrderStatus, Product
+from django.contrib.auth.signals import user_logged_in
+from .models import Order, OrderItem, OrderStatus, Product, ProductCard, ProductImage, Category, Brand, LowStockEvent, StockMovement
+from . import autocomplete, search
+from .cards import refresh_cards
+from .cart import merge_session_cart
+from .conditional import bump_version
+from .inventory import release_stock, shard_stock, spread_stock
+from .ledger import record_movements
+from .utils.email import send_status_notification
 
-@receiver(post_save, sender=OrderItem)
-def update_product_stock(sender, instance, created, **kwargs):
-    """
-    Update product stock when an order item is created or updated
-    """
-    if created:  # Only reduce stock when the order item is first created
-        product = instance.product
-        product.stock -= instance.quantity
-        product.save()
+def _deletes_products(origin):
+    """Whether deleting `origin` (an instance or queryset) cascades to products"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Product, Category, Brand)
 
 @receiver(post_delete, sender=OrderItem)
-def restore_product_stock(sender, instance, **kwargs):
+def restore_product_stock(sender, instance, origin=None, **kwargs):
     """
-    Restore product stock when an order item is deleted
+    Put a deleted order item's quantity back into stock. Checkout takes
+    stock with shop.inventory.reserve_stock, so creating items does not.
+    Items deleted along with their product have no stock to go back to,
+    and a ledger row for that product would outlive it.
     """
-    product = instance.product
-    product.stock += instance.quantity
-    product.save()
-
-@receiver(pre_save, sender=Product)
-def check_low_stock(sender, instance, **kwargs):
-    """
-    Check if product stock is low and send notification
-    """
-    try:
-        old_instance = Product.objects.get(pk=instance.pk)
-        # Check if stock has been updated
-        if old_instance.stock != instance.stock and instance.stock <= 5:
-            # Send low stock notification
-            subject = f'Low Stock Alert: {instance.name}'
-            message = f'Product {instance.name} has low stock ({instance.stock} remaining)'
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.ADMIN_EMAIL],
-                fail_silently=True,
-            )
-    except Product.DoesNotExist:
-        pass  # New product being created
+    if origin is not None and _deletes_products(origin):
+        return
+    release_stock({instance.product_id: instance.quantity}, order_id=instance.order_id)
 
 @receiver(post_save, sender=Order)
 def order_status_notification(sender, instance, created, **kwargs):
@@ -54,25 +38,7 @@ def order_status_notification(sender, instance, created, **kwargs):
     Send notifications when order status changes
     """
     if not created and instance.status != instance.tracker.previous('status'):
-        # Order status has changed
-        context = {
-            'order': instance,
-            'status': instance.get_status_display(),
-            'tracking_number': instance.tracking_number
-        }
-        
-        # Send email notification
-        html_message = render_to_string('shop/email/order_status_update.html', context)
-        plain_message = render_to_string('shop/email/order_status_update.txt', context)
-        
-        send_mail(
-            f'Order #{instance.id} Status Update',
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [instance.email],
-            html_message=html_message,
-            fail_silently=True,
-        )
+        send_status_notification(instance)
 
 @receiver(post_save, sender=OrderStatus)
 def create_order_status_history(sender, instance, created, **kwargs):
@@ -89,18 +55,187 @@ def create_order_status_history(sender, instance, created, **kwargs):
         order.save()
 
 @receiver(pre_save, sender=Product)
-def handle_product_availability(sender, instance, **kwargs):
+def handle_stock_change(sender, instance, **kwargs):
     """
-    Automatically update product availability based on stock
+    Update availability from stock, diffing against the values the product
+    was loaded with instead of re-reading it
     """
+    adding = instance._state.adding
+    previous_stock = None if adding else instance.tracker.previous('stock')
+
     if instance.stock <= 0:
         instance.available = False
-    elif instance.stock > 0 and not instance.available:
-        # Only set to True if it was previously False and now has stock
-        try:
-            old_instance = Product.objects.get(pk=instance.pk)
-            if old_instance.stock <= 0:
-                instance.available = True
-        except Product.DoesNotExist:
-            # New product being created with stock
-            instance.available = True
\ No newline at end of file
+    elif not instance.available and (adding or (previous_stock is not None and previous_stock <= 0)):
+        # New with stock, or back in stock after selling out
+        instance.available = True
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, created, **kwargs):
+    """
+    Enter stock set by hand (admin edits, new products) in the inventory
+    ledger; checkout and cancellations record their own movements. A
+    sharded product's stock was its shards' sum, not the Product.stock
+    loaded, so this runs before spread_sharded_stock rewrites them.
+    """
+    if created:
+        record_movements({instance.pk: instance.stock}, StockMovement.RESTOCK)
+    elif instance.tracker.has_changed('stock'):
+        if instance.tracker.previous('stock_shards'):
+            previous = shard_stock(instance.pk)
+        else:
+            previous = instance.tracker.previous('stock') or 0
+        record_movements({instance.pk: instance.stock - previous}, StockMovement.ADJUSTMENT)
+
+@receiver(post_save, sender=Product)
+def spread_sharded_stock(sender, instance, created, **kwargs):
+    """
+    Stock set on a sharded product (e.g. in the admin) is split over its
+    counters; changing the shard count re-splits it
+    """
+    if not (instance.stock_shards or instance.tracker.previous('stock_shards')):
+        return
+    if created or instance.tracker.has_changed('stock') or instance.tracker.has_changed('stock_shards'):
+        spread_stock(instance.pk, instance.stock_shards, instance.stock)
+
+@receiver(post_save, sender=Product)
+def record_low_stock(sender, instance, created, **kwargs):
+    """
+    Queue a low stock event for the next digest when stock drops to the
+    threshold; send_low_stock_digest does the emailing. Restocks that
+    leave it under the threshold are not drops and record nothing.
+    """
+    if created or not settings.EMAIL_NOTIFICATIONS.get('LOW_STOCK_ALERT', True):
+        return
+    dropped = instance.stock < (instance.tracker.previous('stock') or 0)
+    if dropped and instance.stock <= settings.LOW_STOCK_THRESHOLD:
+        LowStockEvent.objects.create(product=instance, stock=instance.stock)
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, created, **kwargs):
+    """
+    Refresh the product's search document when its searchable text changes
+    """
+    if created or any(instance.tracker.has_changed(field) for field in search.INDEXED_FIELDS):
+        search.index_products([instance.pk])
+
+@receiver(post_save, sender=Product)
+def update_product_card(sender, instance, created, **kwargs):
+    """
+    Keep the denormalized listing card in step with the product
+    """
+    changed = set(instance.tracker.changed())
+    if not created and changed <= {'stock', 'available'}:
+        # Stock movements (e.g. checkout) copy two columns without a read;
+        # the card only looks different when the product goes in or out
+        # of stock
+        if changed:
+            fields = {'stock': instance.stock, 'available': instance.available}
+            was_in_stock = (instance.tracker.previous('stock') or 0) > 0
+            if 'available' in changed or was_in_stock != (instance.stock > 0):
+                fields['updated_at'] = timezone.now()
+            ProductCard.objects.filter(pk=instance.pk).update(**fields)
+        return
+    refresh_cards([instance.pk])
+
+@receiver(post_delete, sender=Product)
+def remove_product_search_index(sender, instance, **kwargs):
+    """
+    Drop a deleted product from the search index
+    """
+    search.remove_products([instance.pk])
+
+@receiver(post_save, sender=Category)
+def update_category_search_index(sender, instance, created, **kwargs):
+    """
+    Category names are part of every product's search document
+    """
+    if not created:
+        search.index_category(instance.pk)
+
+@receiver(post_save, sender=Brand)
+def update_brand_search_index(sender, instance, created, **kwargs):
+    """
+    Brand names are part of every product's search document
+    """
+    if not created:
+        search.index_brand(instance.pk)
+
+@receiver(post_save, sender=Category)
+def update_category_cards(sender, instance, created, **kwargs):
+    """
+    Copy a renamed category onto its products' cards in one UPDATE
+    """
+    if not created:
+        ProductCard.objects.filter(category_id=instance.pk).update(category_name=instance.name,
+                                                                  updated_at=timezone.now())
+
+@receiver(post_save, sender=Brand)
+def update_brand_cards(sender, instance, created, **kwargs):
+    """
+    Copy a renamed brand onto its products' cards in one UPDATE
+    """
+    if not created:
+        ProductCard.objects.filter(brand_id=instance.pk).update(brand_name=instance.name,
+                                                               updated_at=timezone.now())
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def update_autocomplete_index(sender, instance, **kwargs):
+    """
+    Patch the typeahead index once the save is committed
+    """
+    kind, pk = sender._meta.model_name, instance.pk
+    if kind == 'product' and not instance.available:
+        transaction.on_commit(lambda: autocomplete.index.remove(kind, pk))
+    else:
+        name, slug = instance.name, instance.slug
+        transaction.on_commit(lambda: autocomplete.index.update(kind, pk, name, slug))
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def remove_autocomplete_entry(sender, instance, **kwargs):
+    """
+    Drop a deleted name from the typeahead index once the delete is committed
+    """
+    kind, pk = sender._meta.model_name, instance.pk
+    transaction.on_commit(lambda: autocomplete.index.remove(kind, pk))
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def bump_catalog_version(sender, **kwargs):
+    """
+    Invalidate the ETags of catalog pages after a category or brand change;
+    product changes show in their own and their cards' updated_at
+    """
+    bump_version()
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product(sender, instance, **kwargs):
+    """
+    A product's gallery is part of its page, so changing it changes the
+    product's updated_at (and only that page's ETag)
+    """
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+def reset_image_renditions(sender, instance, **kwargs):
+    """
+    A replaced image has no renditions until generate_thumbnails renders it
+    """
+    if instance.pk is not None and instance.tracker.has_changed('image'):
+        instance.image_renditions = False
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """
+    Carry what was put in the cart before logging in over to the
+    customer's stored cart
+    """
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request, user)
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.utils import timezone
+from .models import LowStockEvent, Product
+
+# Low stock alerts, batched. Stock saves only queue a LowStockEvent (see
+# shop.signals); send_digest() turns everything queued since the last run
+# into one email listing each product once, at its current stock.
+
+KEEP_SENT_DAYS = 30
+
+
+def send_digest(now=None):
+    """
+    Email one digest of the pending low stock events and mark them sent.
+    Returns the number of products listed.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        pending = LowStockEvent.objects.select_for_update().filter(sent_at__isnull=True)
+        events = list(pending.values_list('pk', 'product_id'))
+        if not events:
+            return 0
+
+        # Products restocked since the event are left out
+        products = list(
+            Product.objects.filter(
+                pk__in={product_id for _, product_id in events},
+                stock__lte=settings.LOW_STOCK_THRESHOLD
+            ).only('name', 'stock').order_by('stock', 'name')
+        )
+        if products and settings.EMAIL_NOTIFICATIONS.get('LOW_STOCK_ALERT', True):
+            lines = [f'- {product.name}: {product.stock} remaining' for product in products]
+            send_mail(
+                f'Low Stock Alert: {len(products)} product{"s" if len(products) != 1 else ""}',
+                'The following products are at or below the low stock threshold '
+                f'({settings.LOW_STOCK_THRESHOLD}):\n\n' + '\n'.join(lines),
+                settings.DEFAULT_FROM_EMAIL,
+                [settings.ADMIN_EMAIL],
+            )
+        LowStockEvent.objects.filter(pk__in=[pk for pk, _ in events]).update(sent_at=now)
+
+    LowStockEvent.objects.filter(sent_at__lt=now - timedelta(days=KEEP_SENT_DAYS)).delete()
+    return len(products)
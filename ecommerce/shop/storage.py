@@ -0,0 +1,114 @@
+import hashlib
+import os
+import posixpath
+import secrets
+from django.core.files.storage import FileSystemStorage
+from io import BytesIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Content-addressed storage for product images. Uploads are stripped of
+# EXIF, XMP and other metadata, then stored under the SHA-256 of what is
+# left (products/<sha256>.<ext>), so the same picture uploaded twice is
+# one file and a URL always means the same bytes. Existing blobs are never
+# rewritten, and a name is never suffixed to make it unique.
+
+ORIENTATION = 0x0112
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif', 'AVIF': '.avif'}
+
+
+def strip_metadata(data):
+    """
+    Re-encode image bytes without metadata, applying any EXIF rotation
+    first. Returns (bytes, extension); non-images come back unchanged
+    with no extension.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        fmt = image.format
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        return data, None
+    if fmt not in EXTENSIONS or getattr(image, 'is_animated', False):
+        return data, EXTENSIONS.get(fmt)
+
+    orientation = image.getexif().get(ORIENTATION, 1)
+    rotated = image if orientation in (0, 1) else ImageOps.exif_transpose(image)
+    options = {}
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    if fmt == 'JPEG':
+        # Keep the original quantization tables unless the pixels moved
+        options['quality'] = 'keep' if rotated is image else 95
+    elif fmt in ('WEBP', 'AVIF'):
+        options['quality'] = 90
+        if fmt == 'WEBP' and image.info.get('lossless'):
+            options['lossless'] = True
+    elif fmt == 'PNG':
+        options['optimize'] = True
+
+    buffer = BytesIO()
+    rotated.save(buffer, format=fmt, **options)
+    return buffer.getvalue(), EXTENSIONS[fmt]
+
+
+def is_content_name(name):
+    """Whether `name` already is a content hash"""
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    return len(stem) == 64 and all(c in '0123456789abcdef' for c in stem)
+
+
+def content_name(name, data):
+    """Content-addressed name for `data` uploaded as `name`"""
+    directory = posixpath.dirname(name)
+    data, extension = strip_metadata(data)
+    extension = extension or posixpath.splitext(name)[1].lower()
+    digest = hashlib.sha256(data).hexdigest()
+    return posixpath.join(directory, f'{digest}{extension}'), data
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The same name always holds the same bytes, so reuse it
+        return name
+
+    def _save(self, name, content):
+        content.seek(0)
+        name, data = content_name(name, content.read())
+        return self.store(name, data)
+
+    def store(self, name, data):
+        """Write already processed bytes under their content name, once"""
+        if self.exists(name):
+            return name
+        # Not FileSystemStorage._save: when a concurrent upload of the same
+        # bytes creates the file first, it asks get_available_name() for
+        # another name, gets this one back and retries forever. Write a
+        # temporary file and link it into place instead; if the name is
+        # taken by then, it already holds these bytes.
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        if self.directory_permissions_mode is not None:
+            os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(directory, f'.{secrets.token_hex(8)}.tmp')
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            try:
+                os.link(temporary, path)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(temporary)
+        return name
+
+
+product_image_storage = ContentAddressedStorage()
+
+
+def get_product_image_storage():
+    return product_image_storage
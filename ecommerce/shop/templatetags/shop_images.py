@@ -0,0 +1,30 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+from ..thumbnails import rendition_names
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes='100vw', **attrs):
+    """
+    Render a product image as a <picture> offering the AVIF and WebP
+    renditions in every width, falling back to the original upload.
+    Images whose row does not have `<field>_renditions` set yet are
+    rendered as a plain <img>; the storage is never asked.
+    """
+    if not image:
+        return ''
+    img = format_html('<img src="{}" alt="{}" loading="lazy"{}>', image.url, alt, flatatt(attrs))
+    if not getattr(image.instance, f'{image.field.name}_renditions', False):
+        return img
+    sources = format_html_join(
+        '',
+        '<source type="image/{}" srcset="{}" sizes="{}">',
+        (
+            (fmt, ', '.join(f'{image.storage.url(path)} {width}w' for path, width in paths), sizes)
+            for fmt, paths in rendition_names(image.name).items()
+        )
+    )
+    return format_html('<picture>{}{}</picture>', sources, img)
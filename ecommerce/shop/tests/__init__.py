@@ -1,2 +1,22 @@
 """Shop app test package"""
-from shop.tests.test_orders import *
\ No newline at end of file
+from shop.tests.test_orders import *
+from shop.tests.test_search import *
+from shop.tests.test_pagination import *
+from shop.tests.test_facets import *
+from shop.tests.test_querysets import *
+from shop.tests.test_cart import *
+from shop.tests.test_sessions import *
+from shop.tests.test_cart_api import *
+from shop.tests.test_cards import *
+from shop.tests.test_related import *
+from shop.tests.test_autocomplete import *
+from shop.tests.test_conditional import *
+from shop.tests.test_thumbnails import *
+from shop.tests.test_media_storage import *
+from shop.tests.test_import import *
+from shop.tests.test_stock_tracking import *
+from shop.tests.test_low_stock import *
+from shop.tests.test_inventory import *
+from shop.tests.test_ledger import *
+from shop.tests.test_checkout_pipeline import *
+from shop.tests.test_outbox import *
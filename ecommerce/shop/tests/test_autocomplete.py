@@ -0,0 +1,125 @@
+import threading
+from unittest import mock
+from django.test import TestCase
+from django.urls import reverse
+from decimal import Decimal
+from shop import autocomplete
+from shop.inventory import release_stock, reserve_stock
+from shop.models import Product, Category, Brand
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        """A small catalog and a cold index"""
+        autocomplete.index.clear()
+        self.audio = Category.objects.create(name='Audio', slug='audio')
+        self.acme = Brand.objects.create(name='Acme Sound', slug='acme-sound')
+        self.headphones = self.product('Wireless Headphones', 'wireless-headphones')
+        self.speaker = self.product('Acme Speaker', 'acme-speaker')
+
+    def tearDown(self):
+        autocomplete.index.clear()
+
+    def product(self, name, slug, **kwargs):
+        return Product.objects.create(
+            name=name,
+            slug=slug,
+            description='Test Description',
+            price=Decimal('10.00'),
+            stock=5,
+            category=self.audio,
+            brand=self.acme,
+            **kwargs
+        )
+
+    def names(self, query):
+        return [result['name'] for result in autocomplete.suggest(query)]
+
+    def test_prefix_matches_any_word(self):
+        """Prefixes match the start of any word, name starts first"""
+        self.assertEqual(self.names('ac'), ['Acme Speaker', 'Acme Sound'])
+        self.assertEqual(self.names('head'), ['Wireless Headphones'])
+        self.assertEqual(self.names('wireless he'), ['Wireless Headphones'])
+        self.assertEqual(self.names('aud'), ['Audio'])
+        self.assertEqual(self.names('!!'), [])
+
+    def test_lookups_skip_the_database(self):
+        """Once built, suggestions are served from memory"""
+        self.names('a')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('shop:search_suggestions'), {'q': 'spe'})
+        self.assertEqual(response.json()['results'][0]['url'], self.speaker.get_absolute_url())
+
+    def test_patched_from_signals(self):
+        """Saves and deletes update a built index without a rebuild"""
+        self.names('a')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product('Studio Monitor', 'studio-monitor')
+            self.headphones.name = 'Noise Cancelling Headphones'
+            self.headphones.save()
+            self.speaker.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('stu'), ['Studio Monitor'])
+            self.assertEqual(self.names('wire'), [])
+            self.assertEqual(self.names('noise'), ['Noise Cancelling Headphones'])
+            self.assertEqual(self.names('acme'), ['Acme Sound'])
+
+    def test_unavailable_products_are_hidden(self):
+        """Products taken off sale drop out of the suggestions"""
+        self.names('a')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.headphones.available = False
+            self.headphones.save()
+        self.assertEqual(self.names('head'), [])
+
+    def test_sold_out_and_relisted_by_update(self):
+        """Checkouts and cancellations, which skip the signals, patch the index too"""
+        self.names('a')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.headphones.pk: 5}), {})
+        self.assertEqual(self.names('head'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock({self.headphones.pk: 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('head'), ['Wireless Headphones'])
+
+    def test_sharded_product_relisted_by_sync(self):
+        self.headphones.stock_shards = 2
+        self.headphones.save()
+        self.names('a')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.headphones.pk: 5}), {})
+        self.assertEqual(self.names('head'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock({self.headphones.pk: 1})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('head'), ['Wireless Headphones'])
+
+    def test_stale_index_rebuilds_in_the_background(self):
+        """A stale index keeps answering while one thread rebuilds it"""
+        self.names('a')
+        index = autocomplete.index
+        index._built_at -= index.max_age
+        reading = threading.Event()
+        release = threading.Event()
+        documents = {('category', self.audio.pk): autocomplete._suggestion('category', self.audio.pk, 'Hi-Fi', 'audio')}
+
+        def slow_read():
+            reading.set()
+            release.wait(5)
+            return documents
+
+        with mock.patch.object(index, '_documents_from_db', side_effect=slow_read) as read:
+            with self.assertNumQueries(0):
+                self.assertEqual(self.names('aud'), ['Audio'])
+                self.assertTrue(reading.wait(5))
+                # Served from the old index, without starting another rebuild
+                self.assertEqual(self.names('aud'), ['Audio'])
+            # A change made while the catalog is read survives the rebuild
+            index.update('brand', self.acme.pk, 'Acme Audio', 'acme-sound')
+            release.set()
+            index._refresh_thread.join(5)
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(self.names('hi'), ['Hi-Fi'])
+        self.assertEqual(self.names('acme'), ['Acme Audio'])
+        self.assertEqual(self.names('aud'), ['Acme Audio'])
@@ -0,0 +1,71 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from decimal import Decimal
+from io import StringIO
+from shop.models import Product, ProductCard, Category, Brand
+
+
+class ProductCardTests(TestCase):
+    def setUp(self):
+        """A discounted product and its card"""
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = Product.objects.create(
+            name='Headphones',
+            slug='headphones',
+            description='Closed back studio headphones',
+            price=Decimal('75.00'),
+            original_price=Decimal('100.00'),
+            stock=4,
+            category=self.category,
+            brand=self.brand
+        )
+
+    def test_card_created_with_product(self):
+        """Saving a product writes its flattened card"""
+        card = ProductCard.objects.get(pk=self.product.pk)
+        self.assertEqual(card.name, 'Headphones')
+        self.assertEqual(card.brand_name, 'Acme')
+        self.assertEqual(card.category_name, 'Audio')
+        self.assertEqual(card.discount_percentage, 25)
+
+    def test_card_follows_product_changes(self):
+        """Price and stock edits reach the card"""
+        self.product.price = Decimal('50.00')
+        self.product.stock = 0
+        self.product.save()
+        card = ProductCard.objects.get(pk=self.product.pk)
+        self.assertEqual(card.price, Decimal('50.00'))
+        self.assertEqual(card.discount_percentage, 50)
+        self.assertEqual(card.stock, 0)
+
+    def test_card_follows_renames(self):
+        """Renaming a brand or category updates the cards"""
+        self.brand.name = 'Globex'
+        self.brand.save()
+        self.category.name = 'Sound'
+        self.category.save()
+        card = ProductCard.objects.get(pk=self.product.pk)
+        self.assertEqual((card.brand_name, card.category_name), ('Globex', 'Sound'))
+
+    def test_card_removed_with_product(self):
+        """Deleting a product drops its card"""
+        self.product.delete()
+        self.assertFalse(ProductCard.objects.exists())
+
+    def test_rebuild_command(self):
+        """The rebuild command restores missing and stale cards"""
+        ProductCard.objects.all().delete()
+        Product.objects.filter(pk=self.product.pk).update(name='Studio Headphones')
+        out = StringIO()
+        call_command('rebuild_product_cards', stdout=out)
+        self.assertIn('Rebuilt 1 product cards', out.getvalue())
+        self.assertEqual(ProductCard.objects.get(pk=self.product.pk).name, 'Studio Headphones')
+
+    def test_product_list_reads_cards(self):
+        """The listing is served from the card table alone"""
+        response = self.client.get(reverse('shop:product_list'))
+        self.assertContains(response, 'Headphones')
+        self.assertContains(response, 'Acme')
+        self.assertIsInstance(response.context['products'][0], ProductCard)
@@ -0,0 +1,264 @@
+import json
+from copy import deepcopy
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from decimal import Decimal
+from django.template import Context, Template
+from shop.cart import Cart, CartLine, DatabaseCart, get_cart
+from shop.context_processors import cart as cart_context
+from shop.models import Brand, Category, CartItem, Product
+from shop.tests.test_checkout_pipeline import CHECKOUT_DATA
+from shop.tests.test_sessions import WriteCounter
+
+
+class CartTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.products = [
+            Product.objects.create(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description='Test Description',
+                price=Decimal('19.99') + i,
+                stock=10,
+                category=category,
+                brand=brand,
+            )
+            for i in range(3)
+        ]
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionStore()
+
+
+class CartTests(CartTestCase):
+    def test_compact_payload(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0], 2)
+        cart.add(self.products[1])
+        cart.add(self.products[0], 1)
+        self.assertEqual(self.request.session['cart'], {
+            'v': 2,
+            'ids': [self.products[0].id, self.products[1].id],
+            'qty': [3, 1],
+            'price': [1999, 2099],
+            'n': 4,
+            'sub': 8096,
+        })
+        self.assertEqual(len(cart), 4)
+        self.assertEqual(cart.get_total_price(), Decimal('80.96'))
+        self.assertEqual(cart.quantities(), {self.products[0].id: 3, self.products[1].id: 1})
+
+    def test_override_and_remove(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0], 2)
+        cart.add(self.products[1], 2)
+        cart.add(self.products[0], 5, override_quantity=True)
+        cart.remove(self.products[1])
+        cart.remove(self.products[2])
+        self.assertEqual(self.request.session['cart']['ids'], [self.products[0].id])
+        self.assertEqual(self.request.session['cart']['qty'], [5])
+        self.assertEqual(len(cart), 5)
+        self.assertEqual(cart.get_total_price(), Decimal('99.95'))
+
+    def test_iteration_does_not_touch_session(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0], 2)
+        cart.add(self.products[1])
+        self.request.session.modified = False
+        stored = deepcopy(self.request.session['cart'])
+
+        lines = list(Cart(self.request))
+        self.assertEqual([type(line) for line in lines], [CartLine, CartLine])
+        self.assertEqual(lines[0].product, self.products[0])
+        self.assertEqual(lines[0].price, Decimal('19.99'))
+        self.assertEqual(lines[0].total_price, Decimal('39.98'))
+        self.assertEqual(self.request.session['cart'], stored)
+        self.assertFalse(self.request.session.modified)
+        # Still plain JSON
+        json.dumps(self.request.session['cart'])
+
+    def test_deleted_product_skipped(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0])
+        cart.add(self.products[1])
+        self.products[0].delete()
+        self.assertEqual([line.product for line in cart], [self.products[1]])
+
+    def test_legacy_cart_converted(self):
+        self.request.session['cart'] = {
+            str(self.products[0].id): {'quantity': 2, 'price': '19.99'},
+            str(self.products[1].id): {'quantity': 1, 'price': '20.99'},
+            'broken': {'price': '1.00'},
+        }
+        cart = Cart(self.request)
+        self.assertEqual(self.request.session['cart'], {
+            'v': 2,
+            'ids': [self.products[0].id, self.products[1].id],
+            'qty': [2, 1],
+            'price': [1999, 2099],
+            'n': 3,
+            'sub': 6097,
+        })
+        self.assertEqual(cart.get_total_price(), Decimal('60.97'))
+
+    def test_version_1_cart_converted(self):
+        self.request.session['cart'] = {
+            'v': 1, 'ids': [self.products[0].id], 'qty': [2], 'price': [1999]
+        }
+        cart = Cart(self.request)
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.get_total_price(), Decimal('39.98'))
+
+    def test_smaller_than_legacy_format(self):
+        legacy = {str(product.id): {'quantity': 2, 'price': str(product.price)} for product in self.products}
+        cart = Cart(self.request)
+        for product in self.products:
+            cart.add(product, 2)
+        self.assertLess(len(json.dumps(self.request.session['cart'])), len(json.dumps(legacy)))
+
+    def test_clear(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0])
+        cart.clear()
+        self.assertNotIn('cart', self.request.session)
+        self.assertEqual(len(cart), 0)
+        cart.add(self.products[1])
+        self.assertEqual(self.request.session['cart']['ids'], [self.products[1].id])
+
+
+class CartMemoizationTests(CartTestCase):
+    def test_count_and_total_read_no_products(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0], 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cart), 2)
+            self.assertEqual(cart.get_total_price(), Decimal('39.98'))
+            self.assertEqual(cart.quantities(), {self.products[0].id: 2})
+
+    def test_lines_read_once(self):
+        cart = Cart(self.request)
+        cart.add(self.products[0], 2)
+        cart.add(self.products[1])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(cart)), 2)
+            self.assertEqual(len(list(cart)), 2)
+        # Changing the cart reads them again
+        cart.add(self.products[2])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(cart)), 3)
+
+    def test_one_cart_per_request(self):
+        self.assertIs(get_cart(self.request), get_cart(self.request))
+
+    def test_context_processor_is_lazy(self):
+        context = cart_context(self.request)
+        self.assertFalse(hasattr(self.request, '_cart'))
+        get_cart(self.request).add(self.products[0], 3)
+        with self.assertNumQueries(0):
+            rendered = Template('{{ cart|length }} {{ cart.get_total_price }}').render(Context(context))
+        self.assertEqual(rendered, '3 59.97')
+
+
+class DatabaseCartTests(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'testpass123')
+        self.request.user = self.user
+
+    def add(self, client, product, quantity=1, override=False):
+        return client.post(reverse('shop:cart_add', args=[product.id]), {'quantity': quantity, 'override': override})
+
+    def test_signed_in_customers_get_stored_cart(self):
+        self.assertIsInstance(get_cart(self.request), DatabaseCart)
+
+    @override_settings(CART_USER_BACKEND=None)
+    def test_backend_can_be_turned_off(self):
+        self.assertIs(type(get_cart(self.request)), Cart)
+
+    def test_rows_per_line(self):
+        cart = DatabaseCart(self.request)
+        cart.add(self.products[0], 2)
+        cart.add(self.products[1])
+        cart.add(self.products[0], 5, override_quantity=True)
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity', 'price')),
+            [(self.products[0].id, 5, Decimal('19.99')), (self.products[1].id, 1, Decimal('20.99'))]
+        )
+        self.assertNotIn('cart', self.request.session)
+
+        cart = DatabaseCart(self.request)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(cart), 6)
+            self.assertEqual(cart.get_total_price(), Decimal('120.94'))
+        self.assertEqual([line.quantity for line in cart], [5, 1])
+
+        cart.remove(self.products[0])
+        self.assertEqual(list(CartItem.objects.values_list('product_id', flat=True)), [self.products[1].id])
+        cart.clear()
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(len(cart), 0)
+
+    def test_add_and_remove_write_one_row(self):
+        self.client.login(username='buyer', password='testpass123')
+        self.add(self.client, self.products[0])
+        for request in (
+            lambda: self.add(self.client, self.products[0], 3),
+            lambda: self.add(self.client, self.products[1]),
+            lambda: self.client.get(reverse('shop:cart_remove', args=[self.products[0].id])),
+        ):
+            counter = WriteCounter()
+            with connection.execute_wrapper(counter):
+                request()
+            self.assertEqual(counter.count, 1)
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [1])
+
+    def test_concurrent_adds_add_up(self):
+        """Adds from carts read before each other's writes all count"""
+        DatabaseCart(self.request).add(self.products[0], 1)
+        first, second, third = (DatabaseCart(self.request) for _ in range(3))
+        for cart in (first, second, third):
+            len(cart)
+        first.add(self.products[0], 2)
+        second.add(self.products[0], 3)
+        # a line another tab added, and one another tab removed
+        first.add(self.products[1], 1)
+        second.add(self.products[1], 2)
+        third.remove(self.products[0])
+        first.add(self.products[0], 4)
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity')),
+            [(self.products[1].id, 3), (self.products[0].id, 4)]
+        )
+
+    def test_cart_follows_customer(self):
+        self.client.login(username='buyer', password='testpass123')
+        self.add(self.client, self.products[0], 2)
+        other_device = type(self.client)()
+        other_device.login(username='buyer', password='testpass123')
+        response = other_device.get(reverse('shop:cart_detail'))
+        self.assertContains(response, self.products[0].name)
+
+    def test_merge_on_login(self):
+        DatabaseCart(self.request).add(self.products[0], 1)
+        self.add(self.client, self.products[0], 2)
+        self.add(self.client, self.products[2], 1)
+        self.products[2].delete()
+        self.add(self.client, self.products[1], 4)
+
+        self.client.login(username='buyer', password='testpass123')
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity')),
+            [(self.products[0].id, 3), (self.products[1].id, 4)]
+        )
+        self.assertNotIn('cart', self.client.session)
+
+    def test_checkout_empties_stored_cart(self):
+        self.client.login(username='buyer', password='testpass123')
+        self.add(self.client, self.products[0], 2)
+        self.client.post(reverse('shop:checkout'), CHECKOUT_DATA)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 8)
@@ -0,0 +1,109 @@
+import json
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from decimal import Decimal
+from shop.models import Brand, Category, CartItem, Product
+from shop.tests.test_sessions import WriteCounter
+
+
+def product_queries(context):
+    return [q['sql'] for q in context.captured_queries if 'FROM "shop_product"' in q['sql']]
+
+
+class CartApiTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.products = [
+            Product.objects.create(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description='Test Description',
+                price=Decimal('10.00') * (i + 1),
+                stock=10,
+                category=category,
+                brand=brand,
+            )
+            for i in range(3)
+        ]
+
+    def post(self, name, data):
+        return self.client.post(reverse(f'shop:{name}'), json.dumps(data), content_type='application/json')
+
+    def test_add_returns_changed_line(self):
+        self.post('cart_api_add', {'product_id': self.products[1].id, 'quantity': 1})
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('cart_api_add', {'product_id': self.products[0].id, 'quantity': 2})
+        self.assertEqual(len(product_queries(context)), 1)
+        self.assertEqual(response.json(), {
+            'count': 3,
+            'subtotal': '40.00',
+            'lines': [{'product_id': self.products[0].id, 'quantity': 2, 'price': '10.00', 'total_price': '20.00'}],
+        })
+
+    def test_update_sets_quantity(self):
+        self.post('cart_api_add', {'product_id': self.products[0].id, 'quantity': 2})
+        response = self.post('cart_api_update', {'product_id': self.products[0].id, 'quantity': 5})
+        self.assertEqual(response.json()['lines'][0]['quantity'], 5)
+        self.assertEqual(response.json()['count'], 5)
+
+    def test_remove_reads_no_products(self):
+        self.post('cart_api_add', {'product_id': self.products[0].id, 'quantity': 2})
+        self.post('cart_api_add', {'product_id': self.products[1].id, 'quantity': 1})
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('cart_api_remove', {'product_id': self.products[0].id})
+        self.assertEqual(product_queries(context), [])
+        self.assertEqual(response.json(), {
+            'count': 1, 'subtotal': '20.00', 'lines': [], 'removed': self.products[0].id
+        })
+
+    def test_bulk_add_one_lookup(self):
+        items = [{'product_id': product.id, 'quantity': 2} for product in self.products]
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('cart_api_bulk_add', {'items': items})
+        self.assertEqual(len(product_queries(context)), 1)
+        data = response.json()
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(data['subtotal'], '120.00')
+        self.assertEqual([line['product_id'] for line in data['lines']], [p.id for p in self.products])
+
+    def test_bulk_add_one_write_for_stored_cart(self):
+        get_user_model().objects.create_user('buyer', 'buyer@example.com', 'testpass123')
+        self.client.login(username='buyer', password='testpass123')
+        items = [{'product_id': product.id, 'quantity': 1} for product in self.products]
+        counter = WriteCounter()
+        with connection.execute_wrapper(counter):
+            self.post('cart_api_bulk_add', {'items': items + items[:1]})
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity')),
+            [(self.products[0].id, 2), (self.products[1].id, 1), (self.products[2].id, 1)]
+        )
+
+    def test_unknown_product_adds_nothing(self):
+        items = [{'product_id': self.products[0].id}, {'product_id': 999999}]
+        response = self.post('cart_api_bulk_add', {'items': items})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['missing'], [999999])
+        self.assertNotIn('cart', self.client.session)
+
+    def test_bad_requests(self):
+        product_id = self.products[0].id
+        self.assertEqual(self.post('cart_api_add', {'product_id': product_id, 'quantity': 0}).status_code, 400)
+        self.assertEqual(self.post('cart_api_add', {'product_id': 'x'}).status_code, 400)
+        self.assertEqual(self.post('cart_api_add', {'items': [{'product_id': product_id}] * 2}).status_code, 400)
+        self.assertEqual(self.post('cart_api_bulk_add', {'items': []}).status_code, 400)
+        response = self.client.post(reverse('shop:cart_api_add'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('shop:cart_api_add')).status_code, 405)
+
+    def test_pages_carry_api_hooks(self):
+        response = self.client.get(self.products[0].get_absolute_url())
+        self.assertContains(response, f'data-cart-add="{reverse("shop:cart_api_add")}"')
+        self.post('cart_api_add', {'product_id': self.products[0].id})
+        response = self.client.get(reverse('shop:cart_detail'))
+        self.assertContains(response, f'data-cart-line="{self.products[0].id}"')
+        self.assertContains(response, 'data-cart-subtotal')
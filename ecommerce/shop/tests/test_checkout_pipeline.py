@@ -0,0 +1,155 @@
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core import mail
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from decimal import Decimal
+from unittest import mock
+from shop.cart import Cart
+from shop.forms import CheckoutForm
+from shop.models import Brand, Category, Order, OrderStatus, OutgoingEmail, Product
+from shop.outbox import drain
+from shop.utils import order_processing
+from shop.utils.email import send_status_notification
+from shop.utils.order_processing import QUERY_BUDGET, place_order
+
+CHECKOUT_DATA = {
+    'first_name': 'Test',
+    'last_name': 'User',
+    'email': 'test@example.com',
+    'phone': '1234567890',
+    'address': '123 Test St',
+    'city': 'Test City',
+    'state': 'Test State',
+    'zip_code': '12345',
+    'payment_method': 'cash_on_delivery',
+    'shipping_method': 'standard'
+}
+
+
+class CheckoutPipelineTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('buyer', 'test@example.com', 'testpass123')
+        category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.products = [
+            Product.objects.create(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description='Test Description',
+                price=Decimal('10.00'),
+                stock=10,
+                category=category,
+                brand=brand,
+            )
+            for i in range(5)
+        ]
+        mail.outbox = []
+
+    def cart(self, products):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        cart = Cart(request)
+        for product in products:
+            cart.add(product, 2)
+        return cart
+
+    def place(self, products, **data):
+        form = CheckoutForm({**CHECKOUT_DATA, **data})
+        self.assertTrue(form.is_valid())
+        return place_order(form, self.cart(products), self.user)
+
+    def test_query_budget(self):
+        """Checkout stays within its budget and does not grow with the cart"""
+        small = self.place(self.products[:1])
+        large = self.place(self.products)
+        self.assertLessEqual(large.query_count, QUERY_BUDGET)
+        self.assertEqual(small.query_count, large.query_count)
+
+    def test_one_order_written_once(self):
+        order = self.place(self.products[:2])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(order.status, 'confirmed')
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(
+            list(OrderStatus.objects.filter(order=order).order_by('pk').values_list('status', flat=True)),
+            ['pending', 'confirmed']
+        )
+        # No receiver re-saved the order, so no status emails were queued
+        self.assertFalse(OutgoingEmail.objects.exists())
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products[:2]]).values_list('stock', flat=True)),
+            [8, 8]
+        )
+
+    def test_checkout_view_emails(self):
+        """The view queues the status notice and the confirmation with the order"""
+        self.client.login(username='buyer', password='testpass123')
+        self.client.post(reverse('shop:cart_add', args=[self.products[0].id]), {'quantity': 1, 'override': False})
+        response = self.client.post(reverse('shop:checkout'), CHECKOUT_DATA)
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('shop:order_confirmation', args=[order.id]))
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+        drain()
+        self.assertEqual(
+            [message.subject for message in mail.outbox],
+            [f'Order #{order.id} Status Update', f'[Swiftbuy] Order #{order.id} Confirmation']
+        )
+
+    def test_rolled_back_order_queues_no_email(self):
+        """Emails queued by notify() go when the order's transaction rolls back"""
+        def notify(order):
+            send_status_notification(order)
+            raise RuntimeError('worker died')
+        form = CheckoutForm(CHECKOUT_DATA)
+        self.assertTrue(form.is_valid())
+        with self.assertRaises(RuntimeError):
+            place_order(form, self.cart(self.products[:1]), self.user, notify=notify)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OutgoingEmail.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 10)
+
+    def test_forms_carry_distinct_tokens(self):
+        first = CheckoutForm().initial['checkout_token']
+        self.assertEqual(len(first), 32)
+        self.assertNotEqual(first, CheckoutForm().initial['checkout_token'])
+
+    def test_same_token_places_one_order(self):
+        order = self.place(self.products[:2], checkout_token='token-1')
+        self.assertEqual(order.checkout_token, 'token-1')
+        with self.assertNumQueries(1):
+            again = self.place(self.products[:2], checkout_token='token-1')
+        self.assertEqual(again.pk, order.pk)
+        self.assertTrue(again.replayed)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 8)
+
+    def test_concurrent_submission_returns_winner(self):
+        """A submission that loses the insert race returns the committed order"""
+        order = self.place(self.products[:1], checkout_token='token-1')
+        # As if the first order committed after this submission's lookup
+        with mock.patch.object(order_processing, 'placed_order',
+                               side_effect=[None, order_processing.placed_order(self.user, 'token-1')]):
+            again = self.place(self.products[:1], checkout_token='token-1')
+        self.assertEqual(again.pk, order.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 8)
+
+    def test_tokens_are_per_user(self):
+        self.place(self.products[:1], checkout_token='token-1')
+        other = get_user_model().objects.create_user('other', 'other@example.com', 'testpass123')
+        self.assertIsNone(order_processing.placed_order(other, 'token-1'))
+
+    def test_checkout_view_resubmission(self):
+        """Posting the same checkout form twice places and emails one order"""
+        self.client.login(username='buyer', password='testpass123')
+        self.client.post(reverse('shop:cart_add', args=[self.products[0].id]), {'quantity': 1, 'override': False})
+        data = {**CHECKOUT_DATA, 'checkout_token': 'token-1'}
+        first = self.client.post(reverse('shop:checkout'), data)
+        second = self.client.post(reverse('shop:checkout'), data)
+        order = Order.objects.get()
+        self.assertRedirects(first, reverse('shop:order_confirmation', args=[order.id]))
+        self.assertRedirects(second, reverse('shop:order_confirmation', args=[order.id]))
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 9)
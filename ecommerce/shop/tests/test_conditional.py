@@ -0,0 +1,140 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from decimal import Decimal
+from shop.inventory import reserve_stock
+from shop.models import Product, ProductImage, Category, Brand, ContentVersion, Order, OrderStatus
+from shop.tests.test_querysets import catalog_queries
+
+User = get_user_model()
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        """One product and one tracked order"""
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = Product.objects.create(
+            name='Headphones',
+            slug='headphones',
+            description='Test Description',
+            price=Decimal('50.00'),
+            stock=10,
+            category=self.category,
+            brand=brand
+        )
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.order = Order.objects.create(
+            user=self.user, first_name='Test', last_name='User', email='test@example.com',
+            phone='1234567890', address='123 Test St', city='Test City', state='TS',
+            zip_code='12345', tracking_number='TRK123'
+        )
+
+    def revalidate(self, url, data=None):
+        """Fetch a page, then fetch it again with its validators"""
+        first = self.client.get(url, data)
+        self.assertEqual(first.status_code, 200)
+        headers = {'if_none_match': first['ETag']}
+        if first.has_header('Last-Modified'):
+            headers['if_modified_since'] = first['Last-Modified']
+        return first, lambda: self.client.get(url, data, **{f'HTTP_{k.upper()}': v for k, v in headers.items()})
+
+    def test_product_list_not_modified(self):
+        """An unchanged listing is answered with 304 from one version read"""
+        first, again = self.revalidate(reverse('shop:product_list'))
+        self.assertIn('no-cache', first['Cache-Control'])
+        self.assertIn('Cookie', first['Vary'])
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(again().status_code, 304)
+        self.assertEqual(len(catalog_queries(context)), 1)
+
+    def test_catalog_change_invalidates(self):
+        """Editing a product gives every catalog page a new ETag"""
+        _, again = self.revalidate(reverse('shop:product_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('40.00')
+            self.product.save()
+        self.assertEqual(again().status_code, 200)
+
+    def test_product_detail_not_modified(self):
+        """Product pages revalidate on the product and catalog versions"""
+        _, again = self.revalidate(self.product.get_absolute_url())
+        self.assertEqual(again().status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Sound'
+            self.category.save()
+        self.assertEqual(again().status_code, 200)
+
+    def test_sale_only_changes_product_page(self):
+        """A sale that leaves the product in stock keeps listing ETags and the catalog counter"""
+        _, listing = self.revalidate(reverse('shop:product_list'))
+        _, page = self.revalidate(self.product.get_absolute_url())
+        version = ContentVersion.objects.get(name=ContentVersion.CATALOG).version
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.product.pk: 3}), {})
+        self.assertEqual(listing().status_code, 304)
+        self.assertEqual(page().status_code, 200)
+        self.assertEqual(ContentVersion.objects.get(name=ContentVersion.CATALOG).version, version)
+
+    def test_selling_out_changes_listing(self):
+        _, listing = self.revalidate(reverse('shop:product_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock({self.product.pk: 10})
+        self.assertEqual(listing().status_code, 200)
+
+    def test_stock_only_save_keeps_listing(self):
+        _, listing = self.revalidate(reverse('shop:product_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.stock = 4
+            self.product.save()
+        self.assertEqual(listing().status_code, 304)
+
+    def test_gallery_change_only_changes_product_page(self):
+        _, listing = self.revalidate(reverse('shop:product_list'))
+        _, page = self.revalidate(self.product.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/side.jpg')
+        self.assertEqual(listing().status_code, 304)
+        self.assertEqual(page().status_code, 200)
+
+    def test_related_card_change_changes_product_page(self):
+        """The related strip's cards are part of the product page's validators"""
+        related = Product.objects.create(
+            name='Speaker', slug='speaker', description='Test Description', price=Decimal('80.00'),
+            stock=5, category=self.category, brand=self.product.brand
+        )
+        _, page = self.revalidate(self.product.get_absolute_url())
+        self.assertEqual(page().status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            related.price = Decimal('60.00')
+            related.save()
+        response = page()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '60.00')
+
+    def test_new_related_card_changes_product_page(self):
+        _, page = self.revalidate(self.product.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='Speaker', slug='speaker', description='Test Description', price=Decimal('80.00'),
+                stock=5, category=self.category, brand=self.product.brand
+            )
+        self.assertEqual(page().status_code, 200)
+
+    def test_cart_changes_etag(self):
+        """A visitor's own cart changes the page they see"""
+        _, again = self.revalidate(self.product.get_absolute_url())
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 1, 'override': False})
+        response = again()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_track_order_not_modified(self):
+        """Tracking pages revalidate on the order and its status history"""
+        first, again = self.revalidate(reverse('shop:track_order'), {'order_number': 'TRK123'})
+        self.assertIn('private', first['Cache-Control'])
+        self.assertEqual(again().status_code, 304)
+        OrderStatus.objects.create(order=self.order, status='shipped', created_by=self.user)
+        self.assertEqual(again().status_code, 200)
@@ -0,0 +1,56 @@
+from django.test import TestCase
+from django.urls import reverse
+from decimal import Decimal
+from shop.models import Product, Category, Brand
+from shop.facets import facet_counts
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        """Two categories, two brands, products across price buckets"""
+        self.audio = Category.objects.create(name='Audio', slug='audio')
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+        self.acme = Brand.objects.create(name='Acme', slug='acme')
+        self.globex = Brand.objects.create(name='Globex', slug='globex')
+        catalog = [
+            ('a', self.audio, self.acme, '25.00', 10, True),
+            ('b', self.audio, self.acme, '75.00', 0, False),
+            ('c', self.audio, self.globex, '150.00', 3, True),
+            ('d', self.garden, self.globex, '600.00', 8, False),
+            ('e', self.garden, self.acme, '40.00', 1, False),
+        ]
+        for slug, category, brand, price, stock, featured in catalog:
+            Product.objects.create(
+                name=f'Product {slug}',
+                slug=slug,
+                description='Test Description',
+                price=Decimal(price),
+                stock=stock,
+                featured=featured,
+                category=category,
+                brand=brand
+            )
+
+    def test_counts_without_filters(self):
+        """Every option is counted over the whole catalog in one query"""
+        with self.assertNumQueries(1):
+            facets = facet_counts(Product.objects.all(), {})
+        self.assertEqual(facets['category'], {self.audio.pk: 3, self.garden.pk: 2})
+        self.assertEqual(facets['brand'], {self.acme.pk: 3, self.globex.pk: 2})
+        self.assertEqual(facets['price_range'], {'0-50': 2, '50-100': 1, '100-200': 1, '500+': 1})
+        self.assertEqual(facets['featured_only'], 2)
+        self.assertEqual(facets['available_only'], 4)
+
+    def test_facet_ignores_its_own_filter(self):
+        """Selecting a category still counts the other categories"""
+        facets = facet_counts(Product.objects.all(), {'category': self.audio, 'available_only': True})
+        self.assertEqual(facets['category'], {self.audio.pk: 2, self.garden.pk: 2})
+        self.assertEqual(facets['brand'], {self.acme.pk: 1, self.globex.pk: 1})
+        self.assertEqual(facets['available_only'], 2)
+
+    def test_product_list_labels(self):
+        """The sidebar shows the counts"""
+        response = self.client.get(reverse('shop:product_list'), {'brand': self.globex.pk})
+        self.assertContains(response, 'Audio (1)')
+        self.assertContains(response, 'Acme (3)')
+        self.assertContains(response, 'Over $500 (1)')
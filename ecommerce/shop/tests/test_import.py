@@ -0,0 +1,163 @@
+import json
+import os
+import tempfile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from io import StringIO
+from shop.importer import CatalogImporter
+from shop.inventory import reserve_stock, sync_sharded_totals
+from shop.ledger import ledger_stock
+from shop.models import Product, ProductCard, ProductImage, Category, Brand, StockShard
+from shop.search import search_products
+
+CSV_HEADER = 'name,slug,description,price,original_price,stock,category,brand\n'
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        """Three existing products with different availability"""
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+        for slug, stock, available in [('sold-out', 0, False), ('in-stock', 5, True), ('retired', 5, False)]:
+            Product.objects.create(
+                name=slug.title(), slug=slug, description='Old', price=Decimal('10.00'),
+                stock=stock, available=available, category=self.category, brand=self.brand
+            )
+        Product.objects.filter(slug='retired').update(available=False)
+
+    def write(self, content, suffix):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_csv_upsert_and_availability(self):
+        """Existing rows are updated and the availability rules applied in bulk"""
+        path = self.write(CSV_HEADER + (
+            'Sold Out,sold-out,Back again,12.50,,3,Audio,Acme\n'
+            'In Stock,in-stock,Gone,10.00,,0,Audio,Acme\n'
+            'Retired,retired,Still retired,10.00,,9,Audio,Acme\n'
+            'Garden Hose,,Twenty metres,25.00,30.00,7,Garden,Globex\n'
+            'Broken,,No price,,,1,Audio,Acme\n'
+        ), '.csv')
+        out = StringIO()
+        call_command('import_catalog', path, batch_size=2, stdout=out)
+        self.assertIn('Imported 4 products (1 new, 3 updated, 1 skipped)', out.getvalue())
+        self.assertIn('Line 6: price is required', out.getvalue())
+
+        products = {p.slug: p for p in Product.objects.all()}
+        self.assertEqual((products['sold-out'].stock, products['sold-out'].available), (3, True))
+        self.assertEqual(products['sold-out'].price, Decimal('12.50'))
+        self.assertFalse(products['in-stock'].available)
+        self.assertFalse(products['retired'].available)
+        hose = products['garden-hose']
+        self.assertTrue(hose.available)
+        self.assertEqual((hose.category.slug, hose.brand.name), ('garden', 'Globex'))
+
+        # Derived tables follow without per-row signals
+        self.assertEqual(ProductCard.objects.get(pk=hose.pk).brand_name, 'Globex')
+        self.assertEqual(list(search_products(Product.objects.all(), 'metres')), [hose])
+
+    def test_jsonl_gallery(self):
+        """JSONL records can carry gallery images"""
+        path = self.write(json.dumps({
+            'name': 'Speaker', 'price': '40', 'stock': 2, 'category': 'Audio', 'brand': 'Acme',
+            'image': 'products/speaker.jpg', 'images': ['products/a.jpg', 'products/b.jpg'],
+        }) + '\n', '.jsonl')
+        call_command('import_catalog', path, stdout=StringIO())
+        speaker = Product.objects.get(slug='speaker')
+        self.assertEqual(speaker.image.name, 'products/speaker.jpg')
+        self.assertEqual(ProductImage.objects.filter(product=speaker).count(), 2)
+
+    def test_bad_jsonl_lines_are_skipped(self):
+        """Malformed JSON and non-finite prices are reported per line; the rest imports"""
+        record = {'price': '40', 'stock': 2, 'category': 'Audio', 'brand': 'Acme'}
+        path = self.write('\n'.join([
+            json.dumps({**record, 'name': 'Speaker'}),
+            '{"name": "Truncated", "price": ',
+            json.dumps({**record, 'name': 'Priceless', 'price': 'NaN'}),
+            json.dumps({**record, 'name': 'Boundless', 'original_price': 'Infinity'}),
+            '["not", "an", "object"]',
+            json.dumps({**record, 'name': 'Tweeter'}),
+        ]) + '\n', '.jsonl')
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out)
+        self.assertIn('Imported 2 products (2 new, 0 updated, 4 skipped)', out.getvalue())
+        self.assertIn('Line 2: invalid JSON', out.getvalue())
+        self.assertIn("Line 3: invalid price: 'NaN'", out.getvalue())
+        self.assertIn("Line 4: invalid original_price: 'Infinity'", out.getvalue())
+        self.assertIn('Line 5: expected an object', out.getvalue())
+        self.assertEqual(Product.objects.filter(slug__in=['speaker', 'tweeter']).count(), 2)
+
+    def test_rows_that_do_not_fit_the_columns_are_skipped(self):
+        """Over-long names, unsluggable names and overflowing prices fail their row only"""
+        record = {'price': '40', 'stock': 2, 'category': 'Audio', 'brand': 'Acme'}
+        path = self.write('\n'.join([
+            json.dumps({**record, 'name': 'x' * 201}),
+            json.dumps({**record, 'name': '!!!'}),
+            json.dumps({**record, 'name': '???'}),
+            json.dumps({**record, 'name': 'Amplifier', 'price': '123456789.00'}),
+            json.dumps({**record, 'name': 'Studio Monitor ' * 10}),
+        ]) + '\n', '.jsonl')
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out)
+        self.assertIn('Imported 1 products (1 new, 0 updated, 4 skipped)', out.getvalue())
+        self.assertIn('Line 1: name is longer than 200 characters', out.getvalue())
+        self.assertIn("Line 2: slug is required when the name has no letters or digits: '!!!'", out.getvalue())
+        self.assertIn('Line 3: slug is required', out.getvalue())
+        self.assertIn("Line 4: price out of range: '123456789.00'", out.getvalue())
+        self.assertFalse(Product.objects.filter(slug='').exists())
+        # Long names get their slug cut to the column's length
+        monitor = Product.objects.get(name__startswith='Studio Monitor')
+        self.assertEqual(len(monitor.slug), 50)
+        self.assertFalse(monitor.slug.endswith('-'))
+
+    def test_optional_fields_follow_each_record(self):
+        """A JSONL record's own keys decide which optional fields it updates"""
+        Product.objects.filter(slug='in-stock').update(featured=True)
+        record = {'price': '10', 'stock': 5, 'category': 'Audio', 'brand': 'Acme'}
+        path = self.write('\n'.join([
+            json.dumps({**record, 'name': 'Sold Out', 'slug': 'sold-out', 'featured': True}),
+            json.dumps({**record, 'name': 'In Stock', 'slug': 'in-stock'}),
+            json.dumps({**record, 'name': 'Retired', 'slug': 'retired', 'image': 'products/retired.jpg'}),
+        ]) + '\n', '.jsonl')
+        call_command('import_catalog', path, stdout=StringIO())
+        products = {p.slug: p for p in Product.objects.all()}
+        self.assertTrue(products['sold-out'].featured)
+        self.assertTrue(products['in-stock'].featured)
+        self.assertFalse(products['retired'].featured)
+        self.assertEqual(products['retired'].image.name, 'products/retired.jpg')
+
+    def test_sharded_stock_is_spread(self):
+        """Imported stock of a sharded product goes to its shards and the ledger"""
+        product = Product.objects.get(slug='in-stock')
+        product.stock_shards = 2
+        product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock({product.pk: 1})
+        # Product.stock still says 5; the shards hold 4
+        path = self.write(CSV_HEADER + 'In Stock,in-stock,Restocked,10.00,,9,Audio,Acme\n', '.csv')
+        call_command('import_catalog', path, stdout=StringIO())
+        shards = StockShard.objects.filter(product=product).order_by('number').values_list('stock', flat=True)
+        self.assertEqual(list(shards), [5, 4])
+        sync_sharded_totals([product.pk])
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 9)
+        self.assertEqual(ledger_stock([product.pk]), {product.pk: 9})
+
+    def test_queries_per_batch_not_per_row(self):
+        """A batch costs the same number of queries whatever its size"""
+        def run(count, offset):
+            records = (
+                (i, {'name': f'Item {offset + i}', 'price': '5', 'stock': 1, 'category': 'Audio', 'brand': 'Acme'})
+                for i in range(count)
+            )
+            importer = CatalogImporter(batch_size=1000)
+            importer.categories, importer.brands = {'audio': self.category.pk}, {'acme': self.brand.pk}
+            with CaptureQueriesContext(connection) as context:
+                importer.run(records)
+            return len(context.captured_queries)
+        self.assertEqual(run(5, 0), run(50, 100))
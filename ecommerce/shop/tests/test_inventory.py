@@ -0,0 +1,294 @@
+import threading
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.forms import modelform_factory
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from decimal import Decimal
+from io import StringIO
+from shop.admin import ProductAdminForm
+from shop.inventory import available_stock, hold_stock, release_stock, reserve_stock
+from shop.ledger import ledger_stock, reconcile
+from shop.models import (
+    Brand, Category, LowStockEvent, Order, OrderItem, Product, ProductCard, StockHold, StockShard
+)
+
+
+class InventoryFixtures:
+    def setUp(self):
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+        self.headphones = self.create('headphones', stock=10)
+        self.speaker = self.create('speaker', stock=2)
+
+    def create(self, slug, **kwargs):
+        return Product.objects.create(
+            name=slug.title(),
+            slug=slug,
+            description='Test Description',
+            price=Decimal('20.00'),
+            category=self.category,
+            brand=self.brand,
+            **kwargs
+        )
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', 'available').get(pk=product.pk)
+
+
+class InventoryTestCase(InventoryFixtures, TestCase):
+    pass
+
+
+class ReserveStockTests(InventoryTestCase):
+    def test_whole_cart_in_one_update(self):
+        """Every product is decremented by a single guarded UPDATE"""
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(reserve_stock({self.headphones.pk: 3, self.speaker.pk: 1}), {})
+        updates = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE "shop_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'FOR UPDATE' in query['sql']])
+        self.assertEqual(self.stock(self.headphones), (7, True))
+        self.assertEqual(self.stock(self.speaker), (1, True))
+
+    def test_selling_out_hides_product(self):
+        """The same statement hides products it takes to zero"""
+        reserve_stock({self.speaker.pk: 2})
+        self.assertEqual(self.stock(self.speaker), (0, False))
+        card = ProductCard.objects.get(pk=self.speaker.pk)
+        self.assertEqual((card.stock, card.available), (0, False))
+        self.assertTrue(LowStockEvent.objects.filter(product=self.speaker, stock=0).exists())
+
+    def test_shortage_reserves_nothing(self):
+        """A cart that cannot be covered is reported and leaves all stock alone"""
+        hidden = self.create('radio', stock=5)
+        hidden.available = False
+        hidden.save()
+        missing = reserve_stock({self.headphones.pk: 3, self.speaker.pk: 5, hidden.pk: 1})
+        self.assertEqual(missing, {self.speaker.pk: 2, hidden.pk: 0})
+        self.assertEqual(self.stock(self.headphones), (10, True))
+        self.assertEqual(self.stock(self.speaker), (2, True))
+
+    def test_release_lists_sold_out_product_again(self):
+        reserve_stock({self.speaker.pk: 2})
+        release_stock({self.speaker.pk: 2})
+        self.assertEqual(self.stock(self.speaker), (2, True))
+        self.assertTrue(ProductCard.objects.get(pk=self.speaker.pk).available)
+
+    def test_order_items_do_not_touch_stock(self):
+        """Only the reservation decrements; deleting an item puts it back"""
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret')
+        order = Order.objects.create(
+            user=user, first_name='Test', last_name='User', email='buyer@example.com',
+            phone='1234567890', address='1 Street', city='City', state='State', zip_code='12345',
+            subtotal=Decimal('40.00'), total_amount=Decimal('40.00'), tracking_number='TRACK12345'
+        )
+        reserve_stock({self.headphones.pk: 2})
+        item = OrderItem.objects.create(order=order, product=self.headphones, price=Decimal('20.00'), quantity=2)
+        self.assertEqual(self.stock(self.headphones), (8, True))
+        item.delete()
+        self.assertEqual(self.stock(self.headphones), (10, True))
+
+
+class StockHoldTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'secret')
+
+    def test_holds_count_against_other_customers(self):
+        """Stock held by one customer is not on offer to another"""
+        self.assertEqual(hold_stock(self.alice, {self.speaker.pk: 2}), {})
+        self.assertEqual(available_stock([self.speaker.pk], exclude_user=self.bob), {self.speaker.pk: 0})
+        self.assertEqual(hold_stock(self.bob, {self.speaker.pk: 1}), {self.speaker.pk: 0})
+        self.assertEqual(reserve_stock({self.speaker.pk: 1}, user=self.bob), {self.speaker.pk: 0})
+        self.assertEqual(self.stock(self.speaker), (2, True))
+
+    def test_holder_converts_hold_to_decrement(self):
+        """Reserving an order uses the holder's own holds and drops them"""
+        hold_stock(self.alice, {self.speaker.pk: 2, self.headphones.pk: 1})
+        self.assertEqual(reserve_stock({self.speaker.pk: 2, self.headphones.pk: 1}, user=self.alice), {})
+        self.assertEqual(self.stock(self.speaker), (0, False))
+        self.assertFalse(StockHold.objects.filter(user=self.alice).exists())
+
+    def test_reopening_checkout_replaces_holds(self):
+        hold_stock(self.alice, {self.speaker.pk: 2})
+        hold_stock(self.alice, {self.headphones.pk: 1})
+        self.assertEqual(list(StockHold.objects.values_list('product_id', flat=True)), [self.headphones.pk])
+
+    def test_expired_holds_stop_counting_and_are_swept(self):
+        hold_stock(self.alice, {self.speaker.pk: 2}, seconds=60)
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available_stock([self.speaker.pk], exclude_user=self.bob), {self.speaker.pk: 2})
+        out = StringIO()
+        call_command('release_expired_holds', stdout=out)
+        self.assertIn('Released 1 expired holds', out.getvalue())
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_free_stock_is_one_query(self):
+        """Availability sums holds in the database, whatever their number"""
+        StockHold.objects.bulk_create([
+            StockHold(product=self.headphones, user=self.alice, quantity=1,
+                      expires_at=timezone.now() + timedelta(minutes=5))
+            for _ in range(50)
+        ])
+        with self.assertNumQueries(1):
+            free = available_stock([self.headphones.pk, self.speaker.pk], exclude_user=self.bob)
+        self.assertEqual(free, {self.headphones.pk: -40, self.speaker.pk: 2})
+
+    def test_removing_a_line_releases_its_hold(self):
+        hold_stock(self.alice, {self.speaker.pk: 2, self.headphones.pk: 1})
+        self.client.force_login(self.alice)
+        self.client.post(reverse('shop:cart_remove', args=[self.speaker.pk]))
+        self.assertEqual(list(StockHold.objects.values_list('product_id', flat=True)), [self.headphones.pk])
+        self.client.post(reverse('shop:cart_api_remove'), {'product_id': self.headphones.pk},
+                         content_type='application/json')
+        self.assertFalse(StockHold.objects.exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentHoldTests(InventoryFixtures, TransactionTestCase):
+    def test_concurrent_holds_cannot_both_take_the_last_units(self):
+        """A hold started while another is uncommitted waits for it and sees it"""
+        User = get_user_model()
+        alice = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        bob = User.objects.create_user('bob', 'bob@example.com', 'secret')
+        held, started = threading.Event(), threading.Event()
+        results = {}
+
+        def first():
+            try:
+                with transaction.atomic():
+                    results['alice'] = hold_stock(alice, {self.speaker.pk: 2})
+                    held.set()
+                    started.wait(5)
+                    # give the second hold time to reach the database
+                    time.sleep(0.5)
+            finally:
+                connection.close()
+
+        def second():
+            try:
+                held.wait(5)
+                started.set()
+                results['bob'] = hold_stock(bob, {self.speaker.pk: 1})
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {'alice': {}, 'bob': {self.speaker.pk: 0}})
+        self.assertEqual(list(StockHold.objects.values_list('user__username', flat=True)), ['alice'])
+
+
+class ShardedStockTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headphones.stock_shards = 4
+        self.headphones.save()
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.headphones).order_by('number').values_list('stock', flat=True))
+
+    def test_stock_is_split_over_shards(self):
+        """Saving a sharded product spreads its stock evenly"""
+        self.assertEqual(self.shards(), [3, 3, 2, 2])
+        self.headphones.stock = 5
+        self.headphones.save()
+        self.assertEqual(self.shards(), [2, 1, 1, 1])
+
+    def test_checkout_touches_one_shard(self):
+        """A line a shard can cover decrements that shard and not the product row"""
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertEqual(reserve_stock({self.headphones.pk: 2}), {})
+        product_updates = [query['sql'] for query in context.captured_queries
+                           if query['sql'].startswith('UPDATE "shop_product"')]
+        self.assertEqual(product_updates, [])
+        changed = [(before, after) for before, after in zip([3, 3, 2, 2], self.shards()) if before != after]
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(changed[0][0] - changed[0][1], 2)
+
+        # The product row is not written when the order commits either...
+        with CaptureQueriesContext(connection) as context:
+            for callback in callbacks:
+                callback()
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(self.stock(self.headphones), (10, True))
+
+        # ...but caught up by the periodic sync
+        out = StringIO()
+        call_command('sync_sharded_stock', stdout=out)
+        self.assertIn('Synced the stock of 1 sharded products', out.getvalue())
+        self.assertEqual(self.stock(self.headphones), (8, True))
+        self.assertEqual(ProductCard.objects.get(pk=self.headphones.pk).stock, 8)
+        call_command('sync_sharded_stock', stdout=out)
+        self.assertIn('Synced the stock of 0 sharded products', out.getvalue())
+
+    def test_rebalances_when_no_shard_is_enough(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.headphones.pk: 7}), {})
+        self.assertEqual(self.shards(), [1, 1, 1, 0])
+        self.assertEqual(available_stock([self.headphones.pk]), {self.headphones.pk: 3})
+
+    def test_shortage_and_sell_out(self):
+        self.assertEqual(reserve_stock({self.headphones.pk: 11}), {self.headphones.pk: 10})
+        self.assertEqual(sum(self.shards()), 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.headphones.pk: 10}), {})
+        self.assertEqual(self.stock(self.headphones), (0, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock({self.headphones.pk: 3})
+        self.assertEqual(self.stock(self.headphones), (3, True))
+
+    def test_holds_apply_to_shards(self):
+        user = get_user_model().objects.create_user('alice', 'alice@example.com', 'secret')
+        hold_stock(user, {self.headphones.pk: 9})
+        self.assertEqual(reserve_stock({self.headphones.pk: 2}), {self.headphones.pk: 1})
+        self.assertEqual(reserve_stock({self.headphones.pk: 9}, user=user), {})
+
+    def test_stale_product_stock_is_not_shown_or_adjusted_from(self):
+        """The product page, the admin and ledger adjustments read the shards"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.headphones.pk: 2}), {})
+        self.assertEqual(self.stock(self.headphones), (10, True))
+        self.assertEqual(reconcile([self.headphones.pk]), {})
+        self.assertContains(self.client.get(self.headphones.get_absolute_url()), 'In Stock (8 available)')
+
+        form = modelform_factory(Product, form=ProductAdminForm, fields='__all__')(
+            instance=Product.objects.get(pk=self.headphones.pk)
+        )
+        self.assertEqual(form.initial['stock'], 8)
+        product = Product.objects.get(pk=self.headphones.pk)
+        product.stock = 12
+        product.save()
+        self.assertEqual(sum(self.shards()), 12)
+        self.assertEqual(ledger_stock([product.pk]), {product.pk: 12})
+
+    def test_sync_records_low_stock_only_for_drops(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_stock({self.headphones.pk: 8}), {})
+        call_command('sync_sharded_stock', stdout=StringIO())
+        self.assertEqual(list(LowStockEvent.objects.values_list('stock', flat=True)), [2])
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock({self.headphones.pk: 1})
+        call_command('sync_sharded_stock', stdout=StringIO())
+        self.assertEqual(self.stock(self.headphones), (3, True))
+        self.assertEqual(LowStockEvent.objects.count(), 1)
+
+    def test_unsharding_keeps_stock(self):
+        self.headphones.stock_shards = 0
+        self.headphones.save()
+        self.assertEqual(self.shards(), [])
+        self.assertEqual(reserve_stock({self.headphones.pk: 4}), {})
+        self.assertEqual(self.stock(self.headphones), (6, True))
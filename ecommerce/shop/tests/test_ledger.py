@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from decimal import Decimal
+from io import StringIO
+from shop.inventory import release_stock, reserve_stock
+from shop.ledger import compact, ledger_stock, reconcile
+from shop.models import Brand, Category, Order, OrderItem, Product, StockMovement, StockSnapshot
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = Product.objects.create(
+            name='Headphones',
+            slug='headphones',
+            description='Test Description',
+            price=Decimal('50.00'),
+            stock=10,
+            category=category,
+            brand=brand,
+        )
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('pk').values_list('kind', 'quantity'))
+
+    def test_every_stock_change_is_recorded(self):
+        """New stock, checkouts, cancellations and admin edits each append a movement"""
+        reserve_stock({self.product.pk: 3})
+        release_stock({self.product.pk: 1})
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = 20
+        product.save()
+        product.price = Decimal('45.00')
+        product.save()
+        self.assertEqual(self.movements(), [
+            (StockMovement.RESTOCK, 10),
+            (StockMovement.ORDER, -3),
+            (StockMovement.CANCELLATION, 1),
+            (StockMovement.ADJUSTMENT, 12),
+        ])
+        self.assertEqual(ledger_stock([self.product.pk]), {self.product.pk: 20})
+
+    def test_failed_reservation_records_nothing(self):
+        reserve_stock({self.product.pk: 11})
+        self.assertEqual(self.movements(), [(StockMovement.RESTOCK, 10)])
+
+    def test_compaction_folds_into_snapshot(self):
+        """Snapshot plus pending movements is the same figure before and after"""
+        reserve_stock({self.product.pk: 4})
+        self.assertEqual(compact(batch_size=1), 2)
+        self.assertEqual(StockSnapshot.objects.get(pk=self.product.pk).on_hand, 6)
+        self.assertFalse(StockMovement.objects.filter(folded=False).exists())
+        release_stock({self.product.pk: 2})
+        self.assertEqual(ledger_stock([self.product.pk]), {self.product.pk: 8})
+        self.assertEqual(compact(), 1)
+        self.assertEqual(ledger_stock([self.product.pk]), {self.product.pk: 8})
+
+    def test_reconcile_reports_drift(self):
+        self.assertEqual(reconcile(), {})
+        # A write that bypassed the ledger
+        Product.objects.filter(pk=self.product.pk).update(stock=7)
+        self.assertEqual(reconcile(), {self.product.pk: (10, 7)})
+
+    def test_cancelled_order_item_is_linked_to_its_order(self):
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret')
+        order = Order.objects.create(
+            user=user, first_name='Test', last_name='User', email='buyer@example.com',
+            phone='1234567890', address='1 Street', city='City', state='State', zip_code='12345',
+            tracking_number='TRACK12345'
+        )
+        reserve_stock({self.product.pk: 2}, order_id=order.pk)
+        OrderItem.objects.create(order=order, product=self.product, price=Decimal('50.00'), quantity=2)
+        order_id = order.pk
+        order.delete()
+        self.assertEqual(
+            list(StockMovement.objects.filter(order_id=order_id).order_by('pk').values_list('kind', flat=True)),
+            [StockMovement.ORDER, StockMovement.CANCELLATION]
+        )
+        self.assertEqual(ledger_stock([self.product.pk]), {self.product.pk: 10})
+
+    def order_item(self, product, quantity=2):
+        user = get_user_model().objects.create_user('other', 'other@example.com', 'secret')
+        order = Order.objects.create(
+            user=user, first_name='Test', last_name='User', email='other@example.com',
+            phone='1234567890', address='1 Street', city='City', state='State', zip_code='12345',
+            tracking_number='TRACK67890'
+        )
+        return OrderItem.objects.create(order=order, product=product, price=Decimal('50.00'), quantity=quantity)
+
+    def test_deleting_ordered_product(self):
+        """A product with order items can be deleted; its items return no stock"""
+        self.order_item(self.product)
+        self.product.delete()
+        connection.check_constraints()
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_deleting_category_of_ordered_product(self):
+        self.order_item(self.product)
+        self.product.category.delete()
+        connection.check_constraints()
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('compact_stock_ledger', '--reconcile', stdout=out)
+        self.assertIn('Folded 1 movements', out.getvalue())
+        self.assertIn('Ledger matches stock', out.getvalue())
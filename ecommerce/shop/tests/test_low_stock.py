@@ -0,0 +1,112 @@
+from datetime import timedelta
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from decimal import Decimal
+from io import StringIO
+from shop.models import Brand, Category, LowStockEvent, Product
+from shop.stock_alerts import send_digest
+
+
+class LowStockDigestTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.products = [
+            Product.objects.create(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description='Test Description',
+                price=Decimal('10.00'),
+                stock=10,
+                category=category,
+                brand=brand,
+            )
+            for i in range(3)
+        ]
+        mail.outbox = []
+
+    def sell(self, product, stock):
+        product.stock = stock
+        product.save()
+
+    def test_one_email_per_digest(self):
+        """Every product that ran low is listed once in a single email"""
+        self.sell(self.products[0], 4)
+        self.sell(self.products[0], 2)
+        self.sell(self.products[1], 0)
+        self.assertEqual(LowStockEvent.objects.count(), 3)
+
+        self.assertEqual(send_digest(), 2)
+        self.assertEqual(len(mail.outbox), 1)
+        body = mail.outbox[0].body
+        self.assertIn('Product 0: 2 remaining', body)
+        self.assertIn('Product 1: 0 remaining', body)
+        self.assertNotIn('Product 2', body)
+        self.assertFalse(LowStockEvent.objects.filter(sent_at__isnull=True).exists())
+
+    def test_nothing_pending_sends_nothing(self):
+        """Events are not sent twice and an empty window sends no email"""
+        self.sell(self.products[0], 1)
+        send_digest()
+        self.assertEqual(send_digest(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_restocked_products_are_left_out(self):
+        """A product restocked before the digest runs is not reported"""
+        self.sell(self.products[0], 1)
+        self.sell(self.products[0], 20)
+        self.assertEqual(send_digest(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(LowStockEvent.objects.filter(sent_at__isnull=True).exists())
+
+    @override_settings(LOW_STOCK_THRESHOLD=5)
+    def test_only_drops_are_recorded(self):
+        """Partial restocks below the threshold are not reported as running low"""
+        self.sell(self.products[0], 1)
+        self.sell(self.products[0], 3)
+        self.products[1].stock = 2
+        self.products[1].save()
+        self.products[1].price = Decimal('12.00')
+        self.products[1].save()
+        self.assertEqual(
+            list(LowStockEvent.objects.order_by('pk').values_list('product_id', 'stock')),
+            [(self.products[0].pk, 1), (self.products[1].pk, 2)]
+        )
+
+    @override_settings(LOW_STOCK_THRESHOLD=2)
+    def test_threshold_setting(self):
+        """Only drops to LOW_STOCK_THRESHOLD or below are recorded"""
+        self.sell(self.products[0], 3)
+        self.sell(self.products[1], 2)
+        self.assertEqual(
+            list(LowStockEvent.objects.values_list('product_id', flat=True)),
+            [self.products[1].pk]
+        )
+
+    @override_settings(EMAIL_NOTIFICATIONS={'LOW_STOCK_ALERT': False})
+    def test_alerts_disabled(self):
+        """With LOW_STOCK_ALERT off nothing is recorded or emailed"""
+        self.sell(self.products[0], 1)
+        self.assertFalse(LowStockEvent.objects.exists())
+        send_digest()
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_old_sent_events_are_pruned(self):
+        """Sent events older than the retention window are deleted"""
+        self.sell(self.products[0], 1)
+        send_digest(now=timezone.now() - timedelta(days=40))
+        self.sell(self.products[1], 1)
+        send_digest()
+        self.assertEqual(
+            list(LowStockEvent.objects.values_list('product_id', flat=True)),
+            [self.products[1].pk]
+        )
+
+    def test_command(self):
+        self.sell(self.products[2], 0)
+        out = StringIO()
+        call_command('send_low_stock_digest', stdout=out)
+        self.assertIn('1 products', out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
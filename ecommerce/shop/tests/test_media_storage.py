@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from decimal import Decimal
+from io import BytesIO, StringIO
+from PIL import Image
+from shop.models import Product, ProductCard, Category, Brand
+from shop.storage import content_name, is_content_name, product_image_storage
+from unittest import mock
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def photo_bytes():
+    exif = Image.Exif()
+    exif[0x010f] = 'SecretCamera'
+    buffer = BytesIO()
+    Image.new('RGB', (64, 48), (10, 120, 200)).save(buffer, format='JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(os.path.join(MEDIA_ROOT, 'products'), ignore_errors=True)
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+
+    def product(self, slug, **kwargs):
+        return Product.objects.create(
+            name=slug.title(),
+            slug=slug,
+            description='Test Description',
+            price=Decimal('50.00'),
+            stock=10,
+            category=self.category,
+            brand=self.brand,
+            **kwargs
+        )
+
+    def files(self):
+        return sorted(os.listdir(os.path.join(MEDIA_ROOT, 'products')))
+
+    def test_identical_uploads_share_one_file(self):
+        """Uploads are named by content hash and stored once, without EXIF"""
+        first = self.product('first', image=SimpleUploadedFile('photo.jpg', photo_bytes()))
+        second = self.product('second', image=SimpleUploadedFile('copy of photo.JPEG', photo_bytes()))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_content_name(first.image.name))
+        self.assertTrue(first.image.name.endswith('.jpg'))
+        self.assertEqual(len(self.files()), 1)
+        with first.image.open('rb') as f:
+            self.assertNotIn(b'SecretCamera', f.read())
+
+    def test_concurrent_identical_upload(self):
+        """Losing the race to store the same bytes reuses the winner's file"""
+        name, data = content_name('products/photo.jpg', photo_bytes())
+        storage = product_image_storage
+        os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+        with open(storage.path(name), 'wb') as f:
+            f.write(data)
+        # The other request's file appeared after this one checked for it
+        with mock.patch.object(storage, 'exists', return_value=False):
+            self.assertEqual(storage.store(name, data), name)
+        self.assertEqual(self.files(), [os.path.basename(name)])
+        with open(storage.path(name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_dedupe_command(self):
+        """Legacy copies are merged, rows rewritten and old files removed"""
+        legacy = FileSystemStorage(location=MEDIA_ROOT)
+        for name in ('products/photo.jpg', 'products/photo_sqvovjs.jpg', 'products/photo_GpwbDWX.jpg'):
+            legacy.save(name, ContentFile(photo_bytes()))
+        first = self.product('first')
+        second = self.product('second')
+        for model in (Product, ProductCard):
+            model.objects.filter(pk=first.pk).update(image='products/photo.jpg')
+            model.objects.filter(pk=second.pk).update(image='products/photo_sqvovjs.jpg')
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', delete_orphans=True, stdout=out)
+        self.assertIn('Rewrote 2 images into 1 files', out.getvalue())
+        self.assertIn('1 orphaned files deleted', out.getvalue())
+
+        names = set(Product.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_content_name(name))
+        self.assertEqual(ProductCard.objects.get(pk=first.pk).image, name)
+        self.assertEqual(self.files(), [name.split('/')[-1]])
@@ -2,12 +2,14 @@ from django.test import TransactionTestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.management import call_command
 from django.db import connection
 from datetime import date, timedelta
 from ..cart import Cart
 from shop.models import Product, Category, Brand, Order, OrderItem
 from decimal import Decimal
 import json
+from io import StringIO
 
 User = get_user_model()
 
@@ -116,7 +118,10 @@ class OrderPlacementTests(TransactionTestCase):
         self.assertEqual(order_item.quantity, 2)
         
         # Check confirmation email
-        # Expect 2 emails: welcome email + order confirmation
+        # Expect 2 emails: welcome email + order confirmation, queued
+        # until the mail worker runs
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('run_mail_worker', stdout=StringIO())
         self.assertEqual(len(mail.outbox), 2)
         self.assertIn(order.tracking_number, mail.outbox[0].body)
 
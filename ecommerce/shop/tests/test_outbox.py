@@ -0,0 +1,137 @@
+from datetime import timedelta
+from django.core import mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from io import StringIO
+from shop import outbox
+from shop.models import OutgoingEmail
+
+
+class CountingBackend(EmailBackend):
+    """locmem backend that counts connections the way SMTP would make them"""
+    opened = 0
+
+    def open(self):
+        if getattr(self, 'connected', False):
+            return False
+        self.connected = True
+        CountingBackend.opened += 1
+        return True
+
+    def close(self):
+        self.connected = False
+
+
+class PickyBackend(CountingBackend):
+    def send_messages(self, messages):
+        if any(message.subject == 'Message 1' for message in messages):
+            raise ConnectionError('Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP server unavailable')
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        mail.outbox = []
+        CountingBackend.opened = 0
+
+    def queue(self, count=1, **kwargs):
+        for i in range(count):
+            message = EmailMultiAlternatives(
+                f'Message {i}', 'Plain body', 'shop@example.com', ['customer@example.com'],
+                headers={'X-Order-ID': str(i)}
+            )
+            message.attach_alternative('<p>HTML body</p>', 'text/html')
+            outbox.enqueue(message, **kwargs)
+
+    def test_enqueue_does_not_send(self):
+        self.queue()
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.html_body, '<p>HTML body</p>')
+        self.assertEqual(email.headers, {'X-Order-ID': '0'})
+
+    def test_message_round_trip(self):
+        self.queue()
+        outbox.drain()
+        sent = mail.outbox[0]
+        self.assertEqual(sent.subject, 'Message 0')
+        self.assertEqual(sent.to, ['customer@example.com'])
+        self.assertEqual(sent.extra_headers, {'X-Order-ID': '0'})
+        self.assertEqual(sent.alternatives[0][0], '<p>HTML body</p>')
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.SENT)
+
+    def test_plain_message(self):
+        outbox.enqueue(EmailMessage('Plain', 'Body', 'shop@example.com', ['a@example.com']))
+        outbox.drain()
+        self.assertEqual(mail.outbox[0].body, 'Body')
+        self.assertFalse(getattr(mail.outbox[0], 'alternatives', []))
+
+    @override_settings(EMAIL_BACKEND='shop.tests.test_outbox.CountingBackend')
+    def test_batch_shares_one_connection(self):
+        self.queue(5)
+        self.assertEqual(outbox.deliver(batch_size=10), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingBackend.opened, 1)
+
+    @override_settings(EMAIL_BACKEND='shop.tests.test_outbox.CountingBackend')
+    def test_drain_in_batches(self):
+        self.queue(5)
+        self.assertEqual(outbox.drain(batch_size=2), (5, 0))
+        # One connection per batch
+        self.assertEqual(CountingBackend.opened, 3)
+        self.assertFalse(OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).exists())
+
+    @override_settings(EMAIL_BACKEND='shop.tests.test_outbox.FailingBackend')
+    def test_failure_backs_off(self):
+        self.queue()
+        now = timezone.now()
+        self.assertEqual(outbox.deliver(now=now), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.next_attempt_at, now + outbox.RETRY_BASE)
+        self.assertIn('SMTP server unavailable', email.last_error)
+
+        # Not due again until the backoff has passed
+        self.assertEqual(outbox.deliver(now=now), (0, 0))
+        outbox.deliver(now=email.next_attempt_at)
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        self.assertEqual(email.next_attempt_at - now, outbox.RETRY_BASE * 3)
+
+    @override_settings(EMAIL_BACKEND='shop.tests.test_outbox.FailingBackend')
+    def test_dead_letter_after_max_attempts(self):
+        self.queue()
+        now = timezone.now()
+        for _ in range(outbox.MAX_ATTEMPTS):
+            outbox.deliver(now=now)
+            now += timedelta(days=1)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.DEAD)
+        self.assertEqual(email.attempts, outbox.MAX_ATTEMPTS)
+        self.assertEqual(outbox.deliver(now=now), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='shop.tests.test_outbox.PickyBackend')
+    def test_one_failure_does_not_stop_the_batch(self):
+        self.queue(3)
+        self.assertEqual(outbox.deliver(), (2, 1))
+        self.assertEqual([message.subject for message in mail.outbox], ['Message 0', 'Message 2'])
+        self.assertEqual(OutgoingEmail.objects.get(status=OutgoingEmail.PENDING).subject, 'Message 1')
+        # The connection is reopened after the failure
+        self.assertEqual(CountingBackend.opened, 2)
+
+    def test_worker_command(self):
+        self.queue(2)
+        out = StringIO()
+        call_command('run_mail_worker', stdout=out)
+        self.assertIn('Sent 2 emails, 0 failed', out.getvalue())
+        self.assertEqual(len(mail.outbox), 2)
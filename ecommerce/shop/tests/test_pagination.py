@@ -0,0 +1,71 @@
+from django.test import TestCase
+from django.urls import reverse
+from decimal import Decimal
+from shop.models import Product, Category, Brand
+from shop.pagination import KeysetPaginator
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        """Create 20 products with plenty of duplicate prices"""
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        brand = Brand.objects.create(name='Test Brand', slug='test-brand')
+        for i in range(20):
+            Product.objects.create(
+                name=f'Product {i:02d}',
+                slug=f'product-{i}',
+                description='Test Description',
+                price=Decimal(10 + i % 4),
+                stock=5,
+                category=category,
+                brand=brand
+            )
+
+    def walk(self, queryset, per_page=6):
+        """Follow next cursors to the end, then previous cursors back"""
+        paginator = KeysetPaginator(queryset, per_page)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.get_page(backwards[-1].previous_cursor))
+        return pages, backwards[::-1]
+
+    def test_walks_every_row_once(self):
+        """Forward pages cover the ordered queryset exactly"""
+        queryset = Product.objects.order_by('price')
+        pages, _ = self.walk(queryset)
+        rows = [product.id for page in pages for product in page]
+        self.assertEqual(rows, list(queryset.order_by('price', 'id').values_list('id', flat=True)))
+        self.assertEqual([len(page) for page in pages], [6, 6, 6, 2])
+
+    def test_previous_cursors_mirror_next_cursors(self):
+        """Walking back lands on the same pages as walking forward"""
+        pages, backwards = self.walk(Product.objects.order_by('-price'))
+        self.assertEqual(
+            [[p.id for p in page] for page in pages],
+            [[p.id for p in page] for page in backwards]
+        )
+
+    def test_default_ordering(self):
+        """The model's -created_at ordering is used when none is set"""
+        pages, _ = self.walk(Product.objects.all())
+        names = [product.name for page in pages for product in page]
+        self.assertEqual(names, [f'Product {i:02d}' for i in reversed(range(20))])
+
+    def test_stale_cursor_starts_over(self):
+        """A cursor minted for another sort order falls back to page one"""
+        cursor = KeysetPaginator(Product.objects.order_by('name'), 6).get_page().next_cursor
+        page = KeysetPaginator(Product.objects.order_by('price'), 6).get_page(cursor)
+        self.assertFalse(page.has_previous())
+        self.assertIsNone(KeysetPaginator(Product.objects.all(), 6).decode_cursor('garbage'))
+
+    def test_product_list_cursor(self):
+        """The product list exposes a next cursor and follows it"""
+        response = self.client.get(reverse('shop:product_list'), {'sort_by': 'price'})
+        self.assertEqual(response.context['total_products'], 20)
+        cursor = response.context['products'].next_cursor
+        response = self.client.get(reverse('shop:product_list'), {'sort_by': 'price', 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['products'].has_previous())
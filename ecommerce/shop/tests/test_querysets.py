@@ -0,0 +1,70 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from decimal import Decimal
+from shop.models import Product, Category, Brand
+from shop.cart import Cart
+
+
+def catalog_queries(context):
+    """Queries against shop tables, leaving out session handling"""
+    return [query['sql'] for query in context.captured_queries if '"shop_' in query['sql']]
+
+
+class ProductReadProfileTests(TestCase):
+    def setUp(self):
+        """Spread products over several brands and categories"""
+        for i in range(4):
+            category = Category.objects.create(name=f'Category {i}', slug=f'category-{i}')
+            brand = Brand.objects.create(name=f'Brand {i}', slug=f'brand-{i}')
+            for j in range(3):
+                Product.objects.create(
+                    name=f'Product {i}-{j}',
+                    slug=f'product-{i}-{j}',
+                    description='A long description ' * 50,
+                    price=Decimal('75.00'),
+                    original_price=Decimal('99.99') if j else None,
+                    stock=5,
+                    category=category,
+                    brand=brand
+                )
+
+    def test_discount_matches_python(self):
+        """The annotated discount agrees with the property's arithmetic"""
+        for product in Product.objects.for_detail():
+            expected = int(((product.original_price - product.price) / product.original_price) * 100) \
+                if product.original_price else 0
+            self.assertEqual(product.discount_percentage, expected)
+
+    def test_product_list_query_count_is_fixed(self):
+        """Listing queries do not grow with the number of cards"""
+        url = reverse('shop:product_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        # catalog version, facets, page, count, category choices, brand choices
+        self.assertEqual(len(catalog_queries(context)), 6)
+
+    def test_product_detail_query_count(self):
+        """The product page loads product, images and related cards"""
+        product = Product.objects.get(slug='product-0-1')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(product.get_absolute_url())
+        # validators (product, co-purchased cards, category top-up with
+        # no orders yet, catalog version), then product and images
+        self.assertEqual(len(catalog_queries(context)), 6)
+        self.assertContains(response, '24% OFF')
+
+    def test_cart_iteration_uses_checkout_profile(self):
+        """Cart lines are hydrated in a single narrow query"""
+        self.client.post(
+            reverse('shop:cart_add', args=[Product.objects.first().id]),
+            {'quantity': 2, 'override': False}
+        )
+        session = self.client.session
+        session.get('cart')
+        request = type('Request', (), {'session': session})()
+        with self.assertNumQueries(1):
+            items = list(Cart(request))
+        self.assertEqual(items[0].quantity, 2)
@@ -0,0 +1,133 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from shop.cards import related_product_cards
+from shop.models import Product, Category, Brand, Order, OrderItem, RelatedProduct
+from shop.recommendations import build_related_products
+
+User = get_user_model()
+
+
+class RelatedProductTests(TestCase):
+    def setUp(self):
+        """Products in two categories and a handful of past orders"""
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        audio = Category.objects.create(name='Audio', slug='audio')
+        cables = Category.objects.create(name='Cables', slug='cables')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.products = {}
+        for slug, category in [('headphones', audio), ('speaker', audio), ('radio', audio),
+                               ('jack', cables), ('usb', cables), ('hdmi', cables)]:
+            self.products[slug] = Product.objects.create(
+                name=slug.title(),
+                slug=slug,
+                description='Test Description',
+                price=Decimal('10.00'),
+                stock=100,
+                category=category,
+                brand=brand
+            )
+        self.order('headphones', 'jack')
+        self.order('headphones', 'jack', 'usb')
+        self.order('headphones', 'usb')
+        self.order('speaker', 'hdmi')
+
+    def order(self, *slugs):
+        order = Order.objects.create(
+            user=self.user, first_name='Test', last_name='User', email='test@example.com',
+            phone='1234567890', address='123 Test St', city='Test City', state='TS', zip_code='12345'
+        )
+        for slug in slugs:
+            OrderItem.objects.create(order=order, product=self.products[slug], price=Decimal('10.00'))
+        return order
+
+    def neighbours(self, slug):
+        return [
+            related.related.slug
+            for related in RelatedProduct.objects.filter(product=self.products[slug]).select_related('related')
+        ]
+
+    def test_build_ranks_copurchases(self):
+        """Neighbours come from shared orders, most similar first"""
+        build_related_products(chunk_size=3)
+        self.assertEqual(self.neighbours('headphones'), ['jack', 'usb'])
+        self.assertEqual(self.neighbours('jack'), ['headphones', 'usb'])
+        self.assertEqual(self.neighbours('radio'), [])
+        score = RelatedProduct.objects.get(product=self.products['speaker']).score
+        self.assertAlmostEqual(score, 1.0)
+
+    def test_chunk_size_does_not_change_result(self):
+        """Orders are never split across chunks"""
+        build_related_products(chunk_size=1)
+        small = list(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        build_related_products(chunk_size=1000)
+        large = list(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        self.assertEqual(small, large)
+
+    def test_incremental_folds_in_new_orders(self):
+        """An incremental run reads only new orders and matches a full build"""
+        build_related_products()
+        self.order('radio', 'hdmi')
+        self.order('radio', 'speaker')
+        result = build_related_products(incremental=True)
+        self.assertEqual(result['lines'], 4)
+        incremental = list(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        build_related_products()
+        full = list(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        self.assertEqual(len(incremental), len(full))
+        for (product, related, score), expected in zip(incremental, full):
+            self.assertEqual((product, related), expected[:2])
+            self.assertAlmostEqual(score, expected[2])
+
+    def assertMatchesFullBuild(self):
+        incremental = list(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        build_related_products()
+        full = list(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        self.assertEqual([row[:2] for row in incremental], [row[:2] for row in full])
+        for row, expected in zip(incremental, full):
+            self.assertAlmostEqual(row[2], expected[2])
+
+    def test_incremental_picks_up_late_commits(self):
+        """An order committed after a later order was counted is still counted"""
+        build_related_products()
+        # The first order's lines only become visible after the second
+        # order was folded in, as if its transaction committed late
+        late = self.order()
+        self.order('radio', 'hdmi')
+        self.assertEqual(build_related_products(incremental=True)['lines'], 2)
+        for slug in ('radio', 'speaker'):
+            OrderItem.objects.create(order=late, product=self.products[slug], price=Decimal('10.00'))
+        self.assertEqual(build_related_products(incremental=True)['lines'], 2)
+        self.assertEqual(build_related_products(incremental=True)['lines'], 0)
+        self.assertMatchesFullBuild()
+
+    def test_neighbours_deleted_in_batches(self):
+        """Replacing many products' neighbours stays under the parameter limit"""
+        build_related_products()
+        self.order('headphones', 'speaker', 'radio', 'jack', 'usb', 'hdmi')
+        with mock.patch('shop.recommendations.DELETE_BATCH_SIZE', 2), \
+                CaptureQueriesContext(connection) as context:
+            result = build_related_products(incremental=True)
+        deletes = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('DELETE FROM "shop_relatedproduct"')]
+        self.assertEqual(len(deletes), (result['products'] + 1) // 2)
+        self.assertMatchesFullBuild()
+
+    def test_command(self):
+        """The management command reports what it wrote"""
+        out = StringIO()
+        call_command('build_related_products', stdout=out)
+        self.assertIn('Read 9 order lines', out.getvalue())
+
+    def test_related_cards_with_category_fallback(self):
+        """The product page prefers co-purchases and tops up from its category"""
+        build_related_products()
+        self.products['usb'].available = False
+        self.products['usb'].save()
+        cards = related_product_cards(self.products['headphones'])
+        self.assertEqual([card.slug for card in cards], ['jack', 'radio', 'speaker'])
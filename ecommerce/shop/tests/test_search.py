@@ -0,0 +1,75 @@
+from django.test import TestCase
+from django.urls import reverse
+from decimal import Decimal
+from shop.models import Product, Category, Brand
+from shop.search import search_products
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        """Set up a small catalog"""
+        self.audio = Category.objects.create(name='Audio', slug='audio')
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+        self.headphones = Product.objects.create(
+            name='Wireless Headphones',
+            slug='wireless-headphones',
+            description='Noise cancelling over-ear headphones',
+            price=Decimal('89.99'),
+            stock=10,
+            category=self.audio,
+            brand=self.brand
+        )
+        self.hose = Product.objects.create(
+            name='Garden Hose',
+            slug='garden-hose',
+            description='Twenty metres of flexible hose, great for headphones-free afternoons',
+            price=Decimal('19.99'),
+            stock=10,
+            category=self.garden,
+            brand=self.brand
+        )
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query))
+
+    def test_name_match_ranks_first(self):
+        """Name matches outrank description matches"""
+        self.assertEqual(self.search('headphones'), [self.headphones, self.hose])
+
+    def test_prefix_match(self):
+        """Partial words match as prefixes"""
+        self.assertEqual(self.search('wire'), [self.headphones])
+
+    def test_category_and_brand_names_are_searchable(self):
+        """Category and brand names are part of the document"""
+        self.assertEqual(self.search('audio'), [self.headphones])
+        self.assertEqual(len(self.search('acme')), 2)
+
+    def test_index_follows_product_edits(self):
+        """Saving a product refreshes its search document"""
+        self.headphones.name = 'Bluetooth Earbuds'
+        self.headphones.save()
+        self.assertEqual(self.search('earbuds'), [self.headphones])
+        self.assertEqual(self.search('wireless'), [])
+
+    def test_index_follows_category_renames(self):
+        """Renaming a category refreshes its products' documents"""
+        self.garden.name = 'Outdoor'
+        self.garden.save()
+        self.assertEqual(self.search('outdoor'), [self.hose])
+
+    def test_deleted_product_leaves_index(self):
+        """Deleted products no longer match"""
+        self.hose.delete()
+        self.assertEqual(self.search('hose'), [])
+
+    def test_punctuation_only_query(self):
+        """A query with no searchable terms matches nothing"""
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_product_list_search(self):
+        """The product list search box uses the index"""
+        response = self.client.get(reverse('shop:product_list'), {'search': 'hose'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([card.pk for card in response.context['products']], [self.hose.pk])
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+from decimal import Decimal
+from shop.models import Brand, Category, Product
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class WriteCounter:
+    """Count the statements that write (see connection.execute_wrapper)"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(WRITES):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class AnonymousBrowsingTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = Product.objects.create(
+            name='Headphones',
+            slug='headphones',
+            description='Test Description',
+            price=Decimal('50.00'),
+            stock=10,
+            category=self.category,
+            brand=brand
+        )
+        self.pages = [
+            reverse('shop:product_list'),
+            reverse('shop:product_list') + '?search=head',
+            self.product.get_absolute_url(),
+            reverse('shop:cart_detail'),
+            reverse('shop:track_order'),
+        ]
+
+    def writes_per_view(self, client=None, rounds=3):
+        """
+        Average writes per page view over the pages, each viewed `rounds`
+        times by `client`, or without cookies, like a crawler, by default
+        """
+        counter = WriteCounter()
+        with connection.execute_wrapper(counter):
+            for _ in range(rounds):
+                for url in self.pages:
+                    response = (client or Client()).get(url)
+                    self.assertEqual(response.status_code, 200, url)
+                    if client is None:
+                        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        return counter.count / (rounds * len(self.pages))
+
+    def test_browsing_writes_nothing(self):
+        """Crawlers and visitors who only browse cost no writes and no session"""
+        self.assertEqual(self.writes_per_view(), 0)
+        self.assertEqual(self.writes_per_view(Client()), 0)
+        self.assertFalse(Session.objects.exists())
+
+    def test_session_created_on_first_add(self):
+        client = Client()
+        client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 1, 'override': False})
+        self.assertIn(settings.SESSION_COOKIE_NAME, client.cookies)
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(client.session['cart']['ids'], [self.product.id])
+
+        # Browsing with a cart reads the session without saving it again
+        self.assertEqual(self.writes_per_view(client), 0)
+
+    def test_emptied_cart_not_kept(self):
+        client = Client()
+        client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 1, 'override': False})
+        client.get(reverse('shop:cart_remove', args=[self.product.id]))
+        self.assertNotIn('cart', client.session)
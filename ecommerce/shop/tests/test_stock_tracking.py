@@ -0,0 +1,70 @@
+from django.core import mail
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from shop.models import Product, ProductCard, Category, Brand
+
+
+class StockTrackingTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = self.create(stock=10)
+        mail.outbox = []
+
+    def create(self, slug='headphones', **kwargs):
+        return Product.objects.create(
+            name=slug.title(),
+            slug=slug,
+            description='Test Description',
+            price=Decimal('50.00'),
+            category=self.category,
+            brand=self.brand,
+            **kwargs
+        )
+
+    def test_stock_save_reads_nothing(self):
+        """A stock change is written without reading any shop row back"""
+        product = Product.objects.for_checkout().get(pk=self.product.pk)
+        with CaptureQueriesContext(connection) as context:
+            product.stock -= 3
+            product.save()
+        statements = [query['sql'] for query in context.captured_queries]
+        self.assertFalse([sql for sql in statements if sql.startswith('SELECT')], statements)
+        self.assertEqual(ProductCard.objects.get(pk=product.pk).stock, 7)
+
+    def test_sold_out_and_restocked(self):
+        """Selling out hides a product and restocking lists it again"""
+        self.product.stock = 0
+        self.product.save()
+        self.assertFalse(self.product.available)
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = 4
+        product.save()
+        self.assertTrue(product.available)
+        self.assertTrue(ProductCard.objects.get(pk=product.pk).available)
+
+    def test_manually_hidden_product_stays_hidden(self):
+        """Products switched off with stock left are not re-listed"""
+        self.product.available = False
+        self.product.save()
+        self.product.stock = 8
+        self.product.save()
+        self.assertFalse(Product.objects.get(pk=self.product.pk).available)
+
+    def test_new_product_with_stock_is_available(self):
+        """New products are listed when they have stock"""
+        self.assertTrue(self.create('speaker', stock=2, available=False).available)
+        self.assertFalse(self.create('radio', stock=0).available)
+
+    def test_low_stock_alert_on_change_only(self):
+        """A low stock event is queued when stock drops, not on other edits"""
+        self.product.stock = 3
+        self.product.save()
+        self.assertEqual(self.product.low_stock_events.count(), 1)
+        self.product.price = Decimal('45.00')
+        self.product.save()
+        self.assertEqual(self.product.low_stock_events.count(), 1)
+        # The email goes out with the next digest, not during the save
+        self.assertEqual(len(mail.outbox), 0)
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from shop.models import Product, ProductCard, ProductImage, Category, Brand
+from shop.thumbnails import FORMATS, WIDTHS, rendition_name
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def jpeg(width=1200, height=900):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buffer, format='JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Audio', slug='audio')
+        self.brand = Brand.objects.create(name='Acme', slug='acme')
+
+    def product(self, **kwargs):
+        return Product.objects.create(
+            name='Headphones',
+            slug='headphones',
+            description='Test Description',
+            price=Decimal('50.00'),
+            stock=10,
+            category=self.category,
+            brand=self.brand,
+            **kwargs
+        )
+
+    def assertRenditions(self, name):
+        for fmt in FORMATS:
+            for width in WIDTHS:
+                path = rendition_name(name, width, fmt)
+                self.assertTrue(default_storage.exists(path), path)
+                with default_storage.open(path) as f:
+                    self.assertEqual(Image.open(f).size[0], width)
+
+    def test_renditions_by_worker(self):
+        """Uploads are rendered by the command, not by the saving request"""
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.product(image=jpeg())
+            gallery = ProductImage.objects.create(product=product, image=jpeg(800, 600))
+        self.assertFalse(default_storage.exists(rendition_name(product.image.name, 200, 'webp')))
+        call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        self.assertRenditions(product.image.name)
+        self.assertRenditions(gallery.image.name)
+        self.assertTrue(Product.objects.get(pk=product.pk).image_renditions)
+        self.assertTrue(ProductCard.objects.get(pk=product.pk).image_renditions)
+        self.assertTrue(ProductImage.objects.get(pk=gallery.pk).image_renditions)
+
+        # A new image waits for the next run
+        product.image = jpeg(600, 600)
+        product.save()
+        self.assertFalse(Product.objects.get(pk=product.pk).image_renditions)
+        self.assertFalse(ProductCard.objects.get(pk=product.pk).image_renditions)
+        out = StringIO()
+        call_command('generate_thumbnails', workers=1, stdout=out)
+        self.assertIn(f'Wrote {len(WIDTHS) * len(FORMATS)} renditions for 1 images', out.getvalue())
+
+    def test_srcset_markup(self):
+        """Templates get a <picture> with AVIF and WebP srcsets"""
+        product = self.product(image=jpeg())
+        call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        product = Product.objects.get(pk=product.pk)
+        with mock.patch.object(type(product.image.storage), 'exists', side_effect=AssertionError):
+            html = Template(
+                '{% load shop_images %}{% responsive_image product.image alt=product.name sizes="300px" class="card-img-top" %}'
+            ).render(Context({'product': product}))
+        self.assertIn('<source type="image/avif"', html)
+        self.assertIn(f'{rendition_name(product.image.name, 400, "webp")} 400w', html)
+        self.assertIn(f'src="{product.image.url}"', html)
+        self.assertIn('class="card-img-top"', html)
+
+    def test_backfill_command(self):
+        """Existing images without renditions are processed in a pool"""
+        product = self.product(image=jpeg(300, 300))
+        self.assertIn('<img src=', Template(
+            '{% load shop_images %}{% responsive_image image %}'
+        ).render(Context({'image': product.image})))
+        out = StringIO()
+        call_command('generate_thumbnails', workers=2, stdout=out)
+        self.assertIn(f'Wrote {len(WIDTHS) * len(FORMATS)} renditions for 1 images', out.getvalue())
+        call_command('generate_thumbnails', workers=2, stdout=out)
+        self.assertIn('Wrote 0 renditions for 0 images', out.getvalue())
+        # Small sources are not upscaled
+        with default_storage.open(rendition_name(product.image.name, 800, 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (300, 300))
@@ -0,0 +1,105 @@
+import posixpath
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from io import BytesIO
+from PIL import Image, ImageOps
+from .models import Product, ProductCard, ProductImage
+
+# Resized copies of product images for srcset. Every upload gets one
+# rendition per width in WIDTHS and per format in FORMATS, written next to
+# the media under renditions/ with names derived from the original, e.g.
+#
+#   products/headphones.jpg -> renditions/products/headphones-400w.webp
+#
+# so templates can build srcset from the file name alone. Images are never
+# upscaled: a source narrower than a width is stored at its own size.
+#
+# Encoding is left to `manage.py generate_thumbnails` (run with --interval
+# as a worker), never done in a request. Each row showing an image records
+# whether its renditions exist in `image_renditions`, which templates read
+# instead of asking the storage; saving a new image resets it.
+
+RENDITION_DIR = 'renditions'
+# Rows showing an image; ProductCard copies Product's
+IMAGE_MODELS = (Product, ProductCard, ProductImage)
+# Names per UPDATE, well under SQLite's limit on query parameters
+MARK_BATCH_SIZE = 500
+WIDTHS = (200, 400, 800)
+# Most compact first; <picture> takes the first type the browser supports
+FORMATS = ('avif', 'webp')
+QUALITY = {'avif': 50, 'webp': 75}
+
+
+def rendition_name(name, width, fmt):
+    stem, _ = posixpath.splitext(name)
+    return f'{RENDITION_DIR}/{stem}-{width}w.{fmt}'
+
+
+def rendition_names(name):
+    return {
+        fmt: [(rendition_name(name, width, fmt), width) for width in WIDTHS]
+        for fmt in FORMATS
+    }
+
+
+def pending_images():
+    """Names of the images some row shows without renditions"""
+    names = set()
+    for model in IMAGE_MODELS:
+        names.update(
+            model.objects.filter(image_renditions=False).exclude(image='').values_list('image', flat=True)
+        )
+    return sorted(names)
+
+
+def mark_rendered(names):
+    """
+    Flag the rows showing `names` as having renditions, moving the
+    updated_at of the pages that now render them differently
+    """
+    names = list(names)
+    now = timezone.now()
+    for start in range(0, len(names), MARK_BATCH_SIZE):
+        batch = Q(image__in=names[start:start + MARK_BATCH_SIZE], image_renditions=False)
+        gallery = ProductImage.objects.filter(batch)
+        Product.objects.filter(batch | Q(pk__in=gallery.values('product_id'))).update(
+            image_renditions=Case(When(batch, then=Value(True)), default=F('image_renditions')),
+            updated_at=now,
+        )
+        gallery.update(image_renditions=True)
+        ProductCard.objects.filter(batch).update(image_renditions=True, updated_at=now)
+
+
+def generate_renditions(name, storage=default_storage, overwrite=False):
+    """
+    Write every missing rendition of the image stored at `name`. Returns
+    the number of files written.
+    """
+    wanted = [
+        (path, width, fmt)
+        for fmt, paths in rendition_names(name).items()
+        for path, width in paths
+        if overwrite or not storage.exists(path)
+    ]
+    if not wanted:
+        return 0
+
+    with storage.open(name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    written = 0
+    for path, width, fmt in wanted:
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, format=fmt.upper(), quality=QUALITY[fmt])
+        if overwrite and storage.exists(path):
+            storage.delete(path)
+        storage.save(path, ContentFile(buffer.getvalue()))
+        written += 1
+    return written
@@ -5,11 +5,16 @@ app_name = 'shop'
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    path('search/suggest/', views.search_suggestions, name='search_suggestions'),
     path('product/<slug:slug>/', views.product_detail, name='product_detail'),
     path('category/<slug:slug>/', views.category_products, name='category_products'),
     path('cart/', views.cart_detail, name='cart_detail'),
     path('cart/add/<int:product_id>/', views.cart_add, name='cart_add'),
     path('cart/remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
+    path('cart/api/add/', views.cart_api_add, name='cart_api_add'),
+    path('cart/api/bulk-add/', views.cart_api_bulk_add, name='cart_api_bulk_add'),
+    path('cart/api/update/', views.cart_api_update, name='cart_api_update'),
+    path('cart/api/remove/', views.cart_api_remove, name='cart_api_remove'),
     path('checkout/', views.checkout, name='checkout'),
     path('order/confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
     path('orders/', views.order_list, name='order_list'),
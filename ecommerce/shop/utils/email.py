@@ -0,0 +1,79 @@
+import logging
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from django.conf import settings
+from django.urls import reverse
+from .. import outbox
+
+logger = logging.getLogger('django.mail')
+
+# Customer emails are queued in the outbox (shop.outbox) and delivered by
+# `manage.py run_mail_worker`, never sent while a request waits.
+
+def send_status_notification(order):
+    """
+    Queue an email telling the customer their order's status changed
+    """
+    context = {
+        'order': order,
+        'status': order.get_status_display(),
+        'tracking_number': order.tracking_number
+    }
+    
+    html_message = render_to_string('shop/email/order_status_update.html', context)
+    plain_message = render_to_string('shop/email/order_status_update.txt', context)
+    
+    message = EmailMultiAlternatives(
+        f'Order #{order.id} Status Update',
+        plain_message,
+        settings.DEFAULT_FROM_EMAIL,
+        [order.email],
+    )
+    message.attach_alternative(html_message, 'text/html')
+    outbox.enqueue(message)
+
+def send_order_confirmation_email(request, order):
+    """
+    Queue the order confirmation email with tracking number. Returns
+    whether it could be queued.
+    """
+    try:
+        # Build the tracking URL with the order's tracking number
+        base_tracking_url = request.build_absolute_uri(reverse('shop:track_order'))
+        tracking_url = f"{base_tracking_url}?order_number={order.tracking_number}"
+        
+        # Get the site URL for static files
+        site_url = f"{request.scheme}://{request.get_host()}"
+        
+        context = {
+            'order': order,
+            'tracking_url': tracking_url,
+            'site_name': 'Swiftbuy',
+            'contact_email': settings.DEFAULT_FROM_EMAIL,
+            'site_url': site_url,
+        }
+        
+        html_content = render_to_string('shop/email/order_confirmation_email.html', context)
+        text_content = strip_tags(html_content)
+        
+        message = EmailMultiAlternatives(
+            f'{settings.EMAIL_SUBJECT_PREFIX}Order #{order.id} Confirmation',
+            text_content,
+            settings.DEFAULT_FROM_EMAIL,
+            [order.email],
+            headers={
+                'X-Order-ID': str(order.id),
+                'X-Tracking-Number': order.tracking_number
+            }
+        )
+        message.attach_alternative(html_content, "text/html")
+        # A savepoint, so a failed insert leaves the caller's transaction usable
+        with transaction.atomic():
+            outbox.enqueue(message, inline_logo=True)
+        logger.info(f"Queued order confirmation email to {order.email} for order #{order.id}")
+        return True
+    except Exception:
+        logger.exception(f"Failed to queue order confirmation email for order #{order.id}")
+        return False
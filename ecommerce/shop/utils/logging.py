@@ -33,11 +33,12 @@ order_logger = setup_order_logger()
 
 class OrderError(Exception):
     """Base exception for order processing errors"""
-    def __init__(self, message, code=None, order_id=None, user_id=None):
+    def __init__(self, message, code=None, order_id=None, user_id=None, details=None):
         super().__init__(message)
         self.code = code
         self.order_id = order_id
         self.user_id = user_id
+        self.details = details
 
 def log_order_processing(func):
     """Decorator to log order processing steps and handle errors"""
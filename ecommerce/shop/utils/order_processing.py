@@ -1,9 +1,11 @@
 from decimal import Decimal
 from django.utils.crypto import get_random_string
 from datetime import date, timedelta
-from django.db import transaction
+from django.db import IntegrityError, connection, transaction
 from django.core.exceptions import ValidationError
 from .logging import log_order_step, OrderError, order_logger
+from ..cart import CartLine
+from ..inventory import reserve_stock, with_free_stock
 from ..models import Order, OrderItem, OrderStatus, Product
 
 @log_order_step("validate_cart")
@@ -18,56 +20,26 @@ def validate_cart(cart, user_id=None):
         
         unavailable_products = []
         
-        max_retries = 3
-        retry_delay = 1  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                with transaction.atomic():
-                    # Lock the products for update with a timeout
-                    product_ids = [item['product'].id for item in cart]
-                    try:
-                        # Use a timeout instead of nowait
-                        products = Product.objects.select_for_update().filter(id__in=product_ids)
-                        products_dict = {p.id: p for p in products}
-                        break  # Success - exit retry loop
-                    except transaction.TransactionManagementError as e:
-                        if attempt == max_retries - 1:  # Last attempt
-                            raise OrderError(
-                                "The system is experiencing high load. Please try again in a moment.",
-                                code="LOCK_ERROR",
-                                user_id=user_id,
-                                details={"attempt": attempt + 1, "max_retries": max_retries}
-                            )
-                        order_logger.warning(
-                            f"Lock acquisition failed, attempt {attempt + 1}/{max_retries}",
-                            extra={"user_id": user_id, "product_ids": product_ids}
-                        )
-                        import time
-                        time.sleep(retry_delay)  # Wait before retrying
-            except Exception as e:
-                if attempt == max_retries - 1:  # Last attempt
-                    raise OrderError(
-                        f"Error accessing product information: {str(e)}",
-                        code="PRODUCT_ACCESS_ERROR",
-                        user_id=user_id
-                    )
-                continue  # Try again
+        # A plain read for early, friendly messages; nothing is locked here.
+        # Stock is only taken by reserve_stock in create_order_items, and
+        # what other customers hold at checkout is not on offer.
+        product_ids = [item.product.id for item in cart]
+        products_dict = with_free_stock(Product.objects.for_checkout(), user_id).in_bulk(product_ids)
         
         for item in cart:
-            product_id = item['product'].id
+            product_id = item.product.id
             product = products_dict.get(product_id)
             
             if not product:
-                unavailable_products.append(f"{item['product'].name} is no longer available")
+                unavailable_products.append(f"{item.product.name} is no longer available")
                 continue
                 
             if not product.available:
                 unavailable_products.append(f"{product.name} is no longer available for purchase")
-            elif product.stock < item['quantity']:
+            elif product.free < item.quantity:
                 unavailable_products.append(
-                    f"{product.name} has insufficient stock (requested: {item['quantity']}, "
-                    f"available: {product.stock})"
+                    f"{product.name} has insufficient stock (requested: {item.quantity}, "
+                    f"available: {max(product.free, 0)})"
                 )
         
         if unavailable_products:
@@ -91,7 +63,7 @@ def validate_cart(cart, user_id=None):
 
 @log_order_step("create_order")
 def create_order(form, cart, user, products_dict):
-    """Create the order with proper locking and validation"""
+    """Build the order from the form and cart; place_order saves it"""
     # Validate form data
     if not hasattr(form, 'is_valid') or not form.is_valid():
         raise OrderError(
@@ -140,7 +112,7 @@ def create_order(form, cart, user, products_dict):
 
     # Generate tracking number
     order.tracking_number = get_random_string(10).upper()
-    order.save()
+    order.checkout_token = form.cleaned_data.get('checkout_token') or None
     
     return order
 
@@ -149,19 +121,19 @@ def create_order_items(order, cart, products_dict):
     """Create order items and update stock levels"""
     try:
         order_items = []
-        stock_updates = []
+        quantities = {}
         
         for item in cart:
             try:
                 # Validate cart item structure
-                if not isinstance(item, dict) or 'product' not in item:
+                if not isinstance(item, CartLine):
                     raise OrderError(
                         "Invalid cart item format",
                         code="INVALID_CART_ITEM",
                         order_id=order.id
                     )
                 
-                product_id = item['product'].id
+                product_id = item.product.id
                 if product_id not in products_dict:
                     raise OrderError(
                         f"Product {product_id} not found",
@@ -172,7 +144,7 @@ def create_order_items(order, cart, products_dict):
                 product = products_dict[product_id]
                 
                 # Validate quantity and price
-                quantity = int(item.get('quantity', 0))
+                quantity = int(item.quantity)
                 if quantity <= 0:
                     raise OrderError(
                         f"Invalid quantity for {product.name}",
@@ -180,7 +152,7 @@ def create_order_items(order, cart, products_dict):
                         order_id=order.id
                     )
                 
-                price = Decimal(str(item.get('price', '0')))
+                price = item.price
                 if price <= 0:
                     raise OrderError(
                         f"Invalid price for {product.name}",
@@ -197,18 +169,7 @@ def create_order_items(order, cart, products_dict):
                 )
                 order_items.append(order_item)
                 
-                # Prepare stock update
-                if product.stock < quantity:
-                    raise OrderError(
-                        f"Insufficient stock for {product.name}",
-                        code="INSUFFICIENT_STOCK",
-                        order_id=order.id
-                    )
-                
-                product.stock -= quantity
-                if product.stock == 0:
-                    product.available = False
-                stock_updates.append(product)
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
                 
             except (TypeError, ValueError, KeyError) as e:
                 raise OrderError(
@@ -217,11 +178,21 @@ def create_order_items(order, cart, products_dict):
                     order_id=order.id
                 )
         
-        # Bulk create order items and update stock in a transaction
-        with transaction.atomic():
-            OrderItem.objects.bulk_create(order_items)
-            for product in stock_updates:
-                product.save()
+        # Take the stock in one guarded UPDATE, then write the items; this
+        # runs inside place_order's transaction
+        missing = reserve_stock(quantities, user=order.user, order_id=order.id)
+        if missing:
+            raise OrderError(
+                "Insufficient stock",
+                code="STOCK_ERROR",
+                order_id=order.id,
+                details=[
+                    f"{products_dict[product_id].name} has insufficient stock "
+                    f"(requested: {quantities[product_id]}, available: {available})"
+                    for product_id, available in missing.items()
+                ]
+            )
+        OrderItem.objects.bulk_create(order_items)
                 
         return order_items
         
@@ -236,85 +207,131 @@ def create_order_items(order, cart, products_dict):
 
 @log_order_step("process_payment")
 def process_payment(order):
-    """Handle dummy order validation and processing"""
-    try:
-        with transaction.atomic():
-            # Basic validation checks
-            if order.total_amount <= 0:
-                raise OrderError(
-                    "Invalid order amount",
-                    code="VALIDATION_ERROR",
-                    order_id=order.id,
-                    user_id=order.user.id
-                )
-            
-            # Validate shipping information
-            if not all([order.address, order.city, order.state, order.zip_code]):
-                raise OrderError(
-                    "Incomplete shipping information",
-                    code="VALIDATION_ERROR",
-                    order_id=order.id,
-                    user_id=order.user.id
-                )
-            
-            # Validate phone number
-            if not order.phone or len(order.phone) < 10:
-                raise OrderError(
-                    "Invalid phone number",
-                    code="VALIDATION_ERROR",
-                    order_id=order.id,
-                    user_id=order.user.id
-                )
+    """
+    Validate the order and set its status for the payment method. Nothing
+    is written; returns the note for the status history.
+    """
+    # Basic validation checks
+    if order.total_amount <= 0:
+        raise OrderError(
+            "Invalid order amount",
+            code="VALIDATION_ERROR",
+            user_id=order.user.id
+        )
+    
+    # Validate shipping information
+    if not all([order.address, order.city, order.state, order.zip_code]):
+        raise OrderError(
+            "Incomplete shipping information",
+            code="VALIDATION_ERROR",
+            user_id=order.user.id
+        )
+    
+    # Validate phone number
+    if not order.phone or len(order.phone) < 10:
+        raise OrderError(
+            "Invalid phone number",
+            code="VALIDATION_ERROR",
+            user_id=order.user.id
+        )
 
-            # Set appropriate status based on payment method
-            if order.payment_method == 'cash_on_delivery':
-                new_status = 'confirmed'
-                payment_status = 'pending'
-                status_note = 'Order confirmed - Cash on Delivery'
-            else:
-                # Simulate successful order placement
-                new_status = 'processing'
-                payment_status = 'completed'
-                status_note = 'Order validated and confirmed'
+    # Set appropriate status based on payment method
+    if order.payment_method == 'cash_on_delivery':
+        order.status = 'confirmed'
+        order.payment_status = 'pending'
+        return 'Order confirmed - Cash on Delivery'
+    # Simulate successful order placement
+    order.status = 'processing'
+    order.payment_status = 'completed'
+    return 'Payment processed successfully'
 
-            # Update order status
-            order.status = new_status
-            order.payment_status = payment_status
-            order.save()
+class QueryCounter:
+    """Count the statements run on a connection (see connection.execute_wrapper)"""
+    def __init__(self):
+        self.count = 0
 
-            # Create status update record
-            OrderStatus.objects.create(
-                order=order,
-                status=new_status,
-                note=status_note,
-                created_by=order.user
-            )
-            
-            order_logger.info(
-                f"Order {order.id} validated and processed successfully",
-                extra={
-                    'order_id': order.id,
-                    'user_id': order.user.id,
-                    'status': new_status,
-                    'payment_method': order.payment_method
-                }
-            )
-            
-            return True
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
 
-    except OrderError:
-        # Re-raise existing OrderErrors
-        raise
-    except Exception as e:
-        error_message = f"Order validation failed: {str(e)}"
-        order_logger.error(error_message, extra={
+# Statements place_order may run, savepoints included: two product reads,
+# the order, the stock reservation (sharded check, UPDATE, holds, ledger,
+# cards, low stock events), the items and the status history. Every step
+# is batched, so this does not grow with the number of cart lines; the
+# tests hold the pipeline to it.
+QUERY_BUDGET = 16
+
+def placed_order(user, checkout_token):
+    """
+    The order `user` already placed with `checkout_token`, or None. It is
+    marked `replayed` so callers do not repeat what follows a new order.
+    """
+    if not checkout_token:
+        return None
+    order = Order.objects.filter(user=user, checkout_token=checkout_token).first()
+    if order is not None:
+        order.replayed = True
+    return order
+
+@log_order_step("place_order")
+def place_order(form, cart, user, notify=None):
+    """
+    The whole checkout in one transaction: validate the cart, build the
+    order, reserve stock and write the order, its items and its status
+    history once each. Receivers that would re-save the order do not run,
+    because the history rows are bulk inserted with the order already at
+    its final status. `notify(order)` is called last in the transaction,
+    so the emails it queues commit, or roll back, with the order.
+
+    The form's checkout token makes this idempotent: a form that already
+    placed an order gets that order back without anything being locked.
+    The order row is inserted before stock is reserved, so a concurrent
+    submission of the same form waits on the token's unique index and,
+    once the first commits, returns its order too.
+    """
+    checkout_token = form.cleaned_data.get('checkout_token')
+    order = placed_order(user, checkout_token)
+    if order is not None:
+        return order
+
+    counter = QueryCounter()
+    try:
+        with transaction.atomic():
+            with connection.execute_wrapper(counter):
+                # Iterating a Cart reads its products, so do it once
+                items = list(cart)
+                products_dict = validate_cart(items, user_id=user.id)
+                order = create_order(form, cart, user, products_dict)
+                status_note = process_payment(order)
+                order.save()
+                create_order_items(order, items, products_dict)
+                OrderStatus.objects.bulk_create([
+                    OrderStatus(order=order, status='pending', note='Order placed successfully', created_by=user),
+                    OrderStatus(order=order, status=order.status, note=status_note, created_by=user),
+                ])
+            # Outside the budget, which covers the order itself
+            if notify is not None:
+                notify(order)
+    except IntegrityError:
+        # Lost the race to another submission of the same form
+        order = placed_order(user, checkout_token)
+        if order is None:
+            raise
+        return order
+    
+    order.query_count = counter.count
+    if counter.count > QUERY_BUDGET:
+        order_logger.warning(
+            f"Checkout ran {counter.count} queries, over its budget of {QUERY_BUDGET}",
+            extra={'order_id': order.id, 'user_id': user.id}
+        )
+    order_logger.info(
+        f"Order {order.id} placed",
+        extra={
             'order_id': order.id,
-            'user_id': order.user.id,
-            'error_type': type(e).__name__
-        })
-        raise OrderError(
-            error_message,
-            code="VALIDATION_ERROR",
-            order_id=order.id,
-            user_id=order.user.id
-        )
\ No newline at end of file
+            'user_id': user.id,
+            'status': order.status,
+            'payment_method': order.payment_method
+        }
+    )
+    return order
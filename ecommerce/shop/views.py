@@ -1,24 +1,34 @@
+import json
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
-from django.db.models import Q
-from django.views.decorators.http import require_POST
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET, require_POST
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from decimal import Decimal
-from django.utils.crypto import get_random_string
-from datetime import date, timedelta
-from .models import Product, Category, Brand, Order, OrderItem, OrderStatus
+from .models import Product, ProductCard, Category, Brand, Order
 from .forms import ProductFilterForm, CartAddProductForm, CheckoutForm
-from .cart import Cart
-from .utils.logging import log_order_processing, OrderError, order_logger
-from .utils.order_processing import (
-    validate_cart,
-    create_order,
-    create_order_items,
-    process_payment
+from .cart import get_cart
+from .search import search_products
+from .pagination import KeysetPaginator, estimated_count
+from .facets import facet_counts, filter_conditions
+from .inventory import hold_stock, release_holds, with_on_hand
+from . import autocomplete
+from .conditional import (
+    conditional,
+    catalog_etag,
+    catalog_last_modified,
+    product_etag,
+    product_last_modified,
+    related_cards,
+    order_etag,
+    order_last_modified
 )
+from .utils.logging import log_order_processing, OrderError, order_logger
+from .utils.email import send_order_confirmation_email, send_status_notification
+from .utils.order_processing import place_order, placed_order
+
+PRODUCTS_PER_PAGE = 9
 
 def validate_order_status(status):
     valid_statuses = ['pending', 'processing', 'confirmed', 'cancelled', 'shipped', 'delivered', 'refunded']
@@ -26,80 +36,49 @@ def validate_order_status(status):
         raise ValidationError(f"Invalid status: {status}")
     return status
 
+@conditional(catalog_etag, catalog_last_modified)
 def product_list(request):
-    products = Product.objects.all()
+    products = ProductCard.objects.all()
     form = ProductFilterForm(request.GET)
+    facets = None
     
     if form.is_valid():
         # Search filter
         search = form.cleaned_data.get('search')
         if search:
-            products = products.filter(
-                Q(name__icontains=search) |
-                Q(description__icontains=search) |
-                Q(category__name__icontains=search) |
-                Q(brand__name__icontains=search)
-            )
-        
-        # Category filter
-        category = form.cleaned_data.get('category')
-        if category:
-            products = products.filter(category=category)
-        
-        # Brand filter
-        brand = form.cleaned_data.get('brand')
-        if brand:
-            products = products.filter(brand=brand)
-        
-        # Price range filter
-        price_range = form.cleaned_data.get('price_range')
-        if price_range:
-            if price_range == '0-50':
-                products = products.filter(price__lt=50)
-            elif price_range == '50-100':
-                products = products.filter(price__gte=50, price__lt=100)
-            elif price_range == '100-200':
-                products = products.filter(price__gte=100, price__lt=200)
-            elif price_range == '200-500':
-                products = products.filter(price__gte=200, price__lt=500)
-            elif price_range == '500+':
-                products = products.filter(price__gte=500)
-        
-        # Featured filter
-        featured_only = form.cleaned_data.get('featured_only')
-        if featured_only:
-            products = products.filter(featured=True)
+            products = search_products(products, search)
         
-        # Available filter
-        available_only = form.cleaned_data.get('available_only')
-        if available_only:
-            products = products.filter(available=True, stock__gt=0)
+        # Category, brand, price, featured and availability filters,
+        # counted per option for the sidebar in a single query
+        facets = facet_counts(products, form.cleaned_data)
+        form.set_facet_counts(facets)
+        products = products.filter(*filter_conditions(form.cleaned_data).values())
         
         # Sort filter
         sort_by = form.cleaned_data.get('sort_by')
         if sort_by:
             products = products.order_by(sort_by)
     
-    # Pagination
-    paginator = Paginator(products, 9)  # Show 9 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination on the active sort
+    paginator = KeysetPaginator(products, PRODUCTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    total_products, total_is_estimate = estimated_count(products)
     
     context = {
         'products': page_obj,
         'form': form,
-        'total_products': products.count(),
+        'total_products': total_products,
+        'total_is_estimate': total_is_estimate,
+        'facets': facets,
     }
     
     return render(request, 'shop/product_list.html', context)
 
+@conditional(product_etag, product_last_modified)
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    related_products = Product.objects.filter(
-        category=product.category,
-        available=True
-    ).exclude(id=product.id)[:4]
-    
+    product = get_object_or_404(with_on_hand(Product.objects.for_detail()), slug=slug)
+    related_products = related_cards(request, product)
+
     cart_product_form = CartAddProductForm()
     
     context = {
@@ -110,14 +89,14 @@ def product_detail(request, slug):
     
     return render(request, 'shop/product_detail.html', context)
 
+@conditional(catalog_etag, catalog_last_modified)
 def category_products(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    products = Product.objects.filter(category=category, available=True)
+    products = ProductCard.objects.filter(category=category, available=True)
     
     # Apply pagination
-    paginator = Paginator(products, 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(products, PRODUCTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'category': category,
@@ -126,10 +105,20 @@ def category_products(request, slug):
     
     return render(request, 'shop/category_products.html', context)
 
+@require_GET
+def search_suggestions(request):
+    """Typeahead matches for the search box, served from memory"""
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', autocomplete.DEFAULT_LIMIT)), 1), 20)
+    except ValueError:
+        limit = autocomplete.DEFAULT_LIMIT
+    return JsonResponse({'query': query, 'results': autocomplete.suggest(query, limit)})
+
 @require_POST
 def cart_add(request, product_id):
-    cart = Cart(request)
-    product = get_object_or_404(Product, id=product_id)
+    cart = get_cart(request)
+    product = get_object_or_404(Product.objects.for_checkout(), id=product_id)
     form = CartAddProductForm(request.POST)
     if form.is_valid():
         cd = form.cleaned_data
@@ -139,190 +128,108 @@ def cart_add(request, product_id):
     return redirect('shop:cart_detail')
 
 def cart_remove(request, product_id):
-    cart = Cart(request)
-    product = get_object_or_404(Product, id=product_id)
+    cart = get_cart(request)
+    product = get_object_or_404(Product.objects.for_checkout(), id=product_id)
     cart.remove(product)
+    if request.user.is_authenticated:
+        release_holds(request.user, [product.id])
     return redirect('shop:cart_detail')
 
+# JSON cart endpoints for updating the cart and product pages in place.
+# Bodies are {"product_id": 3, "quantity": 2}, or for bulk-add
+# {"items": [{"product_id": 3, "quantity": 2}, ...]}; responses carry only
+# the lines that changed, the item count and the subtotal.
+
+MAX_BULK_ITEMS = 50
+
+def _posted_items(request):
+    """(product id, quantity) pairs from the JSON body, or None if malformed"""
+    try:
+        data = json.loads(request.body or b'{}')
+        items = data['items'] if 'items' in data else [data]
+        pairs = [(int(item['product_id']), item.get('quantity', 1)) for item in items]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return pairs if 0 < len(pairs) <= MAX_BULK_ITEMS else None
+
+def _cart_api_add(request, override_quantity=False, bulk=False):
+    items = _posted_items(request)
+    if items is None or (len(items) > 1 and not bulk):
+        return JsonResponse({'error': 'Expected product_id and quantity'}, status=400)
+    for product_id, quantity in items:
+        form = CartAddProductForm({'quantity': quantity})
+        if not form.is_valid():
+            return JsonResponse({'error': f'Invalid quantity for product {product_id}'}, status=400)
+    
+    # One lookup for every product in the request
+    products = Product.objects.for_checkout().in_bulk([product_id for product_id, _ in items])
+    missing = [product_id for product_id, _ in items if product_id not in products]
+    if missing:
+        return JsonResponse({'error': 'Products not found', 'missing': missing}, status=404)
+    
+    cart = get_cart(request)
+    cart.add_many([(products[product_id], int(quantity)) for product_id, quantity in items], override_quantity)
+    return JsonResponse(cart.summary([product_id for product_id, _ in items]))
+
+@require_POST
+def cart_api_add(request):
+    return _cart_api_add(request)
+
+@require_POST
+def cart_api_bulk_add(request):
+    return _cart_api_add(request, bulk=True)
+
+@require_POST
+def cart_api_update(request):
+    return _cart_api_add(request, override_quantity=True)
+
+@require_POST
+def cart_api_remove(request):
+    items = _posted_items(request)
+    if items is None or len(items) > 1:
+        return JsonResponse({'error': 'Expected product_id'}, status=400)
+    product_id = items[0][0]
+    cart = get_cart(request)
+    cart.discard(product_id)
+    if request.user.is_authenticated:
+        release_holds(request.user, [product_id])
+    return JsonResponse({**cart.summary(), 'removed': product_id})
+
 def cart_detail(request):
-    cart = Cart(request)
-    for item in cart:
-        item['update_quantity_form'] = CartAddProductForm(initial={
-            'quantity': item['quantity'],
-            'override': True})
-    return render(request, 'shop/cart/detail.html', {'cart': cart})
+    cart = get_cart(request)
+    lines = [
+        (item, CartAddProductForm(initial={'quantity': item.quantity, 'override': True}))
+        for item in cart
+    ]
+    return render(request, 'shop/cart/detail.html', {'cart': cart, 'lines': lines})
 
 @login_required
 @log_order_processing
 def checkout(request):
-    cart = Cart(request)
+    cart = get_cart(request)
+    
+    if request.method == 'POST':
+        # A resubmitted form (double click, retried POST) finds the order it
+        # placed, even though the cart was emptied by then
+        order = placed_order(request.user, request.POST.get('checkout_token'))
+        if order is not None:
+            return redirect('shop:order_confirmation', order_id=order.id)
     
     # Check if cart is empty
     if len(cart) == 0:
         messages.error(request, "Your cart is empty!")
         return redirect('shop:product_list')
     
-    # Lock prevention - store cart version in session
-    cart_version = request.session.get('cart_version', 0)
-        
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            # Verify cart hasn't changed
-            if cart_version != request.session.get('cart_version', 0):
-                messages.error(request, "Your cart has been modified. Please review your order and try again.")
-                return redirect('shop:cart_detail')
-            
-            try:
-                with transaction.atomic():
-                    # Step 1: Validate cart and get locked products
-                    products_dict = validate_cart(cart, user_id=request.user.id)
-                    
-                    # Step 2: Create the order
-                    order = create_order(form, cart, request.user, products_dict)
-
-                    # Check product availability and stock with proper locking
-                    unavailable_products = []
-                    products_to_update = []
-                    
-                    # Lock the products for update
-                    product_ids = [item['product'].id for item in cart]
-                    products = Product.objects.select_for_update().filter(id__in=product_ids)
-                    products_dict = {p.id: p for p in products}
-                    
-                    for item in cart:
-                        product_id = item['product'].id
-                        product = products_dict.get(product_id)
-                        
-                        if not product:
-                            unavailable_products.append(f"{item['product'].name} is no longer available")
-                            continue
-                            
-                        if not product.available:
-                            unavailable_products.append(f"{product.name} is no longer available for purchase")
-                        elif product.stock < item['quantity']:
-                            unavailable_products.append(
-                                f"{product.name} has insufficient stock (requested: {item['quantity']}, "
-                                f"available: {product.stock})"
-                            )
-                        else:
-                            # Store product and quantity for later update
-                            products_to_update.append((product, item['quantity']))
-                    
-                    if unavailable_products:
-                        transaction.set_rollback(True)
-                        messages.error(request, "Unable to complete your order due to the following issues:")
-                        for msg in unavailable_products:
-                            messages.error(request, msg)
-                        return redirect('shop:cart_detail')
-
-                    # Create order
-                    order = form.save(commit=False)
-                    order.user = request.user
-                    order.status = 'pending'
-                    order.payment_status = 'pending'
-                    
-                    # Set estimated delivery
-                    today = date.today()
-                    if order.shipping_method == 'express':
-                        order.estimated_delivery = today + timedelta(days=3)
-                    elif order.shipping_method == 'standard':
-                        order.estimated_delivery = today + timedelta(days=7)
-                    elif order.shipping_method == 'pickup':
-                        order.estimated_delivery = today + timedelta(days=1)
-
-                    # Calculate totals
-                    subtotal = Decimal(str(cart.get_total_price()))
-                    shipping_cost = Decimal('0.00')
-                    
-                    if order.shipping_method == 'standard':
-                        shipping_cost = Decimal('5.00')
-                    elif order.shipping_method == 'express':
-                        shipping_cost = Decimal('15.00')
-                    
-                    tax = (subtotal + shipping_cost) * Decimal('0.10')
-                    
-                    order.subtotal = subtotal
-                    order.shipping_cost = shipping_cost
-                    order.tax = tax
-                    order.total_amount = subtotal + shipping_cost + tax
-
-                    # Generate tracking number
-                    tracking_number = get_random_string(10).upper()
-                    order.tracking_number = tracking_number
-                    order.save()
-
-                    # Step 3: Create order items and update stock
-                    create_order_items(order, cart, products_dict)
-                    
-                    # Step 4: Process payment and update status
-                    process_payment(order)
-                    
-                    # Create initial success status
-                    OrderStatus.objects.create(
-                        order=order,
-                        status='pending',
-                        note='Order placed successfully',
-                        created_by=request.user
-                    )
-
-                    # Process payment
-                    if order.payment_method == 'cash_on_delivery':
-                        new_status = 'confirmed'
-                        payment_status = 'pending'
-                        status_note = 'Order confirmed - Cash on Delivery'
-                    else:
-                        new_status = 'processing'
-                        payment_status = 'completed'
-                        status_note = 'Payment processed successfully'
-
-                    # Update order status
-                    validate_order_status(new_status)
-                    order.status = new_status
-                    order.payment_status = payment_status
-                    order.save()
-
-                    # Create payment status update
-                    OrderStatus.objects.create(
-                        order=order,
-                        status=new_status,
-                        note=status_note,
-                        created_by=request.user
-                    )
-
-                    # Send confirmation email
-                    try:
-                        from .utils import send_order_confirmation_email
-                        email_sent = send_order_confirmation_email(request, order)
-                        if email_sent:
-                            messages.success(
-                                request,
-                                f"Order #{order.id} placed successfully! "
-                                f"Current Status: {order.get_status_display()}. "
-                                f"A confirmation email has been sent to {order.email}"
-                            )
-                        else:
-                            messages.warning(
-                                request,
-                                f"Order #{order.id} placed successfully. "
-                                f"Please save your tracking number: {order.tracking_number}. "
-                                "The confirmation email could not be sent."
-                            )
-                    except Exception:
-                        messages.warning(
-                            request,
-                            f"Order #{order.id} placed successfully. "
-                            f"Please save your tracking number: {order.tracking_number}. "
-                            "The confirmation email could not be sent."
-                        )
-
-                    # Store order details and clear cart
-                    request.session['recent_order_id'] = order.id
-                    request.session['order_tracking_number'] = order.tracking_number
-                    cart.clear()
-                    
-                    return redirect('shop:order_confirmation', order_id=order.id)
+            def notify(order):
+                # Queued in the order's transaction; run_mail_worker sends them
+                send_status_notification(order)
+                order.confirmation_queued = send_order_confirmation_email(request, order)
 
+            try:
+                order = place_order(form, cart, request.user, notify=notify)
             except OrderError as e:
                 # Handle specific order processing errors
                 error_messages = {
@@ -389,6 +296,33 @@ def checkout(request):
                     "Our team has been notified and is working to resolve it. "
                     "Please try again in a few minutes or contact our support if the issue persists."
                 )
+            else:
+                if getattr(order, 'replayed', False):
+                    # Placed by a concurrent submission of this form, which
+                    # sends the emails and clears the cart
+                    return redirect('shop:order_confirmation', order_id=order.id)
+                
+                if order.confirmation_queued:
+                    messages.success(
+                        request,
+                        f"Order #{order.id} placed successfully! "
+                        f"Current Status: {order.get_status_display()}. "
+                        f"A confirmation email is on its way to {order.email}"
+                    )
+                else:
+                    messages.warning(
+                        request,
+                        f"Order #{order.id} placed successfully. "
+                        f"Please save your tracking number: {order.tracking_number}. "
+                        "The confirmation email could not be sent."
+                    )
+
+                # Store order details and clear cart
+                request.session['recent_order_id'] = order.id
+                request.session['order_tracking_number'] = order.tracking_number
+                cart.clear()
+                
+                return redirect('shop:order_confirmation', order_id=order.id)
     else:
         # Pre-fill form with user data if available
         initial_data = {}
@@ -399,6 +333,16 @@ def checkout(request):
         if request.user.email:
             initial_data['email'] = request.user.email
         form = CheckoutForm(initial=initial_data)
+        
+        # Set the cart's stock aside while the customer fills in the form
+        missing = hold_stock(request.user, cart.quantities())
+        for item in cart:
+            if item.product.id in missing:
+                messages.warning(
+                    request,
+                    f"{item.product.name} has only {max(missing[item.product.id], 0)} left; "
+                    "please update your cart before placing the order."
+                )
     
     return render(request, 'shop/checkout.html', {
         'cart': cart,
@@ -437,6 +381,7 @@ def order_detail(request, order_id):
         'status_updates': status_updates
     })
 
+@conditional(order_etag, order_last_modified, private=True)
 def track_order(request):
     # Status weights for progress calculation
     status_weights = {
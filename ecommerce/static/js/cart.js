@@ -0,0 +1,76 @@
+// Update the cart in place through the JSON cart endpoints. Forms and
+// links keep working without JavaScript; with it, they post to the URL in
+// their data-cart-* attribute and only the parts of the page that show
+// the cart are refreshed.
+document.addEventListener('DOMContentLoaded', function() {
+    function csrfToken() {
+        const input = document.querySelector('input[name=csrfmiddlewaretoken]');
+        if (input) return input.value;
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : '';
+    }
+
+    function post(url, body) {
+        return fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken(),
+                'X-Requested-With': 'XMLHttpRequest'
+            },
+            body: JSON.stringify(body)
+        }).then(function(response) {
+            return response.json().then(function(data) {
+                if (!response.ok) throw new Error(data.error || 'Could not update the cart');
+                return data;
+            });
+        });
+    }
+
+    // Show a response: count, subtotal and the changed lines
+    function render(data) {
+        document.querySelectorAll('[data-cart-count]').forEach(function(badge) {
+            badge.textContent = data.count;
+        });
+        document.querySelectorAll('[data-cart-subtotal]').forEach(function(total) {
+            total.textContent = '$' + data.subtotal;
+        });
+        data.lines.forEach(function(line) {
+            document.querySelectorAll('[data-line-total="' + line.product_id + '"]').forEach(function(total) {
+                total.textContent = '$' + line.total_price;
+            });
+        });
+        if (data.removed !== undefined) {
+            const row = document.querySelector('[data-cart-line="' + data.removed + '"]');
+            if (row) row.remove();
+        }
+        if (data.count === 0 && document.querySelector('[data-cart-line]') === null
+                && document.querySelector('[data-cart-page]')) {
+            // Let the server render the empty cart
+            window.location.reload();
+        }
+    }
+
+    function fail(error) {
+        alert(error.message);
+    }
+
+    document.querySelectorAll('form[data-cart-add], form[data-cart-update]').forEach(function(form) {
+        form.addEventListener('submit', function(event) {
+            event.preventDefault();
+            const url = form.dataset.cartAdd || form.dataset.cartUpdate;
+            post(url, {
+                product_id: Number(form.dataset.productId),
+                quantity: Number(form.querySelector('[name=quantity]').value)
+            }).then(render).catch(fail);
+        });
+    });
+
+    document.querySelectorAll('a[data-cart-remove]').forEach(function(link) {
+        link.addEventListener('click', function(event) {
+            event.preventDefault();
+            post(link.dataset.cartRemove, {product_id: Number(link.dataset.productId)})
+                .then(render).catch(fail);
+        });
+    });
+});